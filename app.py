@@ -1,14 +1,20 @@
 import streamlit as st
+from concurrent.futures import TimeoutError as FutureTimeout
 from src.init_db import init_db
-from src.memory import update_summary
-from src.config import NAMESPACE, CHUNK_CHARS, CHUNK_OVERLAP_CHARS
+from src import aio
+from src.memory import aupdate_summary
+from src.config import NAMESPACE, CHUNK_CHARS, CHUNK_OVERLAP_CHARS, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
 from src.youtube_ids import extract_video_ids
-from src.transcripts import load_or_fetch_transcript
-from src.chunking import chunk_transcript
-from src.ingest import ingest_video
-from src.retrieve import answer_question
+from src.pipeline import IngestionPipeline
+from src.retrieve import answer_question_stream
+from src.registry import registry_stats
+from src.cache import cache_stats
+from src.rewrite import rewrite_stats
+from src.semantic_cache import semantic_cache_stats
+from src.metrics import serve_metrics, summary as metrics_summary
 
 init_db()
+serve_metrics()  # no-op unless METRICS_PORT is set; idempotent across reruns
 
 st.set_page_config(page_title="YouTube RAG (Prod-style)", layout="wide")
 st.title("YouTube Chatbot")
@@ -21,6 +27,8 @@ with st.sidebar:
     st.subheader("Chunking")
     chunk_chars = st.slider("Chunk chars", 400, 1800, CHUNK_CHARS, 50)
     overlap_chars = st.slider("Overlap chars", 0, 500, CHUNK_OVERLAP_CHARS, 10)
+    chunk_tokens = st.number_input("Chunk tokens (0 = use chunk chars)", 0, 1000, CHUNK_TOKENS, 10)
+    overlap_tokens = st.number_input("Overlap tokens", 0, 200, CHUNK_OVERLAP_TOKENS, 5)
 
 st.write("Paste a video URL, multiple URLs (one per line), or a playlist URL.")
 input_text = st.text_area("Input", height=120)
@@ -37,22 +45,32 @@ if c1.button("Build / Update Index"):
 
     total_new = 0
     skipped = 0
-
-    for vid in video_ids:
-        with st.spinner(f"Ingesting {vid} ..."):
-            try:
-                items = load_or_fetch_transcript(vid)   # may raise
-            except Exception as e:
-                st.warning(f"Skipping {vid}: {e}")
-                continue
-
-            chunks = chunk_transcript(items, chunk_chars=chunk_chars, overlap_chars=overlap_chars)
-            stats = ingest_video(video_id=vid, title=f"YouTube {vid}", chunks=chunks, namespace=namespace, force=force)
-            if stats.get("skipped"):
-                skipped += 1
-            total_new += int(stats.get("new_chunks", 0))
-
+    finished = 0
+    progress = st.progress(0.0)
+    status = st.empty()
+
+    pipeline = IngestionPipeline(
+        namespace=namespace, chunk_chars=chunk_chars, overlap_chars=overlap_chars,
+        chunk_tokens=int(chunk_tokens), overlap_tokens=int(overlap_tokens), force=force,
+    )
+    for ev in pipeline.run(video_ids):
+        if not ev.finished:
+            status.caption(f"{ev.video_id}: {ev.stage} ...")
+            continue
+
+        finished += 1
+        progress.progress(finished / max(1, len(set(video_ids))))
+        if ev.stage == "failed":
+            st.warning(f"Skipping {ev.video_id}: {ev.error}")
+        elif ev.stage == "skipped":
+            skipped += 1
+        total_new += ev.new_chunks
+
+    status.empty()
     st.success(f"Done. New chunks: {total_new}. Skipped videos: {skipped}.")
+    emb = pipeline.batcher.throughput()
+    if emb["chunks"]:
+        st.caption(f"Embedding: {emb['chunks_per_s']:.1f} chunks/s, {emb['tokens_per_s']:.0f} tokens/s ({emb['requests']} requests)")
 
 
 st.divider()
@@ -62,6 +80,24 @@ if "messages" not in st.session_state:
     st.session_state.messages = []  # [{"role":"user"|"assistant", "content": "..."}]
 if "summary" not in st.session_state:
     st.session_state.summary = ""
+if "summary_future" not in st.session_state:
+    st.session_state.summary_future = None  # background summary update from the previous turn
+
+def _collect_summary(wait_s: float) -> None:
+    """Adopt the background summary update once it is done (waiting up to wait_s)."""
+    fut = st.session_state.summary_future
+    if fut is None:
+        return
+    try:
+        st.session_state.summary = fut.result(timeout=wait_s)
+    except FutureTimeout:
+        return
+    except Exception:
+        # If summarization fails, do not break chat
+        pass
+    st.session_state.summary_future = None
+
+_collect_summary(wait_s=0)
 
 # Render chat history
 for m in st.session_state.messages:
@@ -74,42 +110,60 @@ if user_text:
     st.session_state.messages.append({"role": "user", "content": user_text})
     st.chat_message("user").write(user_text)
 
+    # the rewrite needs the summary that includes the previous turn
+    _collect_summary(wait_s=15)
+
     # recent turns for retrieval (last 6 messages)
     recent_turns = st.session_state.messages[-6:]
 
-    with st.spinner("Retrieving + reranking + generating..."):
-        out = answer_question(
-            user_text,
-            namespace=namespace,
-            summary=st.session_state.summary,
-            recent_turns=recent_turns
-        )
-
-    # append assistant message
-    st.session_state.messages.append({"role": "assistant", "content": out["answer"]})
-    st.chat_message("assistant").write(out["answer"])
-
-    with st.expander("Sources"):
-        for s in out["sources"]:
-            st.markdown(f"- [{s['title']} | {s['video_id']} @ {s['start']}s]({s['url']})")
-
-    with st.expander("Latency + Cache"):
-        st.write(out["timings"])
-        st.write(out["cache"])
-
-    # Update summary using only the last user+assistant turn (fast + stable)
+    events = answer_question_stream(
+        user_text,
+        namespace=namespace,
+        summary=st.session_state.summary,
+        recent_turns=recent_turns,
+        last_rewritten=st.session_state.get("last_rewritten"),
+    )
+    def _tokens():
+        for ev in events:
+            if ev["type"] == "token":
+                yield ev["text"]
+            elif ev["type"] == "done":
+                out.update(ev)
+
+    out: dict = {}
     try:
-        st.session_state.summary = update_summary(
+        with st.spinner("Retrieving + reranking..."):
+            out = next(events)  # meta: sources + retrieval timings, before any token
+        # stream the answer as it is generated
+        st.chat_message("assistant").write_stream(_tokens())
+    except Exception as e:
+        st.error(f"Answer failed: {e}")
+
+    # a failed or cut-off answer stays out of the history and the summary
+    if "answer" in out:
+        st.session_state.messages.append({"role": "assistant", "content": out["answer"]})
+        st.session_state.last_rewritten = out["rewritten_query"]
+
+        with st.expander("Sources"):
+            for s in out["sources"]:
+                st.markdown(f"- [{s['title']} | {s['video_id']} @ {s['start']}s]({s['url']})")
+
+        with st.expander("Latency + Cache"):
+            st.write(out["timings"])
+            st.write(out["cache"])
+            st.write({"registry": registry_stats(), "rewrite": rewrite_stats(), "semantic": semantic_cache_stats(), **cache_stats()})
+            st.dataframe(metrics_summary(), hide_index=True)
+
+        # Update summary using only the last user+assistant turn (fast + stable), in the
+        # background: the answer is already shown, and the next turn picks the result up
+        st.session_state.summary_future = aio.submit(aupdate_summary(
             st.session_state.summary,
             new_messages=[
                 {"role": "user", "content": user_text},
                 {"role": "assistant", "content": out["answer"]},
             ],
             max_chars=1500
-        )
-    except Exception:
-        # If summarization fails, do not break chat
-        pass
+        ))
 
 with st.sidebar:
     st.subheader("Memory")
@@ -119,4 +173,6 @@ with st.sidebar:
     if st.button("Reset chat"):
         st.session_state.messages = []
         st.session_state.summary = ""
+        st.session_state.summary_future = None
+        st.session_state.last_rewritten = None
         st.rerun()
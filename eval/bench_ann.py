@@ -0,0 +1,80 @@
+"""
+Benchmark local vector search: exact brute force vs. the HNSW graph (src/ann.py).
+
+Uses synthetic clustered, L2-normalized vectors (roughly what transcript
+chunk embeddings look like: many near-duplicates per video). Reports graph
+build time, recall@k against exact search, and p50/p95 query latency for
+several ef values, unfiltered and with a video filter covering ~20% of rows.
+
+    python -m eval.bench_ann --rows 50000 --dim 256 --ef 256 384 512
+"""
+
+import argparse
+import time
+import numpy as np
+from src.ann import HNSWIndex
+from src.config import FETCH_K, ANN_M, ANN_EF_CONSTRUCTION
+
+def _synthetic(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    X = centers[rng.integers(0, clusters, rows)] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X
+
+def _exact(X: np.ndarray, q: np.ndarray, k: int, mask) -> np.ndarray:
+    """Same shape as the store's exact path: no row gather when unfiltered."""
+    if mask is None:
+        scores = X @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+    rows = np.flatnonzero(mask)
+    scores = X[rows] @ q
+    top = np.argpartition(-scores, k - 1)[:k]
+    return rows[top[np.argsort(-scores[top])]]
+
+def _pct(xs: list[float], p: float) -> float:
+    return float(np.percentile(xs, p)) * 1000
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--clusters", type=int, default=200, help="synthetic 'videos'")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=FETCH_K)
+    ap.add_argument("--ef", type=int, nargs="+", default=[256, 384, 512])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    X = _synthetic(args.rows, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    Q = X[rng.integers(0, args.rows, args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    filtered = rng.random(args.rows) < 0.2
+
+    t = time.perf_counter()
+    index = HNSWIndex(M=ANN_M, ef_construction=ANN_EF_CONSTRUCTION)
+    index.add(X, range(args.rows))
+    print(f"rows={args.rows} dim={args.dim} k={args.k}  HNSW build {time.perf_counter() - t:.1f}s")
+
+    print(f"{'filter':>8} {'method':>12} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, mask in (("none", None), ("20%", filtered)):
+        truth, lat = [], []
+        for q in Q:
+            t = time.perf_counter()
+            truth.append(set(_exact(X, q, args.k, mask).tolist()))
+            lat.append(time.perf_counter() - t)
+        print(f"{name:>8} {'exact':>12} {1.0:>8.3f} {_pct(lat, 50):>8.2f} {_pct(lat, 95):>8.2f}")
+
+        for ef in args.ef:
+            recall, lat = [], []
+            for q, exp in zip(Q, truth):
+                t = time.perf_counter()
+                rows, _ = index.search(X, q, args.k, ef=ef, valid=mask)
+                lat.append(time.perf_counter() - t)
+                recall.append(len(exp & set(rows.tolist())) / len(exp))
+            print(f"{name:>8} {f'hnsw ef={ef}':>12} {np.mean(recall):>8.3f} {_pct(lat, 50):>8.2f} {_pct(lat, 95):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark chunk insertion: legacy per-row ORM loop vs. bulk INSERT ... ON CONFLICT.
+
+Runs against DATABASE_URL using synthetic video ids (bench-*), which are deleted afterwards.
+Each size is measured twice per path: a cold insert (all rows new) and a warm
+re-insert (all rows already present), which is what re-ingests look like.
+
+    python -m eval.bench_chunk_insert --sizes 1000 10000 100000
+"""
+
+import argparse
+import time
+from sqlalchemy import delete
+from src.chunking import ChunkObj
+from src.db import SessionLocal
+from src.init_db import init_db
+from src.ingest import stable_chunk_id, insert_video_chunks
+from src.models import Video, Chunk
+
+def _synthetic_chunks(n: int) -> list[ChunkObj]:
+    return [ChunkObj(text=f"synthetic chunk {i} " + "lorem ipsum " * 60, start=i * 30, end=i * 30 + 30) for i in range(n)]
+
+def _orm_loop(video_id: str, chunks: list[ChunkObj]) -> int:
+    """The pre-bulk implementation: one SELECT per chunk, then ORM adds."""
+    db = SessionLocal()
+    new = 0
+    try:
+        if not db.get(Video, video_id):
+            db.add(Video(id=video_id, title=video_id))
+        for c in chunks:
+            cid = stable_chunk_id(video_id, int(c.start), int(c.end), c.text)
+            if db.get(Chunk, cid) is not None:
+                continue
+            db.add(Chunk(id=cid, video_id=video_id, start=int(c.start), end=int(c.end), text=c.text))
+            new += 1
+        db.commit()
+        return new
+    finally:
+        db.close()
+
+def _bulk(video_id: str, chunks: list[ChunkObj]) -> int:
+    _, new, _ = insert_video_chunks(video_id, video_id, chunks)
+    return new
+
+def _cleanup(video_id: str) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(delete(Chunk).where(Chunk.video_id == video_id))
+        db.execute(delete(Video).where(Video.id == video_id))
+        db.commit()
+    finally:
+        db.close()
+
+def _timed(fn, *args) -> tuple[float, int]:
+    t = time.perf_counter()
+    n = fn(*args)
+    return (time.perf_counter() - t) * 1000, n
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = ap.parse_args()
+
+    init_db()
+    print(f"{'rows':>8} {'path':>5} {'cold ms':>10} {'rows/s':>10} {'warm ms':>10}")
+    for n in args.sizes:
+        chunks = _synthetic_chunks(n)
+        for name, fn in (("orm", _orm_loop), ("bulk", _bulk)):
+            vid = f"bench-{name}-{n}"
+            _cleanup(vid)
+            try:
+                cold_ms, inserted = _timed(fn, vid, chunks)
+                warm_ms, reinserted = _timed(fn, vid, chunks)
+                assert inserted == n and reinserted == 0, (inserted, reinserted)
+                print(f"{n:>8} {name:>5} {cold_ms:>10.0f} {n / (cold_ms / 1000):>10.0f} {warm_ms:>10.0f}")
+            finally:
+                _cleanup(vid)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark transcript chunking on the largest transcripts in data/transcripts:
+the content-defined chunker (src/chunking.py) vs. the previous fixed-length
+chunker with a raw character-tail overlap.
+
+Per transcript: chunk count and size, time per pass, peak memory when the
+chunks are consumed as a stream, and id churn, i.e. the share of chunk ids
+(src.ingest.stable_chunk_id) that are new after a small change, which is
+what a re-ingest has to re-embed:
+- append: the last 10% of segments arrive later
+- edit:   one word changed in a segment in the middle
+- insert: one segment inserted at 10%
+- delete: the segment at 10% removed
+
+    python -m eval.bench_chunking --top 3
+"""
+
+import json
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+from src.chunking import ChunkObj, iter_chunks, chunk_transcript
+from src.config import CHUNK_CHARS, CHUNK_OVERLAP_CHARS
+from src.ingest import stable_chunk_id
+
+TRANSCRIPTS = Path("data/transcripts")
+
+def _legacy(items: list[dict], chunk_chars: int, overlap_chars: int) -> list[ChunkObj]:
+    """The previous implementation: cut at chunk_chars, overlap = last overlap_chars characters."""
+    chunks: list[ChunkObj] = []
+    buf: list[str] = []
+    buf_len = 0
+    buf_start = buf_end = None
+    for seg in items:
+        t = (seg.get("text") or "").strip()
+        if not t:
+            continue
+        s = float(seg.get("start", 0.0))
+        if buf_start is None:
+            buf_start = s
+        buf_end = s + float(seg.get("duration", 0.0))
+        buf.append(t)
+        buf_len += len(t) + 1
+        if buf_len >= chunk_chars:
+            text = " ".join(buf).strip()
+            chunks.append(ChunkObj(text=text, start=int(buf_start), end=int(buf_end)))
+            if overlap_chars > 0 and len(text) > overlap_chars:
+                buf, buf_len = [text[-overlap_chars:]], overlap_chars
+                buf_start = buf_end = chunks[-1].end
+            else:
+                buf, buf_len, buf_start, buf_end = [], 0, None, None
+    if buf:
+        chunks.append(ChunkObj(text=" ".join(buf).strip(), start=int(buf_start or 0), end=int(buf_end or buf_start or 0)))
+    return chunks
+
+def _ids(video_id: str, chunks: list[ChunkObj]) -> set[str]:
+    return {stable_chunk_id(video_id, c.start, c.end, c.text) for c in chunks}
+
+def _variants(items: list[dict]) -> dict[str, tuple[list[dict], list[dict]]]:
+    """(before, after) transcripts per change scenario."""
+    n = len(items)
+    mid, early = n // 2, n // 10
+    edited = [dict(s) for s in items]
+    words = edited[mid]["text"].split()
+    edited[mid]["text"] = " ".join(words[:-1] + ["CHANGED"]) if words else "CHANGED"
+    extra = {"text": "an inserted caption line", "start": items[early]["start"], "duration": 0.5}
+    return {
+        "append": (items[: n - n // 10], items),
+        "edit": (items, edited),
+        "insert": (items, items[:early] + [extra] + items[early:]),
+        "delete": (items, items[:early] + items[early + 1:]),
+    }
+
+def _churn(chunker, video_id: str, before: list[dict], after: list[dict]) -> float:
+    old = _ids(video_id, chunker(before, CHUNK_CHARS, CHUNK_OVERLAP_CHARS))
+    new = _ids(video_id, chunker(after, CHUNK_CHARS, CHUNK_OVERLAP_CHARS))
+    return len(new - old) / max(1, len(new))
+
+def _time_ms(chunker, items: list[dict], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        chunker(items, CHUNK_CHARS, CHUNK_OVERLAP_CHARS)
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+def _stream_peak_kb(items: list[dict]) -> float:
+    tracemalloc.start()
+    for _ in iter_chunks(iter(items), CHUNK_CHARS, CHUNK_OVERLAP_CHARS):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top", type=int, default=3, help="largest transcripts to use")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    paths = sorted(TRANSCRIPTS.glob("*.json"), key=lambda p: p.stat().st_size, reverse=True)[:args.top]
+    chunkers = {"legacy": _legacy, "cdc": chunk_transcript}
+    print(f"chunk_chars={CHUNK_CHARS} overlap_chars={CHUNK_OVERLAP_CHARS}")
+    print(f"{'video':>12} {'chunker':>7} {'segs':>6} {'chunks':>6} {'mean ch':>8} {'max ch':>7} {'ms':>7} "
+          f"{'peak KB':>8} {'append':>7} {'edit':>6} {'insert':>7} {'delete':>7}")
+    for path in paths:
+        items = json.loads(path.read_text(encoding="utf-8"))
+        variants = _variants(items)
+        for name, chunker in chunkers.items():
+            chunks = chunker(items, CHUNK_CHARS, CHUNK_OVERLAP_CHARS)
+            sizes = [len(c.text) for c in chunks]
+            peak = f"{_stream_peak_kb(items):8.1f}" if name == "cdc" else f"{'-':>8}"
+            churn = [_churn(chunker, path.stem, b, a) for b, a in variants.values()]
+            print(f"{path.stem:>12} {name:>7} {len(items):>6} {len(chunks):>6} {sum(sizes) / len(sizes):8.0f} {max(sizes):>7} "
+                  f"{_time_ms(chunker, items, args.repeat):7.2f} {peak} " + " ".join(f"{c:7.1%}" for c in churn))
+
+if __name__ == "__main__":
+    main()
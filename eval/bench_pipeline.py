@@ -0,0 +1,426 @@
+"""
+Offline, replayable benchmark of the answer pipeline (src/retrieve.answer_question).
+
+Every external service is replaced by a deterministic local stand-in, so the
+numbers measure our own code (caching, hydration, fusion, rerank, prompt
+assembly) without network jitter:
+
+- embeddings: feature-hashed bag of words (similar texts get similar vectors)
+- chat model: echoes the question plus the start of the context, word by word
+- vector store: LocalStore in a temp dir, with injected query / fetch latency
+- Redis: fakeredis (sync and asyncio clients on one shared server)
+- tokenizer: words and punctuation instead of tiktoken (no encoding download)
+- DB: SQLite fixture built from data/transcripts/*.json through the normal
+  chunk / insert / upsert code (BENCH_DATABASE_URL points it at Postgres instead)
+
+Stand-ins sleep a fixed latency per call (--latency), so wall times keep a
+realistic shape while CPU time and allocations only count our code. Questions
+are data/eval/testset.json plus --synthetic ones drawn (seeded) from the
+fixture, every third one a follow-up with chat history.
+
+Each run does a cold pass (caches flushed) and a warm pass (same questions
+again) at --concurrency threads, then repeats both single-threaded under
+tracemalloc for allocations. Per stage (metrics.span): calls, wall p50/p95,
+CPU p50 (thread time), mean peak KB allocated above entry; per pass: questions/s.
+
+    python -m eval.bench_pipeline --save-baseline eval/bench_baseline.json
+    python -m eval.bench_pipeline --baseline eval/bench_baseline.json --tolerance 0.25
+
+exits 1 when a stage's CPU p50 or allocations, or a pass's throughput, is worse
+than the baseline by more than --tolerance. Baselines are machine-specific.
+Needs the dev requirements (pip install -r requirements-dev.txt).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# stand-in configuration, must be in place before src.config is imported
+_WORK = Path(tempfile.mkdtemp(prefix="bench-pipeline-"))
+os.environ.update({
+    "DATABASE_URL": os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{_WORK / 'bench.db'}",
+    "VECTOR_BACKEND": "local",
+    "LOCAL_VECTOR_DIR": str(_WORK / "vectors"),
+    "BM25_DIR": str(_WORK / "bm25"),
+    "REDIS_URL": "redis://bench",  # never dialed: clients resolve to fakeredis below
+    "OPENAI_API_KEY": "bench",
+    "METRICS_PORT": "0",
+})
+# repeated synthetic questions would mostly measure the answer cache
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+
+import fakeredis
+import fakeredis.aioredis
+from langchain_core.messages import AIMessage, AIMessageChunk
+from src import clients, tokens
+from src.bm25 import tokenize
+
+TRANSCRIPTS = Path("data/transcripts")
+TESTSET = Path("data/eval/testset.json")
+NAMESPACE = "bench"
+DIM = 256
+
+# seconds per call, set from --latency
+LATENCY = {"embed": 0.03, "chat": 0.25, "token": 0.002, "vector": 0.02, "fetch": 0.01}
+
+# =========================
+# Stand-ins
+# =========================
+
+def _hash_vec(text: str) -> list[float]:
+    v = np.zeros(DIM, dtype=np.float32)
+    for tok in tokenize(text):
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % DIM] += 1.0 if (h >> 32) & 1 else -1.0
+    return (v / (np.linalg.norm(v) or 1.0)).tolist()
+
+class HashEmbeddings:
+    def __init__(self, *key):
+        pass
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(LATENCY["embed"])
+        return _hash_vec(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(LATENCY["embed"])
+        return [_hash_vec(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(LATENCY["embed"])
+        return _hash_vec(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(LATENCY["embed"])
+        return [_hash_vec(t) for t in texts]
+
+_QUESTION = re.compile(r"[Qq]uestion:\s*(.+?)(?:\n\s*\n|$)", re.S)
+
+class EchoChat:
+    """Replies with the question (rewrite) or the question plus the first context words (answer)."""
+
+    answer_words = 80
+
+    def __init__(self, *key):
+        pass
+
+    @staticmethod
+    def _text(prompt) -> str:
+        if isinstance(prompt, str):
+            return prompt
+        return "\n\n".join(str(m.content) for m in prompt)
+
+    def _reply(self, prompt) -> tuple[str, dict]:
+        text = self._text(prompt)
+        found = _QUESTION.findall(text)
+        reply = found[-1].strip() if found else " ".join(text.split()[-20:])
+        if "Context:" in text:
+            reply += " " + " ".join(text.split("Context:", 1)[1].split()[:self.answer_words])
+        n_in, n_out = len(text) // 4, len(reply) // 4
+        return reply, {"input_tokens": n_in, "output_tokens": n_out, "total_tokens": n_in + n_out}
+
+    def invoke(self, prompt) -> AIMessage:
+        reply, usage = self._reply(prompt)
+        time.sleep(LATENCY["chat"] + LATENCY["token"] * len(reply.split()))
+        return AIMessage(content=reply, usage_metadata=usage)
+
+    def stream(self, prompt):
+        reply, usage = self._reply(prompt)
+        time.sleep(LATENCY["chat"])
+        for word in reply.split():
+            time.sleep(LATENCY["token"])
+            yield AIMessageChunk(content=word + " ")
+        yield AIMessageChunk(content="", usage_metadata=usage)
+
+    async def ainvoke(self, prompt) -> AIMessage:
+        reply, usage = self._reply(prompt)
+        await asyncio.sleep(LATENCY["chat"] + LATENCY["token"] * len(reply.split()))
+        return AIMessage(content=reply, usage_metadata=usage)
+
+    async def astream(self, prompt):
+        reply, usage = self._reply(prompt)
+        await asyncio.sleep(LATENCY["chat"])
+        for word in reply.split():
+            await asyncio.sleep(LATENCY["token"])
+            yield AIMessageChunk(content=word + " ")
+        yield AIMessageChunk(content="", usage_metadata=usage)
+
+class SlowStore:
+    """Vector store wrapper adding the injected query / fetch latency."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def query(self, *args, **kwargs):
+        time.sleep(LATENCY["vector"])
+        return self.inner.query(*args, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        time.sleep(LATENCY["fetch"])
+        return self.inner.fetch(*args, **kwargs)
+
+class WordEncoder:
+    """tiktoken stand-in (words and punctuation), so the bench never downloads an encoding."""
+
+    _TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def encode(self, text: str, disallowed_special=()) -> list[str]:
+        return self._TOKEN.findall(text)
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+_REDIS = fakeredis.FakeServer()
+_STANDINS = {
+    "chat": EchoChat,
+    "embed": HashEmbeddings,
+    "redis": lambda binary: fakeredis.FakeRedis(server=_REDIS, decode_responses=not binary),
+}
+_ASYNC_STANDINS = {
+    **_STANDINS,
+    "redis": lambda binary: fakeredis.aioredis.FakeRedis(server=_REDIS, decode_responses=not binary),
+}
+
+def _standin(table: dict, create):
+    """Wraps a client cache of src.clients so the kinds in table get built from stand-ins."""
+    def wrapped(key: tuple, factory):
+        fake = table.get(key[0])
+        return create(key, (lambda: fake(*key[1:])) if fake else factory)
+    return wrapped
+
+# monkeypatched module globals, looked up on every client call
+clients._get_or_create = _standin(_STANDINS, clients._get_or_create)
+clients.loop_local = _standin(_ASYNC_STANDINS, clients.loop_local)
+_ENCODER = WordEncoder()
+tokens.encoder = lambda model=None: _ENCODER
+
+# src.cache binds its Redis clients at import, so these come after the patches
+from src import context, metrics, semantic_cache
+from src.cache import clear_l1
+from src.chunking import chunk_transcript
+from src.config import CHUNK_CHARS, CHUNK_OVERLAP_CHARS, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from src.init_db import init_db
+from src.ingest import insert_video_chunks, upsert_chunks
+from src.retrieve import answer_question
+from src.vector_store import LocalStore, set_store
+
+context.encoder = tokens.encoder  # bound by name at import
+
+# =========================
+# Fixture + questions
+# =========================
+
+def build_fixture(max_videos: int) -> list[dict]:
+    """Chunks, stores and indexes up to max_videos transcripts; returns the chunk rows."""
+    init_db()
+    set_store(SlowStore(LocalStore()))
+    all_rows = []
+    for path in sorted(TRANSCRIPTS.glob("*.json"))[:max_videos]:
+        items = json.loads(path.read_text(encoding="utf-8"))
+        chunks = chunk_transcript(items, CHUNK_CHARS, CHUNK_OVERLAP_CHARS, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+        rows, _, _ = insert_video_chunks(path.stem, path.stem, chunks)
+        if rows:
+            upsert_chunks(rows, [_hash_vec(r["text"]) for r in rows], NAMESPACE)
+        all_rows.extend(rows)
+    return all_rows
+
+def build_questions(rows: list[dict], synthetic: int, seed: int) -> list[dict]:
+    questions = [{"question": q["question"]} for q in json.loads(TESTSET.read_text(encoding="utf-8"))]
+    rng = random.Random(seed)
+    prev = None
+    for i in range(synthetic):
+        words = [w for w in tokenize(rng.choice(rows)["text"]) if len(w) > 3]
+        if len(words) < 3:
+            continue
+        start = rng.randrange(len(words) - 2)
+        phrase = " ".join(words[start:start + 3])
+        if prev and i % 3 == 2:
+            turns = [{"role": "user", "content": prev}, {"role": "assistant", "content": f"They talk about {phrase}."}]
+            questions.append({"question": "Can you explain more about that?", "recent_turns": turns})
+        else:
+            prev = f"What does the speaker say about {phrase}?"
+            questions.append({"question": prev})
+    return questions
+
+# =========================
+# Profiling
+# =========================
+
+class StageProfiler:
+    """metrics span hook: per-stage wall, thread CPU time and (under tracemalloc) allocations."""
+
+    def __init__(self):
+        self.rows: dict[str, dict[str, list]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def span_enter(self, sp) -> None:
+        stack = self._local.__dict__.setdefault("stack", [])
+        mem = 0
+        if tracemalloc.is_tracing():
+            mem = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        stack.append((time.thread_time(), mem))
+
+    def span_exit(self, sp) -> None:
+        cpu0, mem0 = self._local.stack.pop()
+        cpu_ms = (time.thread_time() - cpu0) * 1000
+        # peak memory above the level at entry; only meaningful single-threaded
+        alloc = tracemalloc.get_traced_memory()[1] - mem0 if tracemalloc.is_tracing() else None
+        with self._lock:
+            row = self.rows.setdefault(sp.stage, {"wall": [], "cpu": [], "alloc": []})
+            row["wall"].append(sp.elapsed_ms())
+            row["cpu"].append(cpu_ms)
+            if alloc is not None:
+                row["alloc"].append(alloc)
+
+def _flush_caches() -> None:
+    fakeredis.FakeRedis(server=_REDIS).flushall()
+    clear_l1()
+    semantic_cache.clear()
+
+def _ask(q: dict) -> None:
+    answer_question(q["question"], NAMESPACE, recent_turns=q.get("recent_turns"))
+
+def run_pass(questions: list[dict], concurrency: int, cold: bool, trace_alloc: bool) -> tuple[StageProfiler, float]:
+    if cold:
+        _flush_caches()
+    prof = StageProfiler()
+    metrics.add_span_hook(prof)
+    if trace_alloc:
+        tracemalloc.start()
+    try:
+        t = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(_ask, questions))
+        wall_s = time.perf_counter() - t
+    finally:
+        if trace_alloc:
+            tracemalloc.stop()
+        metrics.remove_span_hook(prof)
+    return prof, wall_s
+
+def _p(xs: list[float], q: float) -> float:
+    return float(np.percentile(xs, q)) if xs else 0.0
+
+def profile(questions: list[dict], concurrency: int, alloc: bool) -> dict:
+    result = {}
+    timed = {"cold": run_pass(questions, concurrency, cold=True, trace_alloc=False)}
+    timed["warm"] = run_pass(questions, concurrency, cold=False, trace_alloc=False)
+    allocs = {}
+    if alloc:
+        allocs["cold"] = run_pass(questions, 1, cold=True, trace_alloc=True)[0]
+        allocs["warm"] = run_pass(questions, 1, cold=False, trace_alloc=True)[0]
+
+    for phase, (prof, wall_s) in timed.items():
+        stages = {}
+        for stage, row in sorted(prof.rows.items()):
+            alloc_row = allocs[phase].rows.get(stage, {}).get("alloc", []) if phase in allocs else []
+            stages[stage] = {
+                "calls": len(row["wall"]),
+                "wall_p50_ms": _p(row["wall"], 50),
+                "wall_p95_ms": _p(row["wall"], 95),
+                "cpu_p50_ms": _p(row["cpu"], 50),
+                "alloc_kb": float(np.mean(alloc_row)) / 1024 if alloc_row else None,
+            }
+        result[phase] = {"questions": len(questions), "wall_s": wall_s, "qps": len(questions) / wall_s, "stages": stages}
+    return result
+
+# =========================
+# Baseline
+# =========================
+
+# below these, differences are timer / allocator noise
+_FLOORS = {"cpu_p50_ms": 0.05, "alloc_kb": 16.0}
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    failures = []
+    for phase, base in baseline.get("result", {}).items():
+        cur = result.get(phase)
+        if cur is None:
+            continue
+        if cur["qps"] < base["qps"] * (1 - tolerance):
+            failures.append(f"{phase}: qps {cur['qps']:.2f} < baseline {base['qps']:.2f}")
+        for stage, b in base["stages"].items():
+            c = cur["stages"].get(stage)
+            if c is None:
+                continue
+            for metric, floor in _FLOORS.items():
+                if b.get(metric) is None or c.get(metric) is None:
+                    continue
+                if c[metric] > max(b[metric], floor) * (1 + tolerance):
+                    failures.append(f"{phase}/{stage}: {metric} {c[metric]:.3f} > baseline {b[metric]:.3f}")
+    return failures
+
+def _print(result: dict) -> None:
+    for phase, r in result.items():
+        print(f"\n{phase}: {r['questions']} questions in {r['wall_s']:.2f}s  ({r['qps']:.2f} q/s)")
+        print(f"{'stage':>10} {'calls':>6} {'wall p50':>9} {'wall p95':>9} {'cpu p50':>8} {'alloc KB':>9}")
+        for stage, s in r["stages"].items():
+            alloc = f"{s['alloc_kb']:9.1f}" if s["alloc_kb"] is not None else f"{'-':>9}"
+            print(f"{stage:>10} {s['calls']:>6} {s['wall_p50_ms']:9.2f} {s['wall_p95_ms']:9.2f} {s['cpu_p50_ms']:8.3f} {alloc}")
+
+def parse_latency(spec: str) -> dict[str, float]:
+    out = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, ms = part.partition("=")
+        if name not in LATENCY:
+            raise SystemExit(f"--latency: unknown stage {name!r} (known: {', '.join(LATENCY)})")
+        out[name] = float(ms) / 1000
+    return out
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, default=20, help="transcripts loaded into the fixture")
+    ap.add_argument("--synthetic", type=int, default=40, help="synthetic questions added to the testset")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--latency", default="", help="injected ms per call, e.g. embed=30,chat=250,token=2,vector=20,fetch=10")
+    ap.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc passes")
+    ap.add_argument("--baseline", help="compare against this baseline JSON; exit 1 on regression")
+    ap.add_argument("--save-baseline", help="write this run as a baseline JSON")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    LATENCY.update(parse_latency(args.latency))
+
+    t = time.perf_counter()
+    rows = build_fixture(args.videos)
+    questions = build_questions(rows, args.synthetic, args.seed)
+    print(f"fixture: {args.videos} videos, {len(rows)} chunks in {time.perf_counter() - t:.1f}s  "
+          f"questions={len(questions)} concurrency={args.concurrency} latency_ms="
+          + ",".join(f"{k}={v * 1000:g}" for k, v in LATENCY.items()))
+
+    result = profile(questions, args.concurrency, alloc=not args.no_alloc)
+    _print(result)
+
+    run = {"args": vars(args), "latency_ms": {k: v * 1000 for k, v in LATENCY.items()}, "result": result}
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(run, indent=2), encoding="utf-8")
+        print(f"\nbaseline written to {args.save_baseline}")
+    if args.baseline:
+        failures = compare(result, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        if failures:
+            print(f"\nREGRESSION (tolerance {args.tolerance:.0%}):")
+            for f in failures:
+                print(f"  {f}")
+            sys.exit(1)
+        print(f"\nno regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Load test: many concurrent synthetic chat sessions through the same calls the
+app makes per turn (answer_question or answer_question_stream, then
+update_summary), with follow-ups that go through the query rewrite.
+
+Arrival models:
+- closed: --sessions users, each runs a conversation of --turns turns with
+  exponential think time (--think-ms) between turns, then starts the next one
+- open: new conversations arrive as a Poisson process at --rate per second no
+  matter how many are still running (at most --max-inflight; beyond that they
+  are dropped and counted), so queueing delay shows up in turn latency
+
+Reports turns/s, client-side turn latency and per-stage percentiles (from the
+returned timings), errors by type, dropped arrivals and the peak number of
+checked-out SQLAlchemy connections. --sweep runs one level per value (sessions
+or rate) and points at the level where throughput stops scaling, errors appear
+or p95 turn latency doubles.
+
+--stub swaps every external service for the offline stand-ins of
+eval/bench_pipeline.py (fixture built from data/transcripts), so the tool runs
+without OpenAI, Pinecone, Postgres or Redis.
+
+    python -m eval.load_test --stub --model closed --sessions 16 --duration 30
+    python -m eval.load_test --stub --model open --rate 2 --duration 30
+    python -m eval.load_test --stub --model closed --sweep 1 2 4 8 16 32
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+TESTSET = Path("data/eval/testset.json")
+FOLLOW_UPS = [
+    "Can you explain more about that?",
+    "Why does that matter?",
+    "What did they say after that?",
+    "Can you give an example of it?",
+]
+
+def _pipeline(stub: bool, videos: int) -> SimpleNamespace:
+    """Entry points the sessions call; with stub the stand-ins must be installed before src is imported."""
+    if stub:
+        from eval import bench_pipeline
+        bench_pipeline.build_fixture(videos)
+        namespace = bench_pipeline.NAMESPACE
+    else:
+        from src.config import NAMESPACE as namespace
+    from src.db import engine
+    from src.memory import update_summary
+    from src.retrieve import answer_question, answer_question_stream
+    return SimpleNamespace(namespace=namespace, engine=engine, update_summary=update_summary,
+                           answer_question=answer_question, answer_question_stream=answer_question_stream)
+
+def _openers(n: int, seed: int) -> list[str]:
+    """Testset questions plus n drawn from stored chunk text."""
+    from sqlalchemy import select
+    from src.bm25 import tokenize
+    from src.db import SessionLocal
+    from src.models import Chunk
+
+    out = [t["question"] for t in json.loads(TESTSET.read_text(encoding="utf-8"))]
+    db = SessionLocal()
+    try:
+        texts = db.execute(select(Chunk.text).limit(5000)).scalars().all()
+    finally:
+        db.close()
+    rng = random.Random(seed)
+    while texts and len(out) < n + 5:
+        words = [w for w in tokenize(rng.choice(texts)) if len(w) > 3]
+        if len(words) >= 3:
+            start = rng.randrange(len(words) - 2)
+            out.append(f"What does the speaker say about {' '.join(words[start:start + 3])}?")
+    return out
+
+# =========================
+# Sessions
+# =========================
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.conversations = 0
+        self.dropped = 0
+        self.errors: Counter = Counter()
+        self.stages: dict[str, list[float]] = {}
+
+    def ok(self, timings: dict, turn_ms: float, summary_ms: float) -> None:
+        with self._lock:
+            self.turns += 1
+            samples = {"turn": turn_ms, "summary": summary_ms}
+            samples.update({k[:-3]: v for k, v in timings.items() if k.endswith("_ms") and isinstance(v, (int, float))})
+            for stage, ms in samples.items():
+                self.stages.setdefault(stage, []).append(ms)
+
+    def fail(self, exc: Exception) -> None:
+        with self._lock:
+            self.errors[type(exc).__name__] += 1
+
+    def done_conversation(self) -> None:
+        with self._lock:
+            self.conversations += 1
+
+    def drop(self) -> None:
+        with self._lock:
+            self.dropped += 1
+
+def _ask(p: SimpleNamespace, stream: bool, **kwargs) -> dict:
+    if not stream:
+        return p.answer_question(**kwargs)
+    out: dict = {}
+    for ev in p.answer_question_stream(**kwargs):
+        if ev["type"] in ("meta", "done"):
+            out.update(ev)
+    return out
+
+def _conversation(p: SimpleNamespace, opener: str, args, rng: random.Random, rec: Recorder, stop: float) -> None:
+    """One chat session, turn by turn the way app.py drives it."""
+    messages: list[dict] = []
+    summary, last_rewritten = "", None
+    for turn in range(args.turns):
+        if turn and time.monotonic() >= stop:
+            break
+        question = opener if turn == 0 else rng.choice(FOLLOW_UPS)
+        messages.append({"role": "user", "content": question})
+        t = time.perf_counter()
+        try:
+            out = _ask(p, args.stream, question=question, namespace=p.namespace, summary=summary,
+                       recent_turns=messages[-6:], last_rewritten=last_rewritten)
+        except Exception as e:
+            rec.fail(e)
+            break
+        turn_ms = (time.perf_counter() - t) * 1000
+        messages.append({"role": "assistant", "content": out["answer"]})
+        last_rewritten = out.get("rewritten_query")
+
+        t = time.perf_counter()
+        try:
+            summary = p.update_summary(summary, messages[-2:])
+        except Exception as e:
+            rec.fail(e)
+        rec.ok(out["timings"], turn_ms, (time.perf_counter() - t) * 1000)
+
+        if args.think_ms and turn < args.turns - 1:
+            time.sleep(rng.expovariate(1000.0 / args.think_ms))
+    rec.done_conversation()
+
+def _closed(p, args, level: int, openers: list[str], rec: Recorder, stop: float) -> None:
+    def user(i: int) -> None:
+        rng = random.Random(args.seed * 1000 + i)
+        while time.monotonic() < stop:
+            _conversation(p, rng.choice(openers), args, rng, rec, stop)
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(level)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+def _open(p, args, rate: float, openers: list[str], rec: Recorder, stop: float) -> None:
+    rng = random.Random(args.seed)
+    slots = threading.Semaphore(args.max_inflight)
+
+    def session(i: int) -> None:
+        try:
+            crng = random.Random(args.seed * 1000 + i)
+            _conversation(p, crng.choice(openers), args, crng, rec, stop)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=args.max_inflight) as pool:
+        due = time.monotonic()
+        i = 0
+        while True:
+            due += rng.expovariate(rate)
+            if due >= stop:
+                break
+            time.sleep(max(0.0, due - time.monotonic()))
+            if not slots.acquire(blocking=False):
+                rec.drop()
+                continue
+            pool.submit(session, i)
+            i += 1
+
+class PoolSampler:
+    """Peak checked-out connections of the SQLAlchemy pool, sampled every 20 ms."""
+
+    def __init__(self, engine):
+        self.pool = engine.pool
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        checkedout = getattr(self.pool, "checkedout", None)
+        while checkedout and not self._stop.wait(0.02):
+            self.peak = max(self.peak, checkedout())
+
+    def __enter__(self) -> "PoolSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+def run_level(p, args, level: float, openers: list[str]) -> dict:
+    rec = Recorder()
+    t = time.perf_counter()
+    stop = time.monotonic() + args.duration
+    with PoolSampler(p.engine) as sampler:
+        if args.model == "closed":
+            _closed(p, args, int(level), openers, rec, stop)
+        else:
+            _open(p, args, float(level), openers, rec, stop)
+    elapsed = time.perf_counter() - t
+
+    errors = sum(rec.errors.values())
+    stages = {
+        s: {f"p{q}": float(np.percentile(xs, q)) for q in (50, 95, 99)}
+        for s, xs in sorted(rec.stages.items())
+    }
+    return {
+        "level": level,
+        "turns": rec.turns,
+        "conversations": rec.conversations,
+        "elapsed_s": elapsed,
+        "qps": rec.turns / elapsed,
+        "error_rate": errors / max(1, rec.turns + errors),
+        "errors": dict(rec.errors),
+        "dropped": rec.dropped,
+        "db_pool_peak": sampler.peak,
+        "db_pool_size": p.engine.pool.size() if hasattr(p.engine.pool, "size") else None,
+        "stages": stages,
+    }
+
+def saturation(levels: list[dict]) -> tuple[float, str] | None:
+    """First level where throughput stops scaling, errors or drops appear, or p95 turn latency doubles."""
+    base_p95 = levels[0]["stages"].get("turn", {}).get("p95")
+    for prev, cur in zip(levels, levels[1:]):
+        p95 = cur["stages"].get("turn", {}).get("p95")
+        if cur["error_rate"] > 0.01 or cur["dropped"]:
+            return cur["level"], "errors / dropped arrivals"
+        if base_p95 and p95 and p95 > 2 * base_p95:
+            return cur["level"], f"turn p95 {p95:.0f} ms > 2x {base_p95:.0f} ms"
+        if cur["qps"] < prev["qps"] * 1.1:
+            return cur["level"], f"qps {prev['qps']:.2f} -> {cur['qps']:.2f}"
+    return None
+
+def _print_level(r: dict, unit: str) -> None:
+    turn = r["stages"].get("turn", {})
+    errs = ", ".join(f"{k}={v}" for k, v in r["errors"].items()) or "-"
+    print(f"{unit}={r['level']:g}  turns={r['turns']} conversations={r['conversations']}  {r['qps']:.2f} turns/s  "
+          f"turn p50/p95/p99 {turn.get('p50', 0):.0f}/{turn.get('p95', 0):.0f}/{turn.get('p99', 0):.0f} ms  "
+          f"errors {r['error_rate']:.1%} ({errs})  dropped={r['dropped']}  db pool peak {r['db_pool_peak']}/{r['db_pool_size']}")
+
+def _print_stages(r: dict) -> None:
+    print(f"{'stage':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, s in r["stages"].items():
+        print(f"{stage:>14} {s['p50']:9.1f} {s['p95']:9.1f} {s['p99']:9.1f}")
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", choices=["closed", "open"], default="closed")
+    ap.add_argument("--sessions", type=int, default=8, help="closed loop: concurrent users")
+    ap.add_argument("--rate", type=float, default=1.0, help="open loop: new conversations per second")
+    ap.add_argument("--sweep", type=float, nargs="+", help="run once per value (sessions or rate) and find the saturation point")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    ap.add_argument("--turns", type=int, default=3, help="turns per conversation (the first is a new question, the rest follow-ups)")
+    ap.add_argument("--think-ms", type=float, default=1000.0, help="mean think time between turns")
+    ap.add_argument("--max-inflight", type=int, default=256, help="open loop: conversations running at once before arrivals are dropped")
+    ap.add_argument("--stream", action="store_true", help="use answer_question_stream like the app (default: answer_question)")
+    ap.add_argument("--stub", action="store_true", help="offline stand-ins from eval/bench_pipeline.py")
+    ap.add_argument("--videos", type=int, default=20, help="stub: transcripts loaded into the fixture")
+    ap.add_argument("--latency", default="", help="stub: injected ms per call, e.g. embed=30,chat=250")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    p = _pipeline(args.stub, args.videos)
+    if args.stub and args.latency:
+        from eval import bench_pipeline
+        bench_pipeline.LATENCY.update(bench_pipeline.parse_latency(args.latency))
+    openers = _openers(50, args.seed)
+
+    unit = "sessions" if args.model == "closed" else "rate"
+    levels = args.sweep or [args.sessions if args.model == "closed" else args.rate]
+    print(f"model={args.model} turns={args.turns} think={args.think_ms:g}ms duration={args.duration:g}s "
+          f"stream={args.stream} stub={args.stub} openers={len(openers)}")
+
+    results = []
+    for level in levels:
+        r = run_level(p, args, level, openers)
+        results.append(r)
+        _print_level(r, unit)
+
+    if len(results) == 1:
+        print()
+        _print_stages(results[0])
+    else:
+        sat = saturation(results)
+        print("\nsaturation: " + (f"{unit}={sat[0]:g} ({sat[1]})" if sat else "not reached"))
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"args": vars(args), "levels": results}, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,33 @@
+"""
+RAGAS evaluation over data/eval/testset.json.
+
+Questions run on a bounded worker pool (--workers). Every finished question is
+appended to a JSONL checkpoint (--checkpoint), and RAGAS scores are computed in
+batches of --ragas-batch while the remaining questions are still running and
+appended to <checkpoint>.scores.jsonl. A rerun with the same checkpoint skips
+questions that already have a result (failed ones are retried) and batches that
+are already scored; --fresh starts over.
+
+    python -m eval.run_eval --workers 8 --checkpoint data/eval/runs/run.jsonl
+
+Reports throughput, per-stage latency percentiles and mean RAGAS scores.
+
+The semantic answer cache is off (and cleared before each pass), so every
+question is really answered and --compare-rewrite passes cannot replay each
+other's answers; each row records semantic_hit so any leak shows up.
+"""
+
+import os
 import json
+import time
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 
+# must be set before src.config is imported
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+
 from datasets import Dataset
 from ragas import evaluate
 from ragas.metrics import faithfulness, answer_relevancy
@@ -9,15 +35,178 @@ from ragas.metrics import faithfulness, answer_relevancy
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-
 from src.retrieve import answer_question
-from src.config import NAMESPACE, CHAT_MODEL, EMBED_MODEL, OPENAI_API_KEY
+from src.config import NAMESPACE, EMBED_MODEL, REWRITE_GATING
+from src.clients import chat_llm, embeddings
+from src.cache import sha1
+from src import semantic_cache
 
 TESTSET_PATH = Path("data/eval/testset.json")
+CHECKPOINT_PATH = Path("data/eval/runs/run.jsonl")
+
+TIMING_COLS = ["total_ms", "rewrite_ms", "embed_query_ms", "retrieve_ms", "db_fetch_ms", "rerank_ms", "generate_ms"]
+METRIC_COLS = ["faithfulness", "answer_relevancy"]
+
+def _key(t: dict, rewrite_gating: str | None) -> str:
+    """Identifies a question (with its chat context) within a checkpoint."""
+    return sha1(json.dumps([t["question"], t.get("summary", ""), t.get("recent_turns"), rewrite_gating], sort_keys=True))
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    out = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            out.append(json.loads(line))
+        except json.JSONDecodeError:
+            # torn last line from an interrupted run
+            continue
+    return out
+
+def _scores_path(checkpoint: Path) -> Path:
+    return checkpoint.with_name(checkpoint.stem + ".scores.jsonl")
+
+def _answer(t: dict, rewrite_gating: str | None) -> dict:
+    # optional multi-turn context: "summary" and "recent_turns" per test
+    out = answer_question(
+        t["question"],
+        namespace=NAMESPACE,
+        summary=t.get("summary", ""),
+        recent_turns=t.get("recent_turns"),
+        rewrite_gating=rewrite_gating,
+    )
+    return {
+        "question": t["question"],
+        "answer": out["answer"],
+        # Use the actual chunk texts used in generation
+        "contexts": out.get("contexts_used", []),
+        "ground_truth": t.get("ground_truth", ""),
+        "sources": [(s["video_id"], s["start"]) for s in out["sources"]],
+        "rewrite_skipped": out["cache"].get("rewrite_skipped", False),
+        "semantic_hit": out["cache"].get("semantic_hit", False),
+        **{c: out["timings"].get(c) for c in TIMING_COLS},
+    }
+
+def _ragas(rows: list[dict]) -> pd.DataFrame:
+    """Per-question RAGAS scores for rows (same order)."""
+    ds = Dataset.from_dict({
+        "question": [r["question"] for r in rows],
+        "answer": [r["answer"] for r in rows],
+        "contexts": [r["contexts"] for r in rows],
+        "ground_truth": [r["ground_truth"] for r in rows],
+    })
 
+    # ✅ Provide evaluation LLM + embeddings explicitly
+    eval_llm = LangchainLLMWrapper(chat_llm(temperature=0))
+    eval_embeddings = LangchainEmbeddingsWrapper(embeddings(EMBED_MODEL))
+
+    result = evaluate(
+        ds,
+        metrics=[faithfulness, answer_relevancy],
+        llm=eval_llm,
+        embeddings=eval_embeddings,
+    )
+    return result.to_pandas()
+
+def _score_batch(batch: list[dict], scores_file) -> list[dict]:
+    print(f"  RAGAS on {len(batch)} answers...")
+    scored = _ragas(batch)
+    out = []
+    for r, (_, s) in zip(batch, scored.iterrows()):
+        row = {"key": r["key"], **{m: float(s[m]) if pd.notna(s.get(m)) else None for m in METRIC_COLS}}
+        scores_file.write(json.dumps(row) + "\n")
+        out.append(row)
+    scores_file.flush()
+    return out
+
+def _run(tests: list[dict], rewrite_gating: str | None, checkpoint: Path, workers: int,
+         ragas_batch: int, fresh: bool) -> pd.DataFrame:
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    scores_path = _scores_path(checkpoint)
+    if fresh:
+        checkpoint.unlink(missing_ok=True)
+        scores_path.unlink(missing_ok=True)
+
+    keys = [_key(t, rewrite_gating) for t in tests]
+    done = {r["key"]: r for r in _read_jsonl(checkpoint) if "error" not in r}
+    scores = {s["key"]: s for s in _read_jsonl(scores_path)}
+    first = {k: i for i, k in reversed(list(enumerate(keys)))}
+    todo = [(i, tests[i]) for k, i in sorted(first.items(), key=lambda kv: kv[1]) if k not in done]
+    print(f"{len(first) - len(todo)} questions already in {checkpoint}, running {len(todo)} with {workers} workers")
+
+    # answers cached by an earlier pass in this process must not be replayed
+    semantic_cache.clear()
+
+    # answered before but not scored (interrupted during RAGAS)
+    pending = [done[k] for k in first if k in done and k not in scores]
+    errors = 0
+    t0 = time.perf_counter()
+    with open(checkpoint, "a", encoding="utf-8") as ck, open(scores_path, "a", encoding="utf-8") as sc:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_answer, t, rewrite_gating): i for i, t in todo}
+            for n, fut in enumerate(as_completed(futures), 1):
+                i = futures[fut]
+                try:
+                    row = {"key": keys[i], **fut.result()}
+                except Exception as e:
+                    errors += 1
+                    row = {"key": keys[i], "question": tests[i]["question"], "error": f"{type(e).__name__}: {e}"}
+                    print(f"[{n}/{len(todo)}] FAILED {tests[i]['question']}: {row['error']}")
+                else:
+                    done[row["key"]] = row
+                    pending.append(row)
+                    print(f"[{n}/{len(todo)}] {row['total_ms']:.0f} ms  {row['question']}")
+                ck.write(json.dumps(row) + "\n")
+                ck.flush()
+
+                # score full batches on this thread while the workers keep answering
+                if ragas_batch and len(pending) >= ragas_batch:
+                    for s in _score_batch(pending, sc):
+                        scores[s["key"]] = s
+                    pending = []
+        elapsed = time.perf_counter() - t0
+        if pending:
+            for s in _score_batch(pending, sc):
+                scores[s["key"]] = s
+
+    ran = len(todo) - errors
+    print(f"\nAnswered {ran} questions in {elapsed:.1f}s ({ran / elapsed if elapsed else 0.0:.2f} q/s), {errors} failed")
+
+    rows = [{**done[k], **{m: scores.get(k, {}).get(m) for m in METRIC_COLS}} for k in keys if k in done]
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+
+    print("\n=== Latency percentiles (ms) ===")
+    print(df[TIMING_COLS].astype(float).quantile([0.5, 0.95, 0.99]).T.rename(columns=lambda q: f"p{round(q * 100)}").round(1))
+    print(f"Rewrite skipped: {df['rewrite_skipped'].mean():.0%}")
+    if "semantic_hit" in df:
+        print(f"Semantic cache hits: {df['semantic_hit'].fillna(False).astype(bool).sum()}")
+    return df
+
+def _print_scores(df: pd.DataFrame) -> None:
+    if df.empty:
+        print("no answers")
+        return
+    for m in METRIC_COLS:
+        print(f"{m}: {df[m].mean():.3f}  (scored {df[m].notna().sum()}/{len(df)})")
+
+def _source_overlap(a: list, b: list) -> float:
+    a, b = set(map(tuple, a)), set(map(tuple, b))
+    return len(a & b) / len(a | b) if a or b else 1.0
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rewrite-gating", choices=["off", "heuristic", "embedding"], default=None,
+                    help="override REWRITE_GATING for this run")
+    ap.add_argument("--compare-rewrite", action="store_true",
+                    help="run with gating off and with gating on; compare retrieved sources and RAGAS scores")
+    ap.add_argument("--workers", type=int, default=4, help="questions answered concurrently")
+    ap.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH, help="per-question results (JSONL); reused to resume")
+    ap.add_argument("--ragas-batch", type=int, default=20, help="score answers in batches of this size as they finish (0 = all at the end)")
+    ap.add_argument("--fresh", action="store_true", help="discard the checkpoint and start over")
+    args = ap.parse_args()
+
     if not TESTSET_PATH.exists():
         print("❌ testset.json not found:", TESTSET_PATH)
         return
@@ -27,73 +216,33 @@ def main():
         print("❌ testset.json is empty. Add at least 3–5 questions.")
         return
 
-    rows = []
     print(f"\nRunning evaluation on {len(tests)} questions...\n")
+    run = dict(workers=args.workers, ragas_batch=args.ragas_batch, fresh=args.fresh)
 
-    for i, t in enumerate(tests, 1):
-        q = t["question"]
-        gt = t.get("ground_truth", "")
-
-        print(f"[{i}/{len(tests)}] Question: {q}")
-        out = answer_question(q, namespace=NAMESPACE)
-
-        # Use the actual chunk texts used in generation
-        contexts = out.get("contexts_used", [])
-
-        rows.append({
-            "question": q,
-            "answer": out["answer"],
-            "contexts": contexts,
-            "ground_truth": gt,
-            "total_ms": out["timings"].get("total_ms"),
-            "rewrite_ms": out["timings"].get("rewrite_ms"),
-            "embed_query_ms": out["timings"].get("embed_query_ms"),
-            "retrieve_ms": out["timings"].get("retrieve_ms"),
-            "db_fetch_ms": out["timings"].get("db_fetch_ms"),
-            "rerank_ms": out["timings"].get("rerank_ms"),
-            "generate_ms": out["timings"].get("generate_ms"),
-        })
-
-    df = pd.DataFrame(rows)
-
-    print("\n=== Latency summary (ms) ===")
-    cols = ["total_ms","rewrite_ms","embed_query_ms","retrieve_ms","db_fetch_ms","rerank_ms","generate_ms"]
-    print(df[cols].describe())
-
-    # Build dataset for RAGAS
-    ds = Dataset.from_dict({
-        "question": df["question"].tolist(),
-        "answer": df["answer"].tolist(),
-        "contexts": df["contexts"].tolist(),
-        "ground_truth": df["ground_truth"].tolist(),
-    })
-
-    # ✅ Provide evaluation LLM + embeddings explicitly
-    eval_llm = LangchainLLMWrapper(
-        ChatOpenAI(
-            model=CHAT_MODEL,
-            api_key=OPENAI_API_KEY,
-            temperature=0,
-        )
-    )
-
-    eval_embeddings = LangchainEmbeddingsWrapper(
-        OpenAIEmbeddings(
-            model=EMBED_MODEL,
-            api_key=OPENAI_API_KEY,
-        )
-    )
-
-    print("\nRunning RAGAS metrics...")
-    result = evaluate(
-        ds,
-        metrics=[faithfulness, answer_relevancy],
-        llm=eval_llm,
-        embeddings=eval_embeddings,
-    )
+    if not args.compare_rewrite:
+        df = _run(tests, args.rewrite_gating, args.checkpoint, **run)
+        print("\n=== RAGAS Results ===")
+        _print_scores(df)
+        return
 
-    print("\n=== RAGAS Results ===")
-    print(result)
+    configured = args.rewrite_gating or REWRITE_GATING
+    gated_mode = configured if configured != "off" else "heuristic"
+    ck = args.checkpoint
+    print("--- rewrite gating: off ---")
+    base = _run(tests, "off", ck.with_name(f"{ck.stem}.off{ck.suffix}"), **run)
+    print(f"\n--- rewrite gating: {gated_mode} ---")
+    gated = _run(tests, gated_mode, ck.with_name(f"{ck.stem}.{gated_mode}{ck.suffix}"), **run)
+
+    both = base.merge(gated, on="question", suffixes=("_off", "_gated"))
+    overlap = [_source_overlap(a, b) for a, b in zip(both["sources_off"], both["sources_gated"])]
+    print("\n=== Rewrite gating comparison ===")
+    print(f"Skipped rewrites: {gated['rewrite_skipped'].mean():.0%}")
+    print(f"Mean source overlap (Jaccard) vs. always-rewrite: {sum(overlap) / len(overlap):.2f}")
+    print(f"Mean total_ms: {base['total_ms'].mean():.0f} -> {gated['total_ms'].mean():.0f}")
+    print("\n=== RAGAS Results (gating off) ===")
+    _print_scores(base)
+    print(f"\n=== RAGAS Results (gating {gated_mode}) ===")
+    _print_scores(gated)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""
+asyncio plumbing for the async retrieval path.
+
+- loop_local(key, factory): one object per (running event loop, key). Async
+  clients (redis.asyncio pools, httpx.AsyncClient, asyncpg engines) are bound to
+  the loop that created them and must not be shared across loops.
+- a process-wide background event loop (run / submit), so sync callers such as
+  the Streamlit script reuse one loop, and therefore one set of pooled async
+  connections, across reruns instead of paying asyncio.run() setup per question.
+"""
+
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Optional
+
+_lock = threading.RLock()
+_loop_objects: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def loop_local(key: tuple, factory: Callable[[], Any]) -> Any:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        objects = _loop_objects.get(loop)
+        if objects is None:
+            objects = _loop_objects[loop] = {}
+        obj = objects.get(key)
+        if obj is None:
+            obj = objects[key] = factory()
+        return obj
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    global _bg_loop
+    with _lock:
+        if _bg_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="aio-loop", daemon=True).start()
+            _bg_loop = loop
+        return _bg_loop
+
+def submit(coro: Coroutine) -> Future:
+    """Schedule coro on the background loop; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, background_loop())
+
+def run(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """Run coro on the background loop and block for its result (cancelled if the wait fails)."""
+    fut = submit(coro)
+    try:
+        return fut.result(timeout)
+    except BaseException:
+        fut.cancel()
+        raise
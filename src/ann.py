@@ -0,0 +1,225 @@
+"""
+NumPy HNSW graph for the local vector store: incremental inserts, tombstone deletes,
+filtered search through a `valid` mask, .npz persistence.
+"""
+
+import copy
+import heapq
+import math
+import os
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+class HNSWIndex:
+    def __init__(self, M: int = 16, ef_construction: int = 100, seed: int = 42):
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.mL = 1.0 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+
+        self.size = 0                  # rows 0..size-1 are in the graph
+        self.entry = -1
+        self.max_level = -1
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.nbr0 = np.full((0, self.M0), -1, dtype=np.int32)
+        self.deg0 = np.zeros(0, dtype=np.int32)
+        self.upper: list[dict[int, list[int]]] = []   # upper[l-1][node] -> neighbor rows at level l
+
+    # ---- graph helpers ----
+
+    def _reserve(self, n: int) -> None:
+        cap = len(self.levels)
+        if n <= cap:
+            return
+        new_cap = max(n, cap * 2, 1024)
+        levels = np.zeros(new_cap, dtype=np.int8)
+        levels[:cap] = self.levels
+        nbr0 = np.full((new_cap, self.M0), -1, dtype=np.int32)
+        nbr0[:cap] = self.nbr0
+        deg0 = np.zeros(new_cap, dtype=np.int32)
+        deg0[:cap] = self.deg0
+        self.levels, self.nbr0, self.deg0 = levels, nbr0, deg0
+
+    def _neighbors(self, node: int, level: int):
+        if level == 0:
+            return self.nbr0[node, :self.deg0[node]].tolist()
+        return self.upper[level - 1].get(node, [])
+
+    def _set_neighbors(self, node: int, level: int, nbrs: list[int]) -> None:
+        if level == 0:
+            self.nbr0[node, :len(nbrs)] = nbrs
+            self.nbr0[node, len(nbrs):] = -1
+            self.deg0[node] = len(nbrs)
+        else:
+            self.upper[level - 1][node] = list(nbrs)
+
+    def _search_layer(self, vecs, q: np.ndarray, eps: list[int], ef: int, level: int,
+                      valid: Optional[np.ndarray] = None) -> list[tuple[float, int]]:
+        """Best-first search on one layer; returns up to ef (sim, node), best first."""
+        visited = set(eps)
+        sims = (vecs[eps] @ q).tolist()
+        cand = [(-s, n) for s, n in zip(sims, eps)]
+        heapq.heapify(cand)
+        res = [(s, n) for s, n in zip(sims, eps) if valid is None or valid[n]]
+        heapq.heapify(res)
+        while len(res) > ef:
+            heapq.heappop(res)
+
+        while cand:
+            neg_s, c = heapq.heappop(cand)
+            if len(res) >= ef and -neg_s < res[0][0]:
+                break
+            nb = [n for n in self._neighbors(c, level) if n not in visited]
+            if not nb:
+                continue
+            visited.update(nb)
+            for s, n in zip((vecs[nb] @ q).tolist(), nb):
+                if len(res) < ef or s > res[0][0]:
+                    heapq.heappush(cand, (-s, n))
+                    if valid is None or valid[n]:
+                        heapq.heappush(res, (s, n))
+                        if len(res) > ef:
+                            heapq.heappop(res)
+        return sorted(res, reverse=True)
+
+    def _select(self, vecs, cands: list[tuple[float, int]], m: int) -> list[int]:
+        """
+        Neighbor-selection heuristic (keeps diverse links), topped up with the closest
+        pruned ones. cands are (sim to base, node), best first.
+        """
+        if len(cands) <= m:
+            return [n for _, n in cands]
+        nodes = [n for _, n in cands]
+        base = [s for s, _ in cands]
+        C = np.asarray(vecs[nodes], dtype=np.float32)
+        G = C @ C.T
+        # closest[i]: highest similarity of candidate i to any selected neighbor so far
+        closest = np.full(len(nodes), -np.inf, dtype=np.float32)
+
+        selected: list[int] = []
+        pruned: list[int] = []
+        for i in range(len(nodes)):
+            if len(selected) >= m:
+                break
+            if closest[i] > base[i]:
+                pruned.append(i)
+                continue
+            selected.append(i)
+            np.maximum(closest, G[i], out=closest)
+        for i in pruned:
+            if len(selected) >= m:
+                break
+            selected.append(i)
+        return [nodes[i] for i in selected]
+
+    # ---- public API ----
+
+    def copy(self) -> "HNSWIndex":
+        """
+        Copy to extend while readers keep searching this one. Upper-layer link lists are
+        shared: they are only ever replaced, never modified in place.
+        """
+        idx = HNSWIndex(M=self.M, ef_construction=self.ef_construction)
+        idx.rng = copy.deepcopy(self.rng)
+        idx.size, idx.entry, idx.max_level = self.size, self.entry, self.max_level
+        idx.levels, idx.nbr0, idx.deg0 = self.levels.copy(), self.nbr0.copy(), self.deg0.copy()
+        idx.upper = [dict(layer) for layer in self.upper]
+        return idx
+
+    def add(self, vecs, rows) -> None:
+        """Insert rows (must be >= size, in increasing order) whose vectors are in vecs."""
+        for row in rows:
+            self._insert(vecs, int(row))
+
+    def _insert(self, vecs, node: int) -> None:
+        if node < self.size:
+            return
+        self._reserve(node + 1)
+        q = np.asarray(vecs[node], dtype=np.float32)
+        level = int(-math.log(1.0 - self.rng.random()) * self.mL)
+        self.levels[node] = level
+        while len(self.upper) < level:
+            self.upper.append({})
+        for l in range(1, level + 1):
+            self.upper[l - 1][node] = []
+        self.size = node + 1
+
+        if self.entry < 0:
+            self.entry, self.max_level = node, level
+            return
+
+        ep = [self.entry]
+        for l in range(self.max_level, level, -1):
+            ep = [self._search_layer(vecs, q, ep, 1, l)[0][1]]
+
+        for l in range(min(level, self.max_level), -1, -1):
+            W = self._search_layer(vecs, q, ep, self.ef_construction, l)
+            mmax = self.M0 if l == 0 else self.M
+            nbrs = self._select(vecs, W, self.M)
+            self._set_neighbors(node, l, nbrs)
+            for n in nbrs:
+                cur = self._neighbors(n, l) + [node]
+                if len(cur) > mmax:
+                    sims = vecs[cur] @ vecs[n]
+                    order = np.argsort(-sims)
+                    cur = self._select(vecs, [(float(sims[i]), cur[i]) for i in order], mmax)
+                self._set_neighbors(n, l, cur)
+            ep = [n for _, n in W]
+
+        if level > self.max_level:
+            self.entry, self.max_level = node, level
+
+    def search(self, vecs, q, k: int, ef: int = 64, valid: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k (rows, sims) among rows where valid is True (all rows when valid is None)."""
+        if self.entry < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q = np.asarray(q, dtype=np.float32)
+        ep = [self.entry]
+        for l in range(self.max_level, 0, -1):
+            ep = [self._search_layer(vecs, q, ep, 1, l)[0][1]]
+        W = self._search_layer(vecs, q, ep, max(ef, k), 0, valid)[:k]
+        return np.asarray([n for _, n in W], dtype=np.int64), np.asarray([s for s, _ in W], dtype=np.float32)
+
+    # ---- persistence ----
+
+    def save(self, path: Path) -> None:
+        arrays = {
+            "params": np.asarray([self.M, self.ef_construction, self.entry, self.max_level, self.size], dtype=np.int64),
+            "levels": self.levels[:self.size],
+            "nbr0": self.nbr0[:self.size],
+            "deg0": self.deg0[:self.size],
+        }
+        for l, layer in enumerate(self.upper, 1):
+            nodes = np.fromiter(layer.keys(), dtype=np.int32, count=len(layer))
+            nbrs = np.full((len(nodes), self.M), -1, dtype=np.int32)
+            for i, node in enumerate(nodes.tolist()):
+                links = layer[node]
+                nbrs[i, :len(links)] = links
+            arrays[f"up{l}_nodes"] = nodes
+            arrays[f"up{l}_nbrs"] = nbrs
+
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "HNSWIndex":
+        with np.load(path) as data:
+            M, ef_c, entry, max_level, size = (int(x) for x in data["params"])
+            idx = cls(M=M, ef_construction=ef_c)
+            idx.entry, idx.max_level, idx.size = entry, max_level, size
+            idx._reserve(size)
+            idx.levels[:size] = data["levels"]
+            idx.nbr0[:size] = data["nbr0"]
+            idx.deg0[:size] = data["deg0"]
+            l = 1
+            while f"up{l}_nodes" in data:
+                layer = {}
+                for node, links in zip(data[f"up{l}_nodes"].tolist(), data[f"up{l}_nbrs"]):
+                    layer[node] = [n for n in links.tolist() if n >= 0]
+                idx.upper.append(layer)
+                l += 1
+        return idx
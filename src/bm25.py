@@ -0,0 +1,368 @@
+"""
+BM25 inverted index over chunk text, one per namespace, for hybrid retrieval.
+
+Dense search misses exact terms (names, code identifiers, numbers) that users
+quote from the transcripts; this index catches them and retrieve.py fuses both
+rankings with reciprocal rank fusion (rrf_fuse).
+
+Postings are array-backed (CSR): terms[tid] owns docs[offsets[tid]:offsets[tid+1]]
+with matching term frequencies in tfs. Docs are chunks, numbered in insertion
+order, so every posting list stays sorted by doc. Each add() appends a small
+delta segment (its postings sorted by term) that search reads next to the main
+arrays; segments are merged into the CSR with one np.insert on flush() or once
+MAX_SEGMENTS pile up. Deleted chunks are tombstoned through the alive mask.
+
+Layout: BM25_DIR/<namespace>/index.npz (arrays + a JSON blob with terms, chunk
+ids and video ids), written atomically by flush(), which ingestion calls once
+per run rather than per batch. Other processes (e.g. the app while the CLI
+ingests) reload it when its mtime changes; unflushed updates are only visible
+in the process that made them.
+
+Rebuild a namespace from Postgres:
+    python -m src.bm25 prodv1
+"""
+
+import re
+import os
+import json
+import argparse
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from src.config import BM25_DIR, BM25_K1, BM25_B, RRF_K
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by do does for from had has have he her his how i if in into is it its
+just like me my no not of on or our she so than that the their them then there these they this
+to um uh was we were what when where which who why will with you your yeah okay oh
+""".split())
+
+MAX_SEGMENTS = 32
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+class _BM25Namespace:
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._clear()
+        self._load()
+
+    def _clear(self) -> None:
+        self.term_of: dict[str, int] = {}
+        self.terms: list[str] = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.uint16)
+        self.segments: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []   # (tids, docs, tfs) sorted by tid
+        self.dirty = False
+        self.ids: list[str] = []
+        self.doc_of: dict[str, int] = {}
+        self.doclen = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.video_ids: list[str] = []
+        self.code_of: dict[str, int] = {}
+        self.mtime = 0.0
+
+    # ---- persistence ----
+
+    @property
+    def file(self) -> Path:
+        return self.path / "index.npz"
+
+    def _load(self) -> None:
+        if not self.file.exists():
+            return
+        mtime = self.file.stat().st_mtime
+        with np.load(self.file) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            self.offsets, self.docs, self.tfs = data["offsets"], data["docs"], data["tfs"]
+            self.doclen, self.alive, self.codes = data["doclen"], data["alive"].copy(), data["codes"]
+        self.terms = meta["terms"]
+        self.term_of = {t: i for i, t in enumerate(self.terms)}
+        self.ids = meta["ids"]
+        self.doc_of = {cid: d for d, cid in enumerate(self.ids) if self.alive[d]}
+        self.video_ids = meta["video_ids"]
+        self.code_of = {v: i for i, v in enumerate(self.video_ids)}
+        self.mtime = mtime
+
+    def _save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = json.dumps({"terms": self.terms, "ids": self.ids, "video_ids": self.video_ids}, ensure_ascii=False)
+        tmp = self.file.with_name(self.file.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                meta=np.frombuffer(meta.encode("utf-8"), dtype=np.uint8),
+                offsets=self.offsets, docs=self.docs, tfs=self.tfs,
+                doclen=self.doclen, alive=self.alive, codes=self.codes,
+            )
+        os.replace(tmp, self.file)
+        self.mtime = self.file.stat().st_mtime
+        self.dirty = False
+
+    def flush(self) -> None:
+        """Merge delta segments and write the index file if anything changed."""
+        with self.lock:
+            self._merge()
+            if self.dirty:
+                self._save()
+
+    def refresh(self) -> None:
+        """Reload if another process rewrote the index file (and nothing here is unsaved)."""
+        if self.dirty:
+            return
+        try:
+            mtime = self.file.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            self._clear()
+            self._load()
+
+    # ---- updates ----
+
+    def _term(self, term: str) -> int:
+        tid = self.term_of.get(term)
+        if tid is None:
+            tid = self.term_of[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+    def _code(self, video_id: str) -> int:
+        code = self.code_of.get(video_id)
+        if code is None:
+            code = self.code_of[video_id] = len(self.video_ids)
+            self.video_ids.append(video_id)
+        return code
+
+    def add(self, rows: list[dict]) -> int:
+        """Index rows ({"id", "video_id", "text"}); ids already indexed are skipped. Returns docs added."""
+        with self.lock:
+            self.refresh()
+            new_tids: list[int] = []
+            new_docs: list[int] = []
+            new_tfs: list[int] = []
+            lens, codes = [], []
+            for r in rows:
+                # chunk ids are content hashes, so a known id means identical text
+                if r["id"] in self.doc_of:
+                    continue
+                doc = len(self.ids)
+                self.ids.append(r["id"])
+                self.doc_of[r["id"]] = doc
+                tokens = tokenize(r["text"])
+                for term, tf in Counter(tokens).items():
+                    new_tids.append(self._term(term))
+                    new_docs.append(doc)
+                    new_tfs.append(min(tf, 65535))
+                lens.append(len(tokens))
+                codes.append(self._code(r.get("video_id") or ""))
+            if not lens:
+                return 0
+
+            tids = np.asarray(new_tids, dtype=np.int64)
+            order = np.argsort(tids, kind="stable")   # keeps docs ascending within a term
+            self.segments.append((tids[order], np.asarray(new_docs, dtype=np.int32)[order], np.asarray(new_tfs, dtype=np.uint16)[order]))
+            self.doclen = np.concatenate([self.doclen, np.asarray(lens, dtype=np.int32)])
+            self.alive = np.concatenate([self.alive, np.ones(len(lens), dtype=bool)])
+            self.codes = np.concatenate([self.codes, np.asarray(codes, dtype=np.int32)])
+            self.dirty = True
+            if len(self.segments) >= MAX_SEGMENTS:
+                self._merge()
+            return len(lens)
+
+    def _merge(self) -> None:
+        """Fold the delta segments into the CSR arrays."""
+        if not self.segments:
+            return
+        # segments hold increasing doc numbers, so a stable sort keeps docs ascending within a term
+        tids = np.concatenate([seg[0] for seg in self.segments])
+        order = np.argsort(tids, kind="stable")
+        tids = tids[order]
+        docs = np.concatenate([seg[1] for seg in self.segments])[order]
+        tfs = np.concatenate([seg[2] for seg in self.segments])[order]
+        self.segments = []
+
+        n_terms = len(self.terms)
+        offsets = np.concatenate([self.offsets, np.full(n_terms + 1 - len(self.offsets), self.offsets[-1])])
+        # append each new posting at the end of its term's list
+        at = offsets[tids + 1]
+        self.docs = np.insert(self.docs, at, docs)
+        self.tfs = np.insert(self.tfs, at, tfs)
+        counts = np.diff(offsets) + np.bincount(tids, minlength=n_terms)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _postings(self, tid: int) -> tuple[np.ndarray, np.ndarray]:
+        """(docs, tfs) of a term across the CSR arrays and the delta segments."""
+        lo, hi = (self.offsets[tid], self.offsets[tid + 1]) if tid + 1 < len(self.offsets) else (0, 0)
+        docs, tfs = [self.docs[lo:hi]], [self.tfs[lo:hi]]
+        for seg_tids, seg_docs, seg_tfs in self.segments:
+            lo, hi = np.searchsorted(seg_tids, tid), np.searchsorted(seg_tids, tid, side="right")
+            docs.append(seg_docs[lo:hi])
+            tfs.append(seg_tfs[lo:hi])
+        if len(docs) == 1:
+            return docs[0], tfs[0]
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def delete(self, ids: list[str]) -> None:
+        with self.lock:
+            self.refresh()
+            docs = [self.doc_of.pop(cid) for cid in ids if cid in self.doc_of]
+            if docs:
+                self.alive[docs] = False
+                self.dirty = True
+
+    # ---- search ----
+
+    def search(self, query: str, top_k: int, video_ids: Optional[list[str]] = None) -> list[tuple[str, float]]:
+        with self.lock:
+            self.refresh()
+            n_alive = int(self.alive.sum())
+            tids = [self.term_of[t] for t in dict.fromkeys(tokenize(query)) if t in self.term_of]
+            if not n_alive or not tids:
+                return []
+
+            avgdl = float(self.doclen[self.alive].mean()) or 1.0
+            all_docs, all_w = [], []
+            for tid in tids:
+                docs, tf = self._postings(tid)
+                tf = tf.astype(np.float32)
+                df = docs.size   # includes tombstoned docs; close enough for idf
+                idf = np.log(1.0 + (n_alive - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doclen[docs] / avgdl)
+                all_docs.append(docs)
+                all_w.append(idf * tf * (BM25_K1 + 1.0) / (tf + norm))
+
+            scores = np.bincount(np.concatenate(all_docs), weights=np.concatenate(all_w), minlength=len(self.ids))
+            mask = self.alive & (scores > 0)
+            if video_ids is not None:
+                wanted = [self.code_of[v] for v in video_ids if v in self.code_of]
+                mask &= np.isin(self.codes, np.asarray(wanted, dtype=np.int32))
+            cand = np.flatnonzero(mask)
+            if cand.size == 0:
+                return []
+            k = min(top_k, cand.size)
+            top = cand[np.argpartition(-scores[cand], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [(self.ids[d], float(scores[d])) for d in top.tolist()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            delta = sum(seg[1].size for seg in self.segments)
+            return {"docs": int(self.alive.sum()), "terms": len(self.terms), "postings": int(self.docs.size) + delta,
+                    "segments": len(self.segments), "dirty": self.dirty}
+
+class BM25Index:
+    def __init__(self, root: str = BM25_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._namespaces: dict[str, _BM25Namespace] = {}
+
+    def _ns(self, namespace: str) -> _BM25Namespace:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                ns = self._namespaces[namespace] = _BM25Namespace(self.root / namespace)
+            return ns
+
+    def add(self, rows: list[dict], namespace: str) -> int:
+        return self._ns(namespace).add(rows)
+
+    def delete(self, ids: list[str], namespace: str) -> None:
+        self._ns(namespace).delete(ids)
+
+    def flush(self, namespace: Optional[str] = None) -> None:
+        """Persist pending updates of one namespace, or of every loaded namespace."""
+        if namespace is not None:
+            self._ns(namespace).flush()
+            return
+        with self._lock:
+            targets = list(self._namespaces.values())
+        for ns in targets:
+            ns.flush()
+
+    def search(self, query: str, top_k: int, namespace: str, video_ids: Optional[list[str]] = None) -> list[tuple[str, float]]:
+        """Top (chunk id, BM25 score) pairs, best first."""
+        return self._ns(namespace).search(query, top_k, video_ids)
+
+    def stats(self, namespace: str) -> dict:
+        return self._ns(namespace).stats()
+
+    def rebuild(self, namespace: str, rows) -> int:
+        """Replace a namespace's index with rows (any iterable of {"id", "video_id", "text"})."""
+        ns = self._ns(namespace)
+        with ns.lock:
+            ns._clear()
+            if ns.file.exists():
+                ns.file.unlink()
+            batch, total = [], 0
+            for r in rows:
+                batch.append(r)
+                if len(batch) >= 5000:
+                    total += ns.add(batch)
+                    batch = []
+            total += ns.add(batch)
+            ns.flush()
+            return total
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+def get_bm25() -> BM25Index:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index()
+        return _index
+
+def rrf_fuse(rankings: list[list[str]], k: int = RRF_K) -> list[tuple[str, float]]:
+    """Reciprocal rank fusion: score(id) = sum over rankings of 1 / (k + rank), rank from 1."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, 1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+def rebuild_from_db(namespace: str, embed_model: Optional[str] = None) -> int:
+    """Re-index every chunk of the videos ingested into namespace (per ingestion_log)."""
+    from sqlalchemy import select
+    from src.config import EMBED_MODEL
+    from src.db import SessionLocal
+    from src.models import Chunk, IngestionLog
+
+    db = SessionLocal()
+    try:
+        video_ids = db.execute(
+            select(IngestionLog.video_id).where(
+                IngestionLog.namespace == namespace,
+                IngestionLog.embed_model == (embed_model or EMBED_MODEL),
+                IngestionLog.status == "done",
+            )
+        ).scalars().all()
+        rows = db.execute(
+            select(Chunk.id, Chunk.video_id, Chunk.text)
+            .where(Chunk.video_id.in_(video_ids))
+            .order_by(Chunk.video_id, Chunk.start)
+            .execution_options(yield_per=5000)
+        )
+        return get_bm25().rebuild(namespace, ({"id": cid, "video_id": vid, "text": text} for cid, vid, text in rows))
+    finally:
+        db.close()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Rebuild the BM25 index of a namespace from Postgres.")
+    ap.add_argument("namespace")
+    ap.add_argument("--embed-model", default=None)
+    args = ap.parse_args()
+    n = rebuild_from_db(args.namespace, args.embed_model)
+    print(f"Indexed {n} chunks into {BM25_DIR}/{args.namespace}: {get_bm25().stats(args.namespace)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,625 @@
+"""
+Two-tier cache: bounded in-process L1 (LRU + TTL + byte budget) in front of Redis.
+L1 values are shared between callers (read-only); a*-prefixed functions are the asyncio variants.
+"""
+
 import json
+import time
+import uuid
+import asyncio
+import struct
 import hashlib
-from typing import Any, Optional
-import redis
-from src.config import REDIS_URL
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+import numpy as np
+from src.aio import loop_local
+from src.clients import redis_client, async_redis_client
+from src.config import (
+    L1_CACHE_MAX_BYTES, L1_CACHE_TTL_S, L1_NEGATIVE_TTL_S, L1_PREFIX_LIMITS, EMBED_CACHE_DTYPE,
+    SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_LEASE_MS, SINGLE_FLIGHT_POLL_MS,
+)
+
+_r = redis_client()
+_rb = redis_client(binary=True)
+
+_MISSING = object()
+
+def _prefix(key: str) -> str:
+    return key.split(":", 1)[0]
+
+def _parse_prefix_limits(raw: str) -> dict[str, int]:
+    out = {}
+    for part in raw.split(","):
+        if ":" in part:
+            name, limit = part.rsplit(":", 1)
+            out[name.strip()] = int(limit)
+    return out
+
+class _LocalCache:
+    """Bounded in-process LRU with TTL, a byte budget and per-prefix entry limits."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, negative_ttl_seconds: int, prefix_limits: dict[str, int]):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.prefix_limits = prefix_limits
+        self._lock = threading.Lock()
+        # key -> (expires_at, size_bytes, value)
+        self._data: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._by_prefix: dict[str, OrderedDict[str, None]] = {}
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "evictions": 0, "expirations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Any:
+        """Cached value, _MISSING for a negative entry, or None when absent/expired."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._by_prefix[_prefix(key)].move_to_end(key)
+            if value is _MISSING:
+                self.stats["negative_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+            return value
+
+    def put(self, key: str, value: Any, size_bytes: int, ttl_seconds: Optional[int] = None) -> None:
+        if not self.enabled or size_bytes > self.max_bytes:
+            return
+        ttl = min(ttl_seconds or self.ttl_seconds, self.ttl_seconds)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            p = _prefix(key)
+            keys = self._by_prefix.setdefault(p, OrderedDict())
+            self._data[key] = (time.monotonic() + ttl, size_bytes, value)
+            keys[key] = None
+            self._bytes += size_bytes
 
-_r = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+            limit = self.prefix_limits.get(p)
+            while limit is not None and len(keys) > limit:
+                self._evict(next(iter(keys)))
+            while self._bytes > self.max_bytes and self._data:
+                self._evict(next(iter(self._data)))
+
+    def put_negative(self, key: str) -> None:
+        self.put(key, _MISSING, size_bytes=len(key), ttl_seconds=self.negative_ttl_seconds)
+
+    def drop_negative(self, key: str) -> None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] is _MISSING:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        p = _prefix(key)
+        self._by_prefix[p].pop(key, None)
+        if not self._by_prefix[p]:
+            del self._by_prefix[p]
+        self._bytes -= size
+
+    def _evict(self, key: str) -> None:
+        self._remove(key)
+        self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._by_prefix.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "entries_by_prefix": {p: len(k) for p, k in self._by_prefix.items()},
+            }
+
+_l1 = _LocalCache(
+    max_bytes=L1_CACHE_MAX_BYTES,
+    ttl_seconds=L1_CACHE_TTL_S,
+    negative_ttl_seconds=L1_NEGATIVE_TTL_S,
+    prefix_limits=_parse_prefix_limits(L1_PREFIX_LIMITS),
+)
 
 def sha1(text: str) -> str:
     return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
+def cache_stats() -> dict[str, Any]:
+    with _gens_lock:
+        gens = {"bumps": _gen_stats["bumps"], "invalidations": dict(_gen_stats["invalidations"])}
+    return {"l1": _l1.snapshot(), "generations": gens, "single_flight": _sf_snapshot()}
+
+def clear_l1() -> None:
+    """Drop every in-process entry (Redis is untouched)."""
+    _l1.clear()
+
+def _miss(key: str) -> None:
+    # Only remember misses when there is a backing store that could have answered.
+    if _r:
+        _l1.put_negative(key)
+
 def get_json(key: str) -> Optional[Any]:
+    v = _l1.get(key)
+    if v is not None:
+        return None if v is _MISSING else v
     if not _r:
         return None
-    v = _r.get(key)
-    return json.loads(v) if v else None
+    raw = _r.get(key)
+    if not raw:
+        _miss(key)
+        return None
+    v = json.loads(raw)
+    _l1.put(key, v, size_bytes=len(raw))
+    return v
 
 def set_json(key: str, value: Any, ttl_seconds: int) -> None:
+    raw = json.dumps(value, ensure_ascii=False)
+    _l1.put(key, value, size_bytes=len(raw), ttl_seconds=ttl_seconds)
     if not _r:
         return
-    _r.setex(key, ttl_seconds, json.dumps(value, ensure_ascii=False))
+    _r.setex(key, ttl_seconds, raw)
 
 def get_text(key: str) -> Optional[str]:
+    v = _l1.get(key)
+    if v is not None:
+        return None if v is _MISSING else v
     if not _r:
         return None
-    return _r.get(key)
+    raw = _r.get(key)
+    if raw is None:
+        _miss(key)
+        return None
+    _l1.put(key, raw, size_bytes=len(raw))
+    return raw
 
 def set_text(key: str, value: str, ttl_seconds: int) -> None:
+    _l1.put(key, value, size_bytes=len(value), ttl_seconds=ttl_seconds)
     if not _r:
         return
     _r.setex(key, ttl_seconds, value)
+
+def get_many(keys: list[str]) -> list[Optional[Any]]:
+    """JSON values for keys in one MGET round trip; None for misses, same order as keys."""
+    out: list[Optional[Any]] = [None] * len(keys)
+    remote: list[int] = []
+    for i, key in enumerate(keys):
+        v = _l1.get(key)
+        if v is None:
+            remote.append(i)
+        elif v is not _MISSING:
+            out[i] = v
+
+    if not _r or not remote:
+        return out
+
+    vals = _r.mget([keys[i] for i in remote])
+    for i, raw in zip(remote, vals):
+        if raw:
+            out[i] = json.loads(raw)
+            _l1.put(keys[i], out[i], size_bytes=len(raw))
+        else:
+            _miss(keys[i])
+    return out
+
+def set_many(items: dict[str, Any], ttl_seconds: int) -> None:
+    """Write JSON values with a shared TTL using one pipelined batch of SETEX."""
+    if not items:
+        return
+    pipe = _r.pipeline(transaction=False) if _r else None
+    for key, value in items.items():
+        raw = json.dumps(value, ensure_ascii=False)
+        _l1.put(key, value, size_bytes=len(raw), ttl_seconds=ttl_seconds)
+        if pipe is not None:
+            pipe.setex(key, ttl_seconds, raw)
+    if pipe is not None:
+        pipe.execute()
+
+# ---- generations ----
+# gen:ns:<namespace> and gen:video:<video_id> are bumped by ingestion. Cached values
+# derived from a namespace or video record the generation they were built under and
+# are treated as misses once it moves, so they can keep long TTLs. Generations are
+# never cached in L1 (they must be fresh across processes); without Redis they are
+# in-process counters.
+
+_local_gens: dict[str, int] = {}
+_gens_lock = threading.Lock()
+_gen_stats = {"bumps": 0, "invalidations": {}}
+
+def _ns_gen_key(namespace: str) -> str:
+    return f"gen:ns:{namespace}"
+
+def _video_gen_key(video_id: str) -> str:
+    return f"gen:video:{video_id}"
+
+def _local_gen_values(keys: list[str]) -> list[int]:
+    with _gens_lock:
+        return [_local_gens.get(k, 0) for k in keys]
+
+def generation(namespace: str) -> int:
+    key = _ns_gen_key(namespace)
+    if _r:
+        return int(_r.get(key) or 0)
+    return _local_gen_values([key])[0]
+
+def video_generations(video_ids: list[str]) -> dict[str, int]:
+    if not video_ids:
+        return {}
+    keys = [_video_gen_key(v) for v in video_ids]
+    vals = [int(v or 0) for v in _r.mget(keys)] if _r else _local_gen_values(keys)
+    return dict(zip(video_ids, vals))
+
+def bump_generation(namespace: str, video_ids=()) -> int:
+    """Invalidate caches derived from namespace (and the given videos); returns the new namespace generation."""
+    keys = [_ns_gen_key(namespace)] + [_video_gen_key(v) for v in video_ids]
+    if _r:
+        pipe = _r.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        gen = int(pipe.execute()[0])
+    else:
+        with _gens_lock:
+            for key in keys:
+                _local_gens[key] = _local_gens.get(key, 0) + 1
+            gen = _local_gens[keys[0]]
+    with _gens_lock:
+        _gen_stats["bumps"] += 1
+    return gen
+
+def note_invalidations(kind: str, n: int = 1) -> None:
+    """Count cached values (by kind: retr, chunk, ...) found stale on read."""
+    if n:
+        with _gens_lock:
+            _gen_stats["invalidations"][kind] = _gen_stats["invalidations"].get(kind, 0) + n
+
+# ---- single-flight ----
+# The first caller to miss on a key (the leader) computes the value; concurrent
+# callers for the same key wait for it instead of calling upstream themselves:
+# - same process: wait for the leader's result directly
+# - other processes: the leader holds a short Redis lease (sf:<key>, SET NX PX);
+#   callers that lose it poll the cache until the value appears or the lease
+#   goes away, then compute only if there is still nothing cached
+# compute() must write the value to the cache; read() returns it from the cache or None.
+# A failed or timed-out leader does not fail its followers: they compute themselves.
+
+T = TypeVar("T")
+
+_FAILED = object()
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = _FAILED
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_sf_stats = {"computed": {}, "saved_local": {}, "saved_remote": {}}
+
+def _sf_count(kind: str, key: str) -> None:
+    with _flights_lock:
+        counts = _sf_stats[kind]
+        counts[_prefix(key)] = counts.get(_prefix(key), 0) + 1
+
+def _sf_snapshot() -> dict[str, Any]:
+    with _flights_lock:
+        out = {kind: dict(counts) for kind, counts in _sf_stats.items()}
+    out["saved"] = sum(out["saved_local"].values()) + sum(out["saved_remote"].values())
+    return out
+
+def _lease_key(key: str) -> str:
+    return f"sf:{key}"
+
+def _lead(key: str, compute: Callable[[], T], read: Callable[[], Optional[T]]) -> tuple[T, bool]:
+    """Compute under the cross-process lease, or wait for the process holding it."""
+    if _r:
+        token = uuid.uuid4().hex
+        lease = _lease_key(key)
+        if not _r.set(lease, token, nx=True, px=SINGLE_FLIGHT_LEASE_MS):
+            while True:
+                _l1.drop_negative(key)
+                value = read()
+                if value is not None:
+                    _sf_count("saved_remote", key)
+                    return value, True
+                if not _r.exists(lease):
+                    break
+                time.sleep(SINGLE_FLIGHT_POLL_MS / 1000)
+            _l1.drop_negative(key)
+            value = read()
+            if value is not None:
+                _sf_count("saved_remote", key)
+                return value, True
+        else:
+            try:
+                _sf_count("computed", key)
+                return compute(), False
+            finally:
+                if _r.get(lease) == token:
+                    _r.delete(lease)
+    _sf_count("computed", key)
+    return compute(), False
+
+def single_flight(
+    key: str, compute: Callable[[], T], read: Callable[[], Optional[T]],
+) -> tuple[T, bool]:
+    """(value, shared): shared is True when another caller's computation produced the value."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return compute(), False
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(SINGLE_FLIGHT_LEASE_MS / 1000)
+        if flight.value is not _FAILED:
+            _sf_count("saved_local", key)
+            return flight.value, True
+        _sf_count("computed", key)
+        return compute(), False
+    try:
+        value, shared = _lead(key, compute, read)
+        flight.value = value
+        return value, shared
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+# ---- binary vector codec ----
+# header: magic(4) | dtype code(1) | pad(3) | dim uint32 | int8 scale float32
+
+_VEC_MAGIC = b"VEC1"
+_VEC_HEADER = struct.Struct("<4sB3xIf")
+_VEC_DTYPES = {"float32": 0, "float16": 1, "int8": 2}
+_VEC_NP = {0: np.float32, 1: np.float16, 2: np.int8}
+
+def encode_vec(vec, dtype: str = EMBED_CACHE_DTYPE) -> bytes:
+    code = _VEC_DTYPES[dtype]
+    arr = np.asarray(vec, dtype=np.float32).ravel()
+    scale = 0.0
+    if code == 2:
+        amax = float(np.abs(arr).max()) if arr.size else 0.0
+        scale = amax / 127.0 if amax > 0 else 1.0
+        body = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+    else:
+        body = arr.astype(_VEC_NP[code], copy=False)
+    return _VEC_HEADER.pack(_VEC_MAGIC, code, arr.size, scale) + body.tobytes()
+
+def decode_vec(raw: bytes) -> np.ndarray:
+    """
+    float32/float16 payloads come back as zero-copy read-only views over raw;
+    int8 payloads are dequantized to float32.
+    """
+    magic, code, dim, scale = _VEC_HEADER.unpack_from(raw)
+    if magic != _VEC_MAGIC:
+        raise ValueError("not a binary vector payload")
+    arr = np.frombuffer(raw, dtype=_VEC_NP[code], count=dim, offset=_VEC_HEADER.size)
+    if code == 2:
+        return arr.astype(np.float32) * np.float32(scale)
+    return arr
+
+def get_vec(key: str) -> Optional[np.ndarray]:
+    """
+    Reads binary payloads, and falls back to legacy JSON ({"vec": [...]})
+    entries, which are re-written in binary form keeping their remaining TTL.
+    """
+    v = _l1.get(key)
+    if v is not None:
+        return None if v is _MISSING else v
+    if not _rb:
+        return None
+    raw = _rb.get(key)
+    if not raw:
+        _miss(key)
+        return None
+
+    if raw[:len(_VEC_MAGIC)] == _VEC_MAGIC:
+        vec = decode_vec(raw)
+        _l1.put(key, vec, size_bytes=len(raw))
+        return vec
+
+    legacy = json.loads(raw)
+    vec = np.asarray(legacy["vec"] if isinstance(legacy, dict) else legacy, dtype=np.float32)
+    ttl = _rb.ttl(key)
+    if ttl and ttl > 0:
+        set_vec(key, vec, ttl_seconds=ttl)
+    return vec
+
+def set_vec(key: str, vec, ttl_seconds: int, dtype: str = EMBED_CACHE_DTYPE) -> None:
+    raw = encode_vec(vec, dtype=dtype)
+    _l1.put(key, decode_vec(raw), size_bytes=len(raw), ttl_seconds=ttl_seconds)
+    if not _rb:
+        return
+    _rb.setex(key, ttl_seconds, raw)
+
+# ---- asyncio variants ----
+
+def _ar():
+    return async_redis_client()
+
+def _arb():
+    return async_redis_client(binary=True)
+
+def _amiss(r, key: str) -> None:
+    if r:
+        _l1.put_negative(key)
+
+async def aget_json(key: str) -> Optional[Any]:
+    v = _l1.get(key)
+    if v is not None:
+        return None if v is _MISSING else v
+    r = _ar()
+    if not r:
+        return None
+    raw = await r.get(key)
+    if not raw:
+        _amiss(r, key)
+        return None
+    v = json.loads(raw)
+    _l1.put(key, v, size_bytes=len(raw))
+    return v
+
+async def aset_json(key: str, value: Any, ttl_seconds: int) -> None:
+    raw = json.dumps(value, ensure_ascii=False)
+    _l1.put(key, value, size_bytes=len(raw), ttl_seconds=ttl_seconds)
+    r = _ar()
+    if r:
+        await r.setex(key, ttl_seconds, raw)
+
+async def aget_many(keys: list[str]) -> list[Optional[Any]]:
+    out: list[Optional[Any]] = [None] * len(keys)
+    remote: list[int] = []
+    for i, key in enumerate(keys):
+        v = _l1.get(key)
+        if v is None:
+            remote.append(i)
+        elif v is not _MISSING:
+            out[i] = v
+
+    r = _ar()
+    if not r or not remote:
+        return out
+
+    vals = await r.mget([keys[i] for i in remote])
+    for i, raw in zip(remote, vals):
+        if raw:
+            out[i] = json.loads(raw)
+            _l1.put(keys[i], out[i], size_bytes=len(raw))
+        else:
+            _amiss(r, keys[i])
+    return out
+
+async def aset_many(items: dict[str, Any], ttl_seconds: int) -> None:
+    if not items:
+        return
+    r = _ar()
+    pipe = r.pipeline(transaction=False) if r else None
+    for key, value in items.items():
+        raw = json.dumps(value, ensure_ascii=False)
+        _l1.put(key, value, size_bytes=len(raw), ttl_seconds=ttl_seconds)
+        if pipe is not None:
+            pipe.setex(key, ttl_seconds, raw)
+    if pipe is not None:
+        await pipe.execute()
+
+async def aget_vec(key: str) -> Optional[np.ndarray]:
+    v = _l1.get(key)
+    if v is not None:
+        return None if v is _MISSING else v
+    r = _arb()
+    if not r:
+        return None
+    raw = await r.get(key)
+    if not raw:
+        _amiss(r, key)
+        return None
+
+    if raw[:len(_VEC_MAGIC)] == _VEC_MAGIC:
+        vec = decode_vec(raw)
+        _l1.put(key, vec, size_bytes=len(raw))
+        return vec
+
+    legacy = json.loads(raw)
+    vec = np.asarray(legacy["vec"] if isinstance(legacy, dict) else legacy, dtype=np.float32)
+    ttl = await r.ttl(key)
+    if ttl and ttl > 0:
+        await aset_vec(key, vec, ttl_seconds=ttl)
+    return vec
+
+async def aset_vec(key: str, vec, ttl_seconds: int, dtype: str = EMBED_CACHE_DTYPE) -> None:
+    raw = encode_vec(vec, dtype=dtype)
+    _l1.put(key, decode_vec(raw), size_bytes=len(raw), ttl_seconds=ttl_seconds)
+    r = _arb()
+    if r:
+        await r.setex(key, ttl_seconds, raw)
+
+async def ageneration(namespace: str) -> int:
+    key = _ns_gen_key(namespace)
+    r = _ar()
+    if r:
+        return int(await r.get(key) or 0)
+    return _local_gen_values([key])[0]
+
+async def avideo_generations(video_ids: list[str]) -> dict[str, int]:
+    if not video_ids:
+        return {}
+    keys = [_video_gen_key(v) for v in video_ids]
+    r = _ar()
+    vals = [int(v or 0) for v in await r.mget(keys)] if r else _local_gen_values(keys)
+    return dict(zip(video_ids, vals))
+
+async def _alead(
+    key: str, compute: Callable[[], Awaitable[T]], read: Callable[[], Awaitable[Optional[T]]],
+) -> tuple[T, bool]:
+    r = _ar()
+    if r:
+        token = uuid.uuid4().hex
+        lease = _lease_key(key)
+        if not await r.set(lease, token, nx=True, px=SINGLE_FLIGHT_LEASE_MS):
+            while True:
+                _l1.drop_negative(key)
+                value = await read()
+                if value is not None:
+                    _sf_count("saved_remote", key)
+                    return value, True
+                if not await r.exists(lease):
+                    break
+                await asyncio.sleep(SINGLE_FLIGHT_POLL_MS / 1000)
+            _l1.drop_negative(key)
+            value = await read()
+            if value is not None:
+                _sf_count("saved_remote", key)
+                return value, True
+        else:
+            try:
+                _sf_count("computed", key)
+                return await compute(), False
+            finally:
+                if await r.get(lease) == token:
+                    await r.delete(lease)
+    _sf_count("computed", key)
+    return await compute(), False
+
+async def asingle_flight(
+    key: str, compute: Callable[[], Awaitable[T]], read: Callable[[], Awaitable[Optional[T]]],
+) -> tuple[T, bool]:
+    """Async single_flight; in-process coalescing is per event loop."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return await compute(), False
+    flights: dict[str, asyncio.Future] = loop_local(("single_flight",), dict)
+    fut = flights.get(key)
+    if fut is not None:
+        # shield: a cancelled follower must not cancel the leader's future
+        value = await asyncio.shield(fut)
+        if value is not _FAILED:
+            _sf_count("saved_local", key)
+            return value, True
+        _sf_count("computed", key)
+        return await compute(), False
+    fut = flights[key] = asyncio.get_running_loop().create_future()
+    value: Any = _FAILED
+    try:
+        value, shared = await _alead(key, compute, read)
+        return value, shared
+    finally:
+        flights.pop(key, None)
+        fut.set_result(value)
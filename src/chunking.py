@@ -1,4 +1,33 @@
+"""
+Transcript chunking with content-defined, segment-aligned boundaries.
+
+Chunks always start and end on transcript segment edges. Whether a segment
+edge closes a chunk depends only on that segment's own text (a hash), once the
+chunk holds at least half the target size; chunks are cut at twice the target
+regardless. Boundaries therefore do not move when text is appended or edited
+elsewhere: an edit changes the chunk ids of its own region and the cut points
+realign right after it, so re-ingesting a re-fetched transcript only re-embeds
+what changed. Segments ending a sentence are more likely to close a chunk.
+
+Overlap is made of whole trailing segments of the previous chunk (at most
+the overlap size), and the overlapping chunk starts at the first of them.
+Overlap counts toward the chunk's size, so no chunk exceeds twice the target
+by more than its last segment.
+
+Sizes are characters by default; chunk_tokens > 0 (callers pass CHUNK_TOKENS) measures
+chunks and overlap in embedding-model tokens instead, summed per segment with
+the cached tiktoken encoder (src/tokens.py).
+
+iter_chunks consumes segments as a stream and yields chunks as they close.
+Ingestion still uses chunk_transcript (a list per video): the insert and embed
+stages work on a whole video's rows at once.
+"""
+
+import hashlib
+from collections import deque
 from dataclasses import dataclass
+from typing import Iterable, Iterator
+from src.tokens import count_tokens
 
 @dataclass
 class ChunkObj:
@@ -6,45 +35,67 @@ class ChunkObj:
     start: int
     end: int
 
-def chunk_transcript(items: list[dict], chunk_chars: int, overlap_chars: int) -> list[ChunkObj]:
-    chunks: list[ChunkObj] = []
-    buf: list[str] = []
-    buf_len = 0
-    buf_start = None
-    buf_end = None
-
-    def flush():
-        nonlocal buf, buf_len, buf_start, buf_end
-        if not buf:
-            return
-        text = " ".join(buf).strip()
-        chunks.append(ChunkObj(text=text, start=int(buf_start or 0), end=int(buf_end or (buf_start or 0))))
-
-        if overlap_chars > 0 and len(text) > overlap_chars:
-            tail = text[-overlap_chars:]
-            buf = [tail]
-            buf_len = len(tail)
-            buf_start = chunks[-1].end
-            buf_end = chunks[-1].end
-        else:
-            buf, buf_len, buf_start, buf_end = [], 0, None, None
+_SENTENCE_END = (".", "?", "!")
+_SENTENCE_WEIGHT = 4
+_HASH_MAX = 2 ** 64
+
+def _cut_here(text: str, size: int, span: int) -> bool:
+    """Deterministic per-segment coin: P ~ size / span, so chunks average ~span past the minimum."""
+    weight = size * (_SENTENCE_WEIGHT if text.endswith(_SENTENCE_END) else 1)
+    h = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return h < _HASH_MAX * min(1.0, weight / span)
+
+def _chars(text: str) -> int:
+    return len(text) + 1   # joined with a space
+
+def iter_chunks(items: Iterable[dict], chunk_chars: int, overlap_chars: int,
+                chunk_tokens: int = 0, overlap_tokens: int = 0) -> Iterator[ChunkObj]:
+    if chunk_tokens > 0:
+        target, overlap, size_of = chunk_tokens, overlap_tokens, count_tokens
+    else:
+        target, overlap, size_of = chunk_chars, overlap_chars, _chars
+    min_size = max(1, target // 2)
+    max_size = 2 * target
+    span = max(1, target - min_size)
+
+    carry: list[tuple[str, float, float, int]] = []   # overlap segments from the previous chunk
+    own: list[tuple[str, float, float, int]] = []     # segments that belong to this chunk (text, start, end, size)
+    own_size = 0
+    carry_size = 0
+
+    def close() -> ChunkObj:
+        segs = carry + own
+        return ChunkObj(text=" ".join(s[0] for s in segs), start=int(segs[0][1]), end=int(own[-1][2]))
+
+    def tail() -> list[tuple[str, float, float, int]]:
+        out: deque = deque()
+        size = 0
+        for seg in reversed(own):
+            size += seg[3]
+            if size > overlap or len(out) + 1 >= len(own):
+                break
+            out.appendleft(seg)
+        return list(out)
 
     for seg in items:
         t = (seg.get("text") or "").strip()
         if not t:
             continue
         s = float(seg.get("start", 0.0))
-        e = s + float(seg.get("duration", 0.0))
-
-        if buf_start is None:
-            buf_start = s
-        buf_end = e
+        n = size_of(t)
+        own.append((t, s, s + float(seg.get("duration", 0.0)), n))
+        own_size += n
+        size = carry_size + own_size
 
-        buf.append(t)
-        buf_len += len(t) + 1
+        if size >= max_size or (size >= min_size and _cut_here(t, n, span)):
+            yield close()
+            carry = tail() if overlap > 0 else []
+            carry_size = sum(s[3] for s in carry)
+            own, own_size = [], 0
 
-        if buf_len >= chunk_chars:
-            flush()
+    if own:
+        yield close()
 
-    flush()
-    return chunks
+def chunk_transcript(items: list[dict], chunk_chars: int, overlap_chars: int,
+                     chunk_tokens: int = 0, overlap_tokens: int = 0) -> list[ChunkObj]:
+    return list(iter_chunks(items, chunk_chars, overlap_chars, chunk_tokens, overlap_tokens))
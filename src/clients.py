@@ -0,0 +1,154 @@
+"""
+Long-lived, shared clients for OpenAI, Pinecone and Redis.
+
+Every call site used to construct its own ChatOpenAI / OpenAIEmbeddings /
+Pinecone client, which threw away TLS sessions and keep-alive connections on
+each chat turn. Clients here are created once per key and reused:
+
+- chat models per (model, temperature)
+- embedding models per model
+- Pinecone Index handles per index name
+
+All OpenAI clients share one pooled keep-alive httpx.Client; Redis uses a
+blocking connection pool. Pool sizes and timeouts come from config.
+
+The async_* variants serve the asyncio retrieval path. They are cached per
+event loop (src/aio.loop_local) because async connections cannot cross loops.
+"""
+
+import threading
+from typing import Any, Callable, Optional
+import httpx
+import redis
+import redis.asyncio as aioredis
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from pinecone import Pinecone
+from src.config import (
+    OPENAI_API_KEY, PINECONE_API_KEY, REDIS_URL, CHAT_MODEL, EMBED_MODEL,
+    OPENAI_TIMEOUT_S, OPENAI_MAX_RETRIES, HTTP_POOL_SIZE, HTTP_KEEPALIVE_S,
+    PINECONE_POOL_THREADS, REDIS_MAX_CONNECTIONS, REDIS_TIMEOUT_S,
+)
+from src.aio import loop_local
+
+_lock = threading.RLock()
+_clients: dict[tuple, Any] = {}
+
+def _get_or_create(key: tuple, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+def _http_client() -> httpx.Client:
+    return _get_or_create(("http",), lambda: httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_S,
+        ),
+        timeout=OPENAI_TIMEOUT_S,
+    ))
+
+def chat_llm(model: str = CHAT_MODEL, temperature: float = 0.0) -> ChatOpenAI:
+    return _get_or_create(("chat", model, float(temperature)), lambda: ChatOpenAI(
+        model=model,
+        api_key=OPENAI_API_KEY,
+        temperature=temperature,
+        timeout=OPENAI_TIMEOUT_S,
+        max_retries=OPENAI_MAX_RETRIES,
+        stream_usage=True,   # token counts for streamed answers (metrics)
+        http_client=_http_client(),
+    ))
+
+def embeddings(model: str = EMBED_MODEL) -> OpenAIEmbeddings:
+    return _get_or_create(("embed", model), lambda: OpenAIEmbeddings(
+        model=model,
+        api_key=OPENAI_API_KEY,
+        timeout=OPENAI_TIMEOUT_S,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=_http_client(),
+    ))
+
+def pinecone_client() -> Pinecone:
+    return _get_or_create(("pinecone",), lambda: Pinecone(
+        api_key=PINECONE_API_KEY,
+        pool_threads=PINECONE_POOL_THREADS,
+    ))
+
+def pinecone_index(name: str):
+    return _get_or_create(("pinecone_index", name), lambda: pinecone_client().Index(
+        name,
+        pool_threads=PINECONE_POOL_THREADS,
+    ))
+
+def redis_client(binary: bool = False) -> Optional[redis.Redis]:
+    """Text client by default; binary=True returns raw bytes (separate pool)."""
+    if not REDIS_URL:
+        return None
+    return _get_or_create(("redis", binary), lambda: redis.Redis(
+        connection_pool=redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_TIMEOUT_S,
+            socket_timeout=REDIS_TIMEOUT_S,
+            socket_connect_timeout=REDIS_TIMEOUT_S,
+            socket_keepalive=True,
+            health_check_interval=30,
+            decode_responses=not binary,
+        )
+    ))
+
+# =========================
+# asyncio (one instance per event loop)
+# =========================
+
+def _async_http_client() -> httpx.AsyncClient:
+    return loop_local(("http",), lambda: httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_S,
+        ),
+        timeout=OPENAI_TIMEOUT_S,
+    ))
+
+def async_chat_llm(model: str = CHAT_MODEL, temperature: float = 0.0) -> ChatOpenAI:
+    """Chat model for ainvoke/astream on the running loop."""
+    return loop_local(("chat", model, float(temperature)), lambda: ChatOpenAI(
+        model=model,
+        api_key=OPENAI_API_KEY,
+        temperature=temperature,
+        timeout=OPENAI_TIMEOUT_S,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_async_client=_async_http_client(),
+    ))
+
+def async_embeddings(model: str = EMBED_MODEL) -> OpenAIEmbeddings:
+    return loop_local(("embed", model), lambda: OpenAIEmbeddings(
+        model=model,
+        api_key=OPENAI_API_KEY,
+        timeout=OPENAI_TIMEOUT_S,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_async_client=_async_http_client(),
+    ))
+
+def async_redis_client(binary: bool = False) -> Optional[aioredis.Redis]:
+    if not REDIS_URL:
+        return None
+    return loop_local(("redis", binary), lambda: aioredis.Redis(
+        connection_pool=aioredis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_TIMEOUT_S,
+            socket_timeout=REDIS_TIMEOUT_S,
+            socket_connect_timeout=REDIS_TIMEOUT_S,
+            socket_keepalive=True,
+            health_check_interval=30,
+            decode_responses=not binary,
+        )
+    ))
@@ -43,6 +43,29 @@ PINECONE_INDEX = _get("PINECONE_INDEX", "youtube-rag")
 PINECONE_CLOUD = _get("PINECONE_CLOUD", "aws")
 PINECONE_REGION = _get("PINECONE_REGION", "us-east-1")
 
+# =========================
+# Vector store backend: pinecone | local
+# =========================
+
+VECTOR_BACKEND = _get("VECTOR_BACKEND", "pinecone")
+LOCAL_VECTOR_DIR = _get("LOCAL_VECTOR_DIR", "data/vectors")
+
+# Local backend search: exact | hnsw (graph is built once a namespace reaches ANN_MIN_ROWS).
+# eval/bench_ann.py (dim 256, k=30): exact search is ~8 ms at 50k rows and ~16 ms at 100k;
+# the graph only beats it at >= 0.9 recall around 50k rows (ef=384: 0.93 recall, ~6 ms),
+# so exact is the default and hnsw is opt-in for namespaces past that size.
+LOCAL_ANN = _get("LOCAL_ANN", "exact")
+ANN_MIN_ROWS = int(_get("ANN_MIN_ROWS", "50000"))
+ANN_M = int(_get("ANN_M", "16"))
+ANN_EF_CONSTRUCTION = int(_get("ANN_EF_CONSTRUCTION", "100"))
+ANN_EF_SEARCH = int(_get("ANN_EF_SEARCH", "384"))
+# rows not in the graph yet are searched exactly; upserts extend it once this many pile up
+ANN_INSERT_BATCH = int(_get("ANN_INSERT_BATCH", "1000"))
+# hnsw.npz is rewritten after this many new graph rows, and at the end of each ingest run
+ANN_SAVE_EVERY = int(_get("ANN_SAVE_EVERY", "5000"))
+# filters leaving at most this many rows are answered exactly (a 20k-row filter: ~11 ms exact vs ~27 ms graph)
+ANN_FILTER_EXACT_MAX = int(_get("ANN_FILTER_EXACT_MAX", "20000"))
+
 # =========================
 # Database (NO localhost fallback on cloud)
 # =========================
@@ -61,6 +84,39 @@ if not DATABASE_URL:
 
 REDIS_URL = _get("REDIS_URL", "")
 
+# In-process L1 tier in front of Redis (0 bytes disables it)
+L1_CACHE_MAX_BYTES = int(_get("L1_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+L1_CACHE_TTL_S = int(_get("L1_CACHE_TTL_S", "300"))
+L1_NEGATIVE_TTL_S = int(_get("L1_NEGATIVE_TTL_S", "5"))
+L1_PREFIX_LIMITS = _get("L1_PREFIX_LIMITS", "qembed:2000,chunk:20000,retr:2000,rewrite:5000")
+
+# Binary encoding for cached embedding vectors: float32 | float16 | int8
+EMBED_CACHE_DTYPE = _get("EMBED_CACHE_DTYPE", "float32")
+
+# Cached vector-search results are checked against the namespace generation on
+# read (bumped by ingestion), so they can live long
+RETRIEVAL_CACHE_TTL_S = int(_get("RETRIEVAL_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+# Single-flight: concurrent misses on the same rewrite/qembed/retr key share one
+# upstream call (in-process wait + a Redis lease across processes)
+SINGLE_FLIGHT_ENABLED = _get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_LEASE_MS = int(_get("SINGLE_FLIGHT_LEASE_MS", "10000"))
+SINGLE_FLIGHT_POLL_MS = int(_get("SINGLE_FLIGHT_POLL_MS", "25"))
+
+# =========================
+# Clients / connection pools
+# =========================
+
+OPENAI_TIMEOUT_S = float(_get("OPENAI_TIMEOUT_S", "60"))
+OPENAI_MAX_RETRIES = int(_get("OPENAI_MAX_RETRIES", "2"))
+HTTP_POOL_SIZE = int(_get("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_S = float(_get("HTTP_KEEPALIVE_S", "30"))
+
+PINECONE_POOL_THREADS = int(_get("PINECONE_POOL_THREADS", "4"))
+
+REDIS_MAX_CONNECTIONS = int(_get("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_TIMEOUT_S = float(_get("REDIS_TIMEOUT_S", "2"))
+
 # =========================
 # App Config
 # =========================
@@ -69,10 +125,77 @@ NAMESPACE = _get("NAMESPACE", "prodv1")
 
 CHUNK_CHARS = int(_get("CHUNK_CHARS", "900"))
 CHUNK_OVERLAP_CHARS = int(_get("CHUNK_OVERLAP_CHARS", "150"))
+# > 0: size chunks (and their overlap) in embedding-model tokens instead of characters
+CHUNK_TOKENS = int(_get("CHUNK_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(_get("CHUNK_OVERLAP_TOKENS", "40"))
 
 FETCH_K = int(_get("FETCH_K", "30"))
 TOP_K = int(_get("TOP_K", "6"))
 RERANK_TOP_N = int(_get("RERANK_TOP_N", "6"))
+# prompt context, in chat-model tokens (0 = no limit); see src/context.py
+CONTEXT_TOKEN_BUDGET = int(_get("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# Rewrite gate: off | heuristic | embedding (heuristic + similarity to the last rewritten query)
+# off by default until `python -m eval.run_eval --compare-rewrite` shows unchanged retrieval quality
+REWRITE_GATING = _get("REWRITE_GATING", "off")
+REWRITE_MIN_WORDS = int(_get("REWRITE_MIN_WORDS", "5"))
+REWRITE_SIM_THRESHOLD = float(_get("REWRITE_SIM_THRESHOLD", "0.9"))
+
+# Reranker: local (MMR over candidate vectors + lexical score, CPU only) | llm (chat model picks).
+# local needs the candidate vectors, an extra fetch round trip per question on Pinecone
+RERANKER = _get("RERANKER", "llm" if VECTOR_BACKEND == "pinecone" else "local")
+RERANK_MMR_LAMBDA = float(_get("RERANK_MMR_LAMBDA", "0.7"))
+RERANK_LEXICAL_WEIGHT = float(_get("RERANK_LEXICAL_WEIGHT", "0.3"))
+
+# Semantic answer cache: reuse answers for near-duplicate (rewritten) queries per namespace + filter
+SEMANTIC_CACHE_ENABLED = _get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(_get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_S = int(_get("SEMANTIC_CACHE_TTL_S", str(6 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(_get("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+
+# Async retrieval (src/retrieve_async.py): the app prepares answers through the stage DAG
+ASYNC_RETRIEVAL = _get("ASYNC_RETRIEVAL", "false").lower() == "true"
+ASYNC_STAGE_TIMEOUTS = _get(
+    "ASYNC_STAGE_TIMEOUTS",
+    "rewrite:15,embed:15,semantic:2,vector:10,lexical:3,fuse:1,hydrate:10,vectors:5,rerank:30,titles:5,prompt:5,generate:90",
+)
+
+# Hybrid retrieval: BM25 over chunk text fused with vector matches (reciprocal rank fusion)
+HYBRID_RETRIEVAL = _get("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_CANDIDATES = int(_get("HYBRID_CANDIDATES", "20"))   # fused candidates passed to rerank
+RRF_K = int(_get("RRF_K", "60"))
+BM25_DIR = _get("BM25_DIR", "data/bm25")
+BM25_K1 = float(_get("BM25_K1", "1.2"))
+BM25_B = float(_get("BM25_B", "0.75"))
+
+# =========================
+# Ingestion pipeline (workers per stage, requests/sec; 0 = unlimited)
+# =========================
+
+INGEST_TRANSCRIPT_WORKERS = int(_get("INGEST_TRANSCRIPT_WORKERS", "4"))
+INGEST_TRANSCRIPT_RPS = float(_get("INGEST_TRANSCRIPT_RPS", "2"))
+INGEST_CHUNK_WORKERS = int(_get("INGEST_CHUNK_WORKERS", "2"))
+INGEST_DB_WORKERS = int(_get("INGEST_DB_WORKERS", "4"))
+INGEST_EMBED_WORKERS = int(_get("INGEST_EMBED_WORKERS", "4"))
+INGEST_EMBED_RPS = float(_get("INGEST_EMBED_RPS", "5"))
+INGEST_UPSERT_WORKERS = int(_get("INGEST_UPSERT_WORKERS", "4"))
+INGEST_UPSERT_RPS = float(_get("INGEST_UPSERT_RPS", "0"))
+INGEST_EMBED_LINGER_MS = int(_get("INGEST_EMBED_LINGER_MS", "200"))
+
+# Embedding batcher (OpenAI limits: 300k tokens / 2048 inputs per request)
+EMBED_BATCH_MAX_TOKENS = int(_get("EMBED_BATCH_MAX_TOKENS", "200000"))
+EMBED_BATCH_MAX_INPUTS = int(_get("EMBED_BATCH_MAX_INPUTS", "1000"))
+EMBED_BATCH_CONCURRENCY = int(_get("EMBED_BATCH_CONCURRENCY", "4"))
+EMBED_BATCH_MAX_RETRIES = int(_get("EMBED_BATCH_MAX_RETRIES", "6"))
+
+# Content-addressed embedding store (Postgres), consulted before calling OpenAI
+EMBED_STORE_ENABLED = _get("EMBED_STORE_ENABLED", "true").lower() == "true"
+
+# =========================
+# Metrics (src/metrics.py): Prometheus text on http://<host>:METRICS_PORT/metrics, 0 = off
+# =========================
+
+METRICS_PORT = int(_get("METRICS_PORT", "0"))
 
 # =========================
 # Optional: LangSmith
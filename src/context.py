@@ -0,0 +1,90 @@
+"""
+Context packing for the generation prompt.
+
+pack() takes the reranked chunks (best first) and returns the passages to show:
+- chunks are taken in rank order while their new tokens fit the budget
+  (CONTEXT_TOKEN_BUDGET chat-model tokens, 0 = no limit); one that does not fit
+  is skipped and a later, smaller one may still fit. The best chunk is always
+  kept, cut to the budget if it is larger on its own.
+- chunks of one video that overlap or touch in time are merged into a single
+  passage, and the text repeated by the chunker's overlap is dropped, so the
+  budget is not spent twice on the same words
+- passages are ordered by their best chunk's rank
+"""
+
+from dataclasses import dataclass, field
+from src.config import CHAT_MODEL, CONTEXT_TOKEN_BUDGET
+from src.tokens import count_tokens, encoder
+
+MERGE_GAP_S = 1   # chunk times are whole seconds
+
+@dataclass
+class Passage:
+    video_id: str
+    start: int
+    end: int
+    text: str
+    rank: int
+    tokens: int = 0
+    chunk_ids: list[str] = field(default_factory=list)
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is also a prefix of b."""
+    probe = b[:24]
+    if not probe:
+        return 0
+    i = a.find(probe, max(0, len(a) - len(b)))
+    while i != -1:
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(probe, i + 1)
+    return 0
+
+def _join(a: str, b: str) -> str:
+    ov = _overlap(a, b)
+    rest = b[ov:].strip()
+    return f"{a} {rest}" if rest else a
+
+def _merged(parts: list[Passage]) -> tuple[str, int, int]:
+    """(text, start, end) of time-ordered, overlapping or touching parts."""
+    parts = sorted(parts, key=lambda p: (p.start, p.end))
+    text, start, end = parts[0].text, parts[0].start, parts[0].end
+    for p in parts[1:]:
+        if p.end <= end and p.text in text:
+            continue
+        text = _join(text, p.text)
+        end = max(end, p.end)
+    return text, start, end
+
+def _truncate(text: str, budget: int, model: str) -> str:
+    enc = encoder(model)
+    return enc.decode(enc.encode(text, disallowed_special=())[:budget])
+
+def pack(chunks: list, budget: int = CONTEXT_TOKEN_BUDGET, model: str = CHAT_MODEL) -> list[Passage]:
+    """chunks: objects with id, video_id, start, end, text, best first."""
+    passages: list[Passage] = []
+    used = 0
+    for rank, c in enumerate(chunks):
+        new = Passage(c.video_id, int(c.start), int(c.end), c.text, rank, chunk_ids=[c.id])
+        touching = [
+            p for p in passages
+            if p.video_id == c.video_id and p.start <= new.end + MERGE_GAP_S and new.start <= p.end + MERGE_GAP_S
+        ]
+        text, start, end = _merged(touching + [new]) if touching else (new.text, new.start, new.end)
+        tokens = count_tokens(text, model)
+        added = tokens - sum(p.tokens for p in touching)
+
+        if budget and used + added > budget:
+            if passages:
+                continue
+            text = _truncate(text, budget, model)
+            tokens = added = count_tokens(text, model)
+
+        for p in touching:
+            passages.remove(p)
+            new.chunk_ids = p.chunk_ids + new.chunk_ids
+        new.text, new.start, new.end, new.tokens = text, start, end, tokens
+        new.rank = min([rank] + [p.rank for p in touching])
+        passages.append(new)
+        used += added
+    return sorted(passages, key=lambda p: p.rank)
@@ -1,4 +1,6 @@
+from typing import Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 from src.config import DATABASE_URL
 
@@ -6,3 +8,69 @@ engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 Base = declarative_base()
+
+def insert_ignore(table):
+    """INSERT that silently skips rows violating any unique constraint, for the active dialect."""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+    from sqlalchemy import insert
+    return insert(table).prefix_with("IGNORE")
+
+def insert_replace(table, conflict: list[str], update: list[str]):
+    """
+    INSERT ... ON CONFLICT (conflict) DO UPDATE SET update, only where a value changes,
+    so RETURNING yields inserted and replaced rows. PostgreSQL / SQLite.
+    """
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"insert_replace is not supported on {dialect}")
+    from sqlalchemy import or_
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=conflict,
+        set_={c: stmt.excluded[c] for c in update},
+        where=or_(*[table.c[c] != stmt.excluded[c] for c in update]),
+    )
+
+def _async_url(url: str) -> Optional[str]:
+    """postgresql+asyncpg:// form of url when it is Postgres and asyncpg (+ greenlet) is installed."""
+    u = make_url(url)
+    if u.get_backend_name() != "postgresql":
+        return None
+    try:
+        import asyncpg  # noqa: F401
+        import greenlet  # noqa: F401
+    except ImportError:
+        return None
+    query = dict(u.query)
+    # libpq options asyncpg does not understand (Neon URLs carry both)
+    sslmode = query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    if sslmode and sslmode != "disable":
+        query["ssl"] = "require"
+    return u.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+def async_session_factory():
+    """
+    async_sessionmaker bound to the running event loop, or None when async
+    Postgres is unavailable (callers then run the sync query in a thread).
+    """
+    if ASYNC_DATABASE_URL is None:
+        return None
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from src.aio import loop_local
+    return loop_local(("db",), lambda: async_sessionmaker(
+        create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True),
+        expire_on_commit=False,
+    ))
@@ -0,0 +1,169 @@
+"""
+Token-aware embedding batcher.
+
+Collects (key, text) items (possibly from many videos), packs them into
+requests bounded by token count and input count, sends the requests
+concurrently with retry/backoff on rate limits (429), and routes vectors
+back to their keys. Throughput is tracked in chunks/sec and tokens/sec over
+the time spent inside embed() calls, so idle gaps of a shared batcher do not count.
+
+Before anything is sent, texts are looked up in the content-addressed
+embedding store; identical texts within a call are embedded once.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, Optional
+from src.config import (
+    EMBED_MODEL, EMBED_BATCH_MAX_TOKENS, EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_CONCURRENCY, EMBED_BATCH_MAX_RETRIES, EMBED_STORE_ENABLED,
+)
+from src.clients import embeddings
+from src import embed_store
+from src.ratelimit import RateLimiter
+from src.tokens import count_tokens
+
+def _is_rate_limit(e: Exception) -> bool:
+    if getattr(e, "status_code", None) == 429:
+        return True
+    return type(e).__name__ == "RateLimitError"
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        model: str = EMBED_MODEL,
+        max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+        max_inputs: int = EMBED_BATCH_MAX_INPUTS,
+        concurrency: int = EMBED_BATCH_CONCURRENCY,
+        max_retries: int = EMBED_BATCH_MAX_RETRIES,
+        rate_limiter: Optional[RateLimiter] = None,
+        use_store: bool = EMBED_STORE_ENABLED,
+    ):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_inputs = max_inputs
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.use_store = use_store
+        self._lock = threading.Lock()
+        self._active = 0
+        self._busy_since = 0.0
+        self._busy_s = 0.0
+        self.stats = {"chunks": 0, "store_hits": 0, "tokens": 0, "requests": 0, "retries": 0}
+
+    def pack(self, items: list[tuple[Hashable, str]]) -> list[list[tuple[Hashable, str, int]]]:
+        """Greedy, order-preserving packing into batches within the token/input limits."""
+        batches: list[list[tuple[Hashable, str, int]]] = []
+        cur: list[tuple[Hashable, str, int]] = []
+        cur_tokens = 0
+        for key, text in items:
+            n = count_tokens(text, self.model)
+            if cur and (cur_tokens + n > self.max_tokens or len(cur) >= self.max_inputs):
+                batches.append(cur)
+                cur, cur_tokens = [], 0
+            cur.append((key, text, n))
+            cur_tokens += n
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def _send(self, batch: list[tuple[Hashable, str, int]]) -> list[list[float]]:
+        texts = [t for _, t, _ in batch]
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                vecs = embeddings(self.model).embed_documents(texts)
+                with self._lock:
+                    self.stats["requests"] += 1
+                return vecs
+            except Exception as e:
+                if not _is_rate_limit(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.stats["retries"] += 1
+                delay = _retry_after(e) or min(30.0, 0.5 * 2 ** attempt)
+                time.sleep(delay * (1 + random.random() * 0.25))
+
+    def embed(self, items: list[tuple[Hashable, str]]) -> dict[Hashable, list[float]]:
+        if not items:
+            return {}
+        with self._lock:
+            if self._active == 0:
+                self._busy_since = time.perf_counter()
+            self._active += 1
+        try:
+            return self._embed(items)
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    self._busy_s += time.perf_counter() - self._busy_since
+
+    def _embed(self, items: list[tuple[Hashable, str]]) -> dict[Hashable, list[float]]:
+        shas = {key: embed_store.text_key(text) for key, text in items}
+        known = embed_store.lookup(self.model, list(shas.values())) if self.use_store else {}
+        todo: dict[str, str] = {}
+        for key, text in items:
+            sha = shas[key]
+            if sha not in known and sha not in todo:
+                todo[sha] = text
+
+        batches = self.pack(list(todo.items()))
+        if len(batches) <= 1 or self.concurrency == 1:
+            results = [self._send(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                results = list(pool.map(self._send, batches))
+
+        fresh: dict[str, list[float]] = {}
+        tokens = 0
+        for batch, vecs in zip(batches, results):
+            for (sha, _, n), vec in zip(batch, vecs):
+                fresh[sha] = vec
+                tokens += n
+        if self.use_store:
+            embed_store.save(self.model, fresh)
+
+        out = {key: known[sha] if sha in known else fresh[sha] for key, sha in shas.items()}
+
+        with self._lock:
+            self.stats["chunks"] += len(items)
+            self.stats["store_hits"] += sum(1 for sha in shas.values() if sha in known)
+            self.stats["tokens"] += tokens
+        return out
+
+    def throughput(self) -> dict[str, float]:
+        """Totals plus chunks/sec and tokens/sec over the wall-clock time some embed() call was running."""
+        with self._lock:
+            s = dict(self.stats)
+            secs = self._busy_s + (time.perf_counter() - self._busy_since if self._active else 0.0)
+        return {
+            **s,
+            "seconds": secs,
+            "chunks_per_s": s["chunks"] / secs if secs > 0 else 0.0,
+            "tokens_per_s": s["tokens"] / secs if secs > 0 else 0.0,
+        }
+
+_batchers: dict[str, EmbeddingBatcher] = {}
+_batchers_lock = threading.Lock()
+
+def get_batcher(model: str = EMBED_MODEL) -> EmbeddingBatcher:
+    with _batchers_lock:
+        b = _batchers.get(model)
+        if b is None:
+            b = _batchers[model] = EmbeddingBatcher(model=model)
+        return b
@@ -0,0 +1,58 @@
+"""
+Content-addressed embedding store (Postgres table embedding_store).
+
+Keyed by (embed model, sha1 of normalized text) so that re-chunking
+experiments, force re-ingests and namespace copies only pay OpenAI for
+text that was never embedded before.
+"""
+
+import hashlib
+import unicodedata
+import numpy as np
+from sqlalchemy import select
+from src.db import SessionLocal, insert_ignore
+from src.models import StoredEmbedding
+
+_IN_BATCH = 500
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+def lookup(embed_model: str, keys: list[str]) -> dict[str, list[float]]:
+    """Stored vectors for the given text keys (missing keys are absent from the result)."""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    out: dict[str, list[float]] = {}
+    db = SessionLocal()
+    try:
+        for i in range(0, len(keys), _IN_BATCH):
+            rows = db.execute(
+                select(StoredEmbedding.text_sha, StoredEmbedding.vector).where(
+                    StoredEmbedding.embed_model == embed_model,
+                    StoredEmbedding.text_sha.in_(keys[i:i + _IN_BATCH]),
+                )
+            ).all()
+            for sha, blob in rows:
+                out[sha] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return out
+    finally:
+        db.close()
+
+def save(embed_model: str, vectors: dict[str, list[float]]) -> None:
+    if not vectors:
+        return
+    rows = []
+    for sha, vec in vectors.items():
+        arr = np.asarray(vec, dtype=np.float32)
+        rows.append({"embed_model": embed_model, "text_sha": sha, "dim": int(arr.size), "vector": arr.tobytes()})
+    db = SessionLocal()
+    try:
+        for i in range(0, len(rows), _IN_BATCH):
+            db.execute(insert_ignore(StoredEmbedding.__table__), rows[i:i + _IN_BATCH])
+        db.commit()
+    finally:
+        db.close()
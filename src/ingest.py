@@ -1,10 +1,15 @@
 import hashlib
 from sqlalchemy import select
-from langchain_openai import OpenAIEmbeddings
-from src.config import OPENAI_API_KEY, EMBED_MODEL
-from src.db import SessionLocal
+from src.config import EMBED_MODEL, EMBED_STORE_ENABLED, HYBRID_RETRIEVAL
+from src.embed_batch import get_batcher
+from src.db import SessionLocal, insert_replace
 from src.models import Video, Chunk, IngestionLog
-from src.pinecone_store import ensure_index
+from src.vector_store import get_store
+from src.bm25 import get_bm25
+from src.cache import bump_generation
+from src.metrics import span, inc
+
+INSERT_BATCH = 1000
 
 def stable_chunk_id(video_id: str, start: int, end: int, text: str) -> str:
     return hashlib.sha1(f"{video_id}|{start}|{end}|{text}".encode("utf-8")).hexdigest()
@@ -44,19 +49,26 @@ def mark_ingest(namespace: str, embed_model: str, video_id: str, status: str, er
     finally:
         db.close()
 
-def ingest_video(video_id: str, title: str | None, chunks: list, namespace: str, force: bool = False) -> dict:
+@span("insert", pipeline="ingest")
+def insert_video_chunks(
+    video_id: str, title: str | None, chunks: list, namespace: str | None = None,
+) -> tuple[list[dict], int, list[str]]:
     """
-    Returns stats dict.
-    Dedup:
-      - If ingestion_log says done and not force -> skip entire video
-      - Chunk primary key prevents duplicates; we only embed+upsert newly inserted chunks
+    Upserts the video row and inserts chunks that do not exist yet.
+    Returns (chunk rows to index as plain dicts, number newly inserted, replaced ids).
+    The rows are all chunks of the video, since vectors for text embedded before come
+    from the embedding store. With EMBED_STORE_ENABLED=false they are only the new
+    and replaced chunks once namespace already holds the video, so a re-ingest does
+    not embed unchanged text again.
+    A chunk whose span (video_id, start, end) is stored with other text replaces
+    that row; the old ids are returned so the caller can drop them from the indexes.
     """
-    if (not force) and already_ingested(namespace, EMBED_MODEL, video_id):
-        return {"video_id": video_id, "skipped": True, "new_chunks": 0}
+    by_span: dict[tuple[int, int], dict] = {}
+    for c in chunks:
+        cid = stable_chunk_id(video_id, int(c.start), int(c.end), c.text)
+        by_span[(int(c.start), int(c.end))] = {"id": cid, "video_id": video_id, "start": int(c.start), "end": int(c.end), "text": c.text}
 
     db = SessionLocal()
-    new_rows: list[Chunk] = []
-
     try:
         # upsert video
         v = db.get(Video, video_id)
@@ -65,43 +77,88 @@ def ingest_video(video_id: str, title: str | None, chunks: list, namespace: str,
             db.add(v)
         elif title and not v.title:
             v.title = title
+        db.flush()
 
-        # insert chunks if not exist
-        for c in chunks:
-            cid = stable_chunk_id(video_id, int(c.start), int(c.end), c.text)
-            if db.get(Chunk, cid) is not None:
-                continue
-            row = Chunk(id=cid, video_id=video_id, start=int(c.start), end=int(c.end), text=c.text)
-            db.add(row)
-            new_rows.append(row)
+        stored = db.execute(select(Chunk.id, Chunk.start, Chunk.end).where(Chunk.video_id == video_id)).all()
+        replaced = [cid for cid, s, e in stored if (s, e) in by_span and by_span[(s, e)]["id"] != cid]
+        if replaced:
+            inc("chunks_replaced_total", len(replaced))
 
+        rows = list(by_span.values())
+        new_ids = _bulk_insert_chunks(db, rows)
         db.commit()
+    finally:
+        db.close()
+
+    if namespace and not EMBED_STORE_ENABLED and already_ingested(namespace, EMBED_MODEL, video_id):
+        rows = [r for r in rows if r["id"] in new_ids]
+    return rows, len(new_ids), replaced
+
+def _bulk_insert_chunks(db, rows: list[dict]) -> set[str]:
+    """
+    INSERT ... ON CONFLICT (video_id, start, end) DO UPDATE RETURNING id, in batches.
+    Returns the ids inserted or replaced now.
+    """
+    new_ids: set[str] = set()
+    for i in range(0, len(rows), INSERT_BATCH):
+        stmt = insert_replace(Chunk.__table__, ["video_id", "start", "end"], ["id", "text"])
+        new_ids.update(db.execute(stmt.values(rows[i:i + INSERT_BATCH]).returning(Chunk.id)).scalars())
+    return new_ids
+
+@span("embed", pipeline="ingest")
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    vecs = get_batcher(EMBED_MODEL).embed(list(enumerate(texts)))
+    return [vecs[i] for i in range(len(texts))]
 
-        if not new_rows:
-            mark_ingest(namespace, EMBED_MODEL, video_id, status="done", error=None)
-            return {"video_id": video_id, "skipped": False, "new_chunks": 0}
+@span("upsert", pipeline="ingest")
+def upsert_chunks(rows: list[dict], vecs: list, namespace: str, replaced: list[str] | None = None) -> None:
+    """Index rows into namespace; replaced (ids of chunks whose text changed) are removed first."""
+    if replaced:
+        get_store().delete(replaced, namespace=namespace)
+        if HYBRID_RETRIEVAL:
+            get_bm25().delete(replaced, namespace=namespace)
+    vectors = []
+    for r, vec in zip(rows, vecs):
+        meta = {"video_id": r["video_id"], "start": r["start"], "end": r["end"]}
+        vectors.append((r["id"], vec, meta))
 
-        emb = OpenAIEmbeddings(model=EMBED_MODEL, api_key=OPENAI_API_KEY)
-        dim = len(emb.embed_query("dimension probe"))
-        index = ensure_index(dimension=dim)
+    get_store().upsert(vectors, namespace=namespace)
+    if HYBRID_RETRIEVAL:
+        get_bm25().add(rows, namespace=namespace)
+    # cached retrieval results and answers for the namespace, and cached chunks of
+    # these videos, were built from the previous contents
+    bump_generation(namespace, sorted({r["video_id"] for r in rows}))
 
-        texts = [r.text for r in new_rows]
-        vecs = emb.embed_documents(texts)
+def flush_indexes(namespace: str) -> None:
+    """Write the index updates of upsert_chunks (BM25, local HNSW graph) to disk; call once per ingest run."""
+    get_store().flush(namespace)
+    if HYBRID_RETRIEVAL:
+        get_bm25().flush(namespace)
+
+def ingest_video(video_id: str, title: str | None, chunks: list, namespace: str, force: bool = False) -> dict:
+    """
+    Returns stats dict.
+    Dedup:
+      - If ingestion_log says done and not force -> skip entire video
+      - Chunk primary key prevents duplicates
+      - Every chunk of the video is upserted into the namespace, but only text missing
+        from the embedding store is sent to OpenAI (without the store, a forced
+        re-ingest only upserts new and replaced chunks)
+    """
+    if (not force) and already_ingested(namespace, EMBED_MODEL, video_id):
+        return {"video_id": video_id, "skipped": True, "new_chunks": 0}
 
-        vectors = []
-        for r, vec in zip(new_rows, vecs):
-            meta = {"video_id": r.video_id, "start": r.start, "end": r.end}
-            vectors.append((r.id, vec, meta))
+    try:
+        rows, new_count, replaced = insert_video_chunks(video_id, title, chunks, namespace)
 
-        B = 100
-        for i in range(0, len(vectors), B):
-            index.upsert(vectors=vectors[i:i+B], namespace=namespace)
+        if rows:
+            vecs = embed_texts([r["text"] for r in rows])
+            upsert_chunks(rows, vecs, namespace, replaced)
+            flush_indexes(namespace)
 
         mark_ingest(namespace, EMBED_MODEL, video_id, status="done", error=None)
-        return {"video_id": video_id, "skipped": False, "new_chunks": len(new_rows)}
+        return {"video_id": video_id, "skipped": False, "new_chunks": new_count}
 
     except Exception as e:
         mark_ingest(namespace, EMBED_MODEL, video_id, status="failed", error=str(e))
         raise
-    finally:
-        db.close()
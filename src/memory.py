@@ -1,6 +1,6 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from src.config import CHAT_MODEL, OPENAI_API_KEY
+from src.clients import chat_llm, async_chat_llm
+from src.metrics import span, record_usage
 
 _SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
     ("system",
@@ -15,6 +15,16 @@ _SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
      "Updated summary:")
 ])
 
+def _messages(summary: str, new_messages: list[dict]):
+    formatted = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in new_messages])
+    return _SUMMARY_PROMPT.format_messages(summary=summary or "", new_messages=formatted)
+
+def _cap(out: str, max_chars: int) -> str:
+    # hard cap (defensive)
+    if len(out) > max_chars:
+        out = out[:max_chars].rsplit(" ", 1)[0]
+    return out
+
 def update_summary(summary: str, new_messages: list[dict], max_chars: int = 1500) -> str:
     """
     new_messages: [{"role":"user"|"assistant", "content": "..."}]
@@ -22,12 +32,18 @@ def update_summary(summary: str, new_messages: list[dict], max_chars: int = 1500
     if not new_messages:
         return summary or ""
 
-    llm = ChatOpenAI(model=CHAT_MODEL, api_key=OPENAI_API_KEY, temperature=0)
+    llm = chat_llm(temperature=0)
+    with span("summary"):
+        msg = llm.invoke(_messages(summary, new_messages))
+    record_usage("summary", msg.usage_metadata)
+    return _cap(msg.content.strip(), max_chars)
 
-    formatted = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in new_messages])
-    out = llm.invoke(_SUMMARY_PROMPT.format_messages(summary=summary or "", new_messages=formatted)).content.strip()
+async def aupdate_summary(summary: str, new_messages: list[dict], max_chars: int = 1500) -> str:
+    if not new_messages:
+        return summary or ""
 
-    # hard cap (defensive)
-    if len(out) > max_chars:
-        out = out[:max_chars].rsplit(" ", 1)[0]
-    return out
+    llm = async_chat_llm(temperature=0)
+    with span("summary"):
+        msg = await llm.ainvoke(_messages(summary, new_messages))
+    record_usage("summary", msg.usage_metadata)
+    return _cap(msg.content.strip(), max_chars)
@@ -0,0 +1,249 @@
+"""
+In-process latency histograms and counters, exported in the Prometheus text format.
+
+    with span("rerank", timings):              # also sets timings["rerank_ms"]
+        ...
+    with span("embed", timings, key="embed_query_ms") as sp:
+        vec, hit = query_vector(text)
+        sp.label(cache=hit)                    # labels can be added inside the block
+
+    @span("transcript", pipeline="ingest")     # or as a decorator (sync or async)
+    def fetch(...): ...
+
+- histograms are log-bucketed (HDR-style): 16 buckets per doubling from 1 µs, so
+  p50/p95/p99 come from bucket counts with ~2% relative error and memory stays
+  constant no matter how many samples are recorded
+- labels are keyword arguments; keep them low-cardinality (stage, pipeline,
+  cache=hit|miss). Token counts are counters labelled by stage and kind, not labels.
+- add_span_hook(hook): hook.span_enter(sp) / hook.span_exit(sp) run around every
+  span on the caller's thread (per-stage CPU / allocation profiling in
+  eval/bench_pipeline.py); no hooks, no cost beyond an empty-list check
+- serve_metrics() starts a sidecar http.server thread answering GET /metrics
+  (METRICS_PORT, 0 = disabled)
+"""
+
+import math
+import time
+import asyncio
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+import numpy as np
+from src.config import METRICS_PORT
+
+PREFIX = "ytrag_"
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    MIN_MS = 1e-3
+    STEPS_PER_DOUBLING = 16
+    BUCKETS = 512   # 1 µs .. ~4 days
+
+    def __init__(self):
+        self.counts = np.zeros(self.BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, ms: float) -> None:
+        if ms <= self.MIN_MS:
+            idx = 0
+        else:
+            idx = min(int(math.log2(ms / self.MIN_MS) * self.STEPS_PER_DOUBLING), self.BUCKETS - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        # geometric midpoint of the bucket, never above the largest sample
+        return min(self.MIN_MS * 2 ** ((idx + 0.5) / self.STEPS_PER_DOUBLING), self.max)
+
+_lock = threading.Lock()
+_histograms: dict[tuple[str, tuple], Histogram] = {}
+_counters: dict[tuple[str, tuple], float] = {}
+
+_hooks: list = []
+
+def add_span_hook(hook) -> None:
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+def remove_span_hook(hook) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+def _label_value(v: Any) -> str:
+    if isinstance(v, bool):
+        return "hit" if v else "miss"
+    return str(v)
+
+def _labels(labels: dict[str, Any]) -> tuple:
+    return tuple(sorted((k, _label_value(v)) for k, v in labels.items() if v is not None))
+
+def observe(name: str, ms: float, **labels) -> None:
+    """Record a latency sample (milliseconds). bool label values become hit / miss."""
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = Histogram()
+        h.record(ms)
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+def record_usage(stage: str, usage: Optional[dict], **labels) -> None:
+    """Token counters from a LangChain usage_metadata dict (input_tokens / output_tokens)."""
+    if not usage:
+        return
+    inc("tokens_total", usage.get("input_tokens", 0), stage=stage, kind="prompt", **labels)
+    inc("tokens_total", usage.get("output_tokens", 0), stage=stage, kind="completion", **labels)
+
+class span:
+    """Times a block or function into the stage_latency_ms histogram (see module docstring)."""
+
+    def __init__(self, stage: str, timings: Optional[dict] = None, key: Optional[str] = None,
+                 name: str = "stage_latency_ms", pipeline: str = "answer", **labels):
+        self.stage = stage
+        self.timings = timings
+        self.key = key or f"{stage}_ms"
+        self.name = name
+        self.labels = {"pipeline": pipeline, **labels}
+        self.ms = 0.0
+
+    def label(self, **labels) -> None:
+        self.labels.update(labels)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def __enter__(self) -> "span":
+        for hook in _hooks:
+            hook.span_enter(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.ms = self.elapsed_ms()
+        for hook in reversed(_hooks):
+            hook.span_exit(self)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.labels["status"] = "error"
+        observe(self.name, self.ms, stage=self.stage, **self.labels)
+        if self.timings is not None:
+            self.timings[self.key] = self.ms
+
+    def _fresh(self) -> "span":
+        return span(self.stage, self.timings, self.key, self.name, **self.labels)
+
+    def __call__(self, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self._fresh():
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self._fresh():
+                return fn(*args, **kwargs)
+        return wrapper
+
+# =========================
+# Export
+# =========================
+
+def summary() -> list[dict[str, Any]]:
+    """Histograms as rows (name, labels, count, mean, p50, p95, p99, max) for the UI."""
+    with _lock:
+        items = list(_histograms.items())
+        rows = []
+        for (name, labels), h in sorted(items, key=lambda kv: kv[0]):
+            row = {"name": name, **dict(labels), "count": h.count, "mean": h.sum / h.count if h.count else 0.0}
+            for q in QUANTILES:
+                row[f"p{round(q * 100)}"] = h.quantile(q)
+            row["max"] = h.max
+            rows.append(row)
+    return rows
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+def prometheus_text() -> str:
+    """Histograms as Prometheus summaries (quantiles + _sum + _count), counters as counters."""
+    lines: list[str] = []
+    with _lock:
+        by_name: dict[str, list] = {}
+        for (name, labels), h in _histograms.items():
+            by_name.setdefault(name, []).append((labels, h))
+        for name in sorted(by_name):
+            metric = PREFIX + name
+            lines.append(f"# TYPE {metric} summary")
+            for labels, h in sorted(by_name[name], key=lambda x: x[0]):
+                for q in QUANTILES:
+                    lines.append(f"{metric}{_fmt_labels(labels, (('quantile', str(q)),))} {h.quantile(q):.6g}")
+                lines.append(f"{metric}_sum{_fmt_labels(labels)} {h.sum:.6g}")
+                lines.append(f"{metric}_count{_fmt_labels(labels)} {h.count}")
+
+        counters: dict[str, list] = {}
+        for (name, labels), value in _counters.items():
+            counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            metric = PREFIX + name
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(counters[name], key=lambda x: x[0]):
+                lines.append(f"{metric}{_fmt_labels(labels)} {value:.6g}")
+    return "\n".join(lines) + "\n"
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server: Optional[ThreadingHTTPServer] = None
+
+def serve_metrics(port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[int]:
+    """Start the /metrics sidecar once per process; returns the bound port, or None when disabled/busy."""
+    global _server
+    with _lock:
+        if _server is None:
+            if not port:
+                return None
+            try:
+                _server = ThreadingHTTPServer((host, port), _Handler)
+            except OSError:
+                # another process (e.g. a second Streamlit worker) already serves this port
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server.server_address[1]
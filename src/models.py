@@ -7,9 +7,12 @@ Dedup is enforced via:
 
 3)Ingestion log table tracks if a video already indexed for a namespace + embedding model
 
+4)Embedding store keeps vectors by (embed model, sha1 of normalized text), so identical
+  text is never embedded twice (re-chunking, force re-ingest, namespace copies)
+
 """
 
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import Column, String, Integer, Text, LargeBinary, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from src.db import Base
 
@@ -58,3 +61,14 @@ class IngestionLog(Base):
     )
 
 Index("ix_ingestion_namespace", IngestionLog.namespace)
+
+class StoredEmbedding(Base):
+    """
+    Content-addressed embedding store: packed float32 vector per (embed model, text sha).
+    """
+    __tablename__ = "embedding_store"
+    embed_model = Column(String, primary_key=True)
+    text_sha = Column(String, primary_key=True)   # sha1 of normalized chunk text
+
+    dim = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
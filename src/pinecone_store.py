@@ -1,17 +1,25 @@
 from pinecone import Pinecone, ServerlessSpec
-from src.config import PINECONE_API_KEY, PINECONE_INDEX, PINECONE_CLOUD, PINECONE_REGION
+from src.config import PINECONE_INDEX, PINECONE_CLOUD, PINECONE_REGION
+from src.clients import pinecone_client, pinecone_index
 
 def pc() -> Pinecone:
-    return Pinecone(api_key=PINECONE_API_KEY)
+    return pinecone_client()
 
-def ensure_index(dimension: int, metric: str = "cosine"):
+def ensure_index(dimension: int, metric: str = "cosine", name: str = PINECONE_INDEX):
     p = pc()
     existing = [i["name"] for i in p.list_indexes()]
-    if PINECONE_INDEX not in existing:
+    if name not in existing:
         p.create_index(
-            name=PINECONE_INDEX,
+            name=name,
             dimension=dimension,
             metric=metric,
             spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION),
         )
-    return p.Index(PINECONE_INDEX)
+    else:
+        desc = p.describe_index(name)
+        if desc.dimension and int(desc.dimension) != dimension:
+            raise ValueError(
+                f"Pinecone index '{name}' has dimension {desc.dimension}, "
+                f"but the embedding model produces {dimension}."
+            )
+    return pinecone_index(name)
@@ -0,0 +1,317 @@
+"""
+Staged, concurrent ingestion for many videos (transcript -> chunk -> insert -> embed -> upsert).
+CLI: python -m src.pipeline "<playlist url>" --namespace prodv1
+"""
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+from src.config import (
+    NAMESPACE, EMBED_MODEL, CHUNK_CHARS, CHUNK_OVERLAP_CHARS, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS,
+    INGEST_TRANSCRIPT_WORKERS, INGEST_TRANSCRIPT_RPS, INGEST_CHUNK_WORKERS, INGEST_DB_WORKERS,
+    INGEST_EMBED_WORKERS, INGEST_EMBED_RPS, INGEST_UPSERT_WORKERS, INGEST_UPSERT_RPS,
+    INGEST_EMBED_LINGER_MS,
+)
+from src.transcripts import load_or_fetch_transcript
+from src.chunking import chunk_transcript
+from src.ratelimit import RateLimiter
+from src.embed_batch import EmbeddingBatcher
+from src.ingest import already_ingested, mark_ingest, insert_video_chunks, upsert_chunks, flush_indexes
+from src.metrics import span
+
+STAGES = ("transcript", "chunk", "insert", "embed", "upsert")
+FINAL = ("done", "skipped", "failed")
+
+@dataclass
+class StageConfig:
+    workers: int
+    rate_per_s: float = 0.0   # 0 = unlimited
+
+@dataclass
+class VideoProgress:
+    video_id: str
+    stage: str                # one of STAGES while running, then done | skipped | failed
+    new_chunks: int = 0
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in FINAL
+
+def default_stages() -> dict[str, StageConfig]:
+    return {
+        "transcript": StageConfig(INGEST_TRANSCRIPT_WORKERS, INGEST_TRANSCRIPT_RPS),
+        "chunk": StageConfig(INGEST_CHUNK_WORKERS),
+        "insert": StageConfig(INGEST_DB_WORKERS),
+        "embed": StageConfig(INGEST_EMBED_WORKERS, INGEST_EMBED_RPS),
+        "upsert": StageConfig(INGEST_UPSERT_WORKERS, INGEST_UPSERT_RPS),
+    }
+
+@dataclass
+class _Job:
+    video_id: str
+    title: Optional[str]
+    t0: float = field(default_factory=time.perf_counter)
+    items: list = field(default_factory=list)
+    chunks: list = field(default_factory=list)
+    rows: list = field(default_factory=list)
+    new_chunks: int = 0
+    replaced: list = field(default_factory=list)
+    vecs: list = field(default_factory=list)
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        namespace: str = NAMESPACE,
+        chunk_chars: int = CHUNK_CHARS,
+        overlap_chars: int = CHUNK_OVERLAP_CHARS,
+        chunk_tokens: int = CHUNK_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        force: bool = False,
+        stages: Optional[dict[str, StageConfig]] = None,
+        title_fn: Callable[[str], Optional[str]] = lambda vid: f"YouTube {vid}",
+    ):
+        self.namespace = namespace
+        self.chunk_chars = chunk_chars
+        self.overlap_chars = overlap_chars
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.force = force
+        self.stages = {**default_stages(), **(stages or {})}
+        self.title_fn = title_fn
+        self.batcher = EmbeddingBatcher(model=EMBED_MODEL, rate_limiter=RateLimiter(self.stages["embed"].rate_per_s))
+        self._handlers = {
+            "transcript": self._transcript,
+            "chunk": self._chunk,
+            "insert": self._insert,
+            "upsert": self._upsert,
+        }
+
+    # ---- stage handlers: return the next stage name or a final state ----
+
+    def _transcript(self, job: _Job) -> str:
+        if (not self.force) and already_ingested(self.namespace, EMBED_MODEL, job.video_id):
+            return "skipped"
+        with span("transcript", pipeline="ingest"):
+            job.items = load_or_fetch_transcript(job.video_id)
+        return "chunk"
+
+    def _chunk(self, job: _Job) -> str:
+        with span("chunk", pipeline="ingest"):
+            job.chunks = chunk_transcript(
+                job.items, chunk_chars=self.chunk_chars, overlap_chars=self.overlap_chars,
+                chunk_tokens=self.chunk_tokens, overlap_tokens=self.overlap_tokens,
+            )
+        job.items = []
+        return "insert"
+
+    def _insert(self, job: _Job) -> str:
+        job.rows, job.new_chunks, job.replaced = insert_video_chunks(
+            job.video_id, job.title, job.chunks, self.namespace,
+        )
+        job.chunks = []
+        if not job.rows:
+            mark_ingest(self.namespace, EMBED_MODEL, job.video_id, status="done", error=None)
+            return "done"
+        return "embed"
+
+    def _upsert(self, job: _Job) -> str:
+        upsert_chunks(job.rows, job.vecs, self.namespace, job.replaced)
+        job.vecs = []
+        mark_ingest(self.namespace, EMBED_MODEL, job.video_id, status="done", error=None)
+        return "done"
+
+    # ---- orchestration ----
+
+    def run(self, video_ids: list[str]) -> Iterator[VideoProgress]:
+        """Ingest video_ids concurrently, yielding a VideoProgress per stage transition."""
+        video_ids = list(dict.fromkeys(video_ids))
+        if not video_ids:
+            return
+
+        events: queue.Queue[VideoProgress] = queue.Queue()
+        embed_q: queue.Queue[Optional[_Job]] = queue.Queue()
+        pools = {
+            name: ThreadPoolExecutor(max_workers=max(1, cfg.workers), thread_name_prefix=f"ingest-{name}")
+            for name, cfg in self.stages.items() if name != "embed"
+        }
+        limiters = {name: RateLimiter(cfg.rate_per_s) for name, cfg in self.stages.items() if name != "embed"}
+        max_group_items = self.batcher.max_inputs * self.batcher.concurrency
+
+        def emit(job: _Job, stage: str, error: Optional[str] = None) -> None:
+            events.put(VideoProgress(
+                video_id=job.video_id,
+                stage=stage,
+                new_chunks=job.new_chunks if stage == "done" else 0,
+                error=error,
+                elapsed_ms=(time.perf_counter() - job.t0) * 1000,
+            ))
+
+        def fail(job: _Job, stage: str, e: Exception) -> None:
+            if stage in ("insert", "embed", "upsert"):
+                try:
+                    mark_ingest(self.namespace, EMBED_MODEL, job.video_id, status="failed", error=str(e))
+                except Exception:
+                    pass
+            emit(job, "failed", error=f"{type(e).__name__}: {e}")
+
+        def submit(stage: str, job: _Job) -> None:
+            if stage == "embed":
+                embed_q.put(job)
+                return
+            try:
+                pools[stage].submit(work, stage, job)
+            except RuntimeError:
+                # pools are shut down: the consumer stopped iterating
+                pass
+
+        def work(stage: str, job: _Job) -> None:
+            emit(job, stage)
+            try:
+                limiters[stage].acquire()
+                nxt = self._handlers[stage](job)
+            except Exception as e:
+                fail(job, stage, e)
+                return
+            if nxt in FINAL:
+                emit(job, nxt)
+            else:
+                submit(nxt, job)
+
+        def embed_worker() -> None:
+            while True:
+                job = embed_q.get()
+                if job is None:
+                    embed_q.put(None)   # let the other embed workers see it too
+                    return
+
+                # linger briefly so chunks from several videos share requests
+                group, n_items = [job], len(job.rows)
+                deadline = time.monotonic() + INGEST_EMBED_LINGER_MS / 1000
+                while n_items < max_group_items:
+                    try:
+                        nxt = embed_q.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        embed_q.put(None)
+                        break
+                    group.append(nxt)
+                    n_items += len(nxt.rows)
+
+                for j in group:
+                    emit(j, "embed")
+                try:
+                    with span("embed", pipeline="ingest"):
+                        vecs = self.batcher.embed([(r["id"], r["text"]) for j in group for r in j.rows])
+                except Exception as e:
+                    for j in group:
+                        fail(j, "embed", e)
+                    continue
+                for j in group:
+                    j.vecs = [vecs[r["id"]] for r in j.rows]
+                    submit("upsert", j)
+
+        embed_threads = [
+            threading.Thread(target=embed_worker, name=f"ingest-embed-{i}", daemon=True)
+            for i in range(max(1, self.stages["embed"].workers))
+        ]
+        for th in embed_threads:
+            th.start()
+
+        try:
+            for vid in video_ids:
+                submit("transcript", _Job(video_id=vid, title=self.title_fn(vid)))
+
+            pending = len(video_ids)
+            while pending:
+                ev = events.get()
+                if ev.finished:
+                    pending -= 1
+                yield ev
+        finally:
+            embed_q.put(None)
+            for p in pools.values():
+                p.shutdown(wait=False, cancel_futures=True)
+            flush_indexes(self.namespace)
+
+def ingest_many(
+    video_ids: list[str],
+    namespace: str = NAMESPACE,
+    on_progress: Optional[Callable[[VideoProgress], None]] = None,
+    **kwargs,
+) -> dict:
+    """Blocking helper around IngestionPipeline.run; returns totals."""
+    stats = {"videos": len(set(video_ids)), "done": 0, "skipped": 0, "failed": 0, "new_chunks": 0, "errors": {}}
+    t0 = time.perf_counter()
+    pipeline = IngestionPipeline(namespace=namespace, **kwargs)
+    for ev in pipeline.run(video_ids):
+        if on_progress:
+            on_progress(ev)
+        if ev.finished:
+            stats[ev.stage] += 1
+            stats["new_chunks"] += ev.new_chunks
+            if ev.error:
+                stats["errors"][ev.video_id] = ev.error
+    stats["elapsed_s"] = time.perf_counter() - t0
+    stats["embedding"] = pipeline.batcher.throughput()
+    return stats
+
+def main() -> None:
+    from src.init_db import init_db
+    from src.youtube_ids import extract_video_ids
+
+    ap = argparse.ArgumentParser(description="Ingest YouTube videos / playlists into the RAG index.")
+    ap.add_argument("inputs", nargs="+", help="video URLs or a playlist URL")
+    ap.add_argument("--namespace", default=NAMESPACE)
+    ap.add_argument("--force", action="store_true", help="re-ingest videos already marked done")
+    ap.add_argument("--chunk-chars", type=int, default=CHUNK_CHARS)
+    ap.add_argument("--overlap-chars", type=int, default=CHUNK_OVERLAP_CHARS)
+    ap.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="size chunks in tokens (0 = use --chunk-chars)")
+    ap.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = ap.parse_args()
+
+    init_db()
+    video_ids: list[str] = []
+    for inp in args.inputs:
+        video_ids.extend(extract_video_ids(inp))
+    print(f"Found {len(video_ids)} videos.")
+
+    finished = 0
+
+    def report(ev: VideoProgress) -> None:
+        nonlocal finished
+        if not ev.finished:
+            print(f"  {ev.video_id}: {ev.stage}")
+            return
+        finished += 1
+        detail = ev.error or f"{ev.new_chunks} new chunks"
+        print(f"[{finished}/{len(video_ids)}] {ev.video_id}: {ev.stage} ({detail}, {ev.elapsed_ms:.0f} ms)")
+
+    stats = ingest_many(
+        video_ids,
+        namespace=args.namespace,
+        on_progress=report,
+        force=args.force,
+        chunk_chars=args.chunk_chars,
+        overlap_chars=args.overlap_chars,
+        chunk_tokens=args.chunk_tokens,
+        overlap_tokens=args.overlap_tokens,
+    )
+    print(
+        f"Done in {stats['elapsed_s']:.1f}s. New chunks: {stats['new_chunks']}. "
+        f"Skipped: {stats['skipped']}. Failed: {stats['failed']}."
+    )
+    emb = stats["embedding"]
+    print(
+        f"Embedding: {emb['chunks']} chunks / {emb['tokens']} tokens in {emb['requests']} requests "
+        f"({emb['chunks_per_s']:.1f} chunks/s, {emb['tokens_per_s']:.0f} tokens/s, {emb['retries']} retries)."
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Cached query embeddings (qembed:<model>:<sha1(text)>), shared by retrieval and
+the rewrite gate: a question embedded to decide whether to skip the rewrite is
+the same vector retrieval then searches with.
+"""
+
+from typing import Optional
+import numpy as np
+from src.config import EMBED_MODEL
+from src.clients import embeddings, async_embeddings
+from src.cache import get_vec, set_vec, aget_vec, aset_vec, sha1, single_flight, asingle_flight
+
+QEMBED_CACHE_TTL = 30 * 24 * 3600
+
+def _key(text: str, model: str) -> str:
+    return f"qembed:{model}:{sha1(text)}"
+
+def query_vector(text: str, model: str = EMBED_MODEL) -> tuple[np.ndarray, bool]:
+    """(float32 vector, cache hit); a vector computed by a concurrent caller counts as a hit."""
+    key = _key(text, model)
+    vec = get_vec(key)
+    if vec is not None:
+        return vec, True
+
+    def compute() -> np.ndarray:
+        vec = np.asarray(embeddings(model).embed_query(text), dtype=np.float32)
+        set_vec(key, vec, ttl_seconds=QEMBED_CACHE_TTL)
+        return vec
+
+    return single_flight(key, compute, lambda: get_vec(key))
+
+async def aquery_vector(text: str, model: str = EMBED_MODEL) -> tuple[np.ndarray, bool]:
+    key = _key(text, model)
+    vec = await aget_vec(key)
+    if vec is not None:
+        return vec, True
+
+    async def compute() -> np.ndarray:
+        vec = np.asarray(await async_embeddings(model).aembed_query(text), dtype=np.float32)
+        await aset_vec(key, vec, ttl_seconds=QEMBED_CACHE_TTL)
+        return vec
+
+    return await asingle_flight(key, compute, lambda: aget_vec(key))
+
+def cached_query_vector(text: str, model: str = EMBED_MODEL) -> Optional[np.ndarray]:
+    """Only what is already cached; never calls the API."""
+    return get_vec(_key(text, model))
+
+async def acached_query_vector(text: str, model: str = EMBED_MODEL) -> Optional[np.ndarray]:
+    return await aget_vec(_key(text, model))
@@ -0,0 +1,99 @@
+"""
+Process-wide registry for embedding dimensions and Pinecone index handles.
+
+Resolving the dimension used to cost an embedding call ("dimension probe") and
+ensure_index() a list_indexes() call on every question / video. Both are now
+resolved once per (embed model, index name) and the Index handle is reused.
+
+Dimension lookup order:
+1) known-model table
+2) persisted record in Redis (embdim:<model>)
+3) one real probe embedding (then persisted)
+"""
+
+import threading
+from typing import Any
+from src.config import EMBED_MODEL, PINECONE_INDEX
+from src.clients import embeddings
+from src.cache import get_json, set_json
+from src.pinecone_store import ensure_index
+
+KNOWN_EMBED_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+_lock = threading.Lock()
+_stats_lock = threading.Lock()  # not _lock: hits must not wait behind a probe
+_dims: dict[str, int] = {}
+_indexes: dict[tuple[str, str], Any] = {}
+_stats = {
+    "dim_hits": 0,
+    "dim_misses": 0,
+    "dim_probes": 0,
+    "index_hits": 0,
+    "index_misses": 0,
+}
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+def _resolve_dimension(embed_model: str) -> int:
+    dim = KNOWN_EMBED_DIMS.get(embed_model)
+    if dim:
+        return dim
+
+    key = f"embdim:{embed_model}"
+    cached = get_json(key)
+    if cached and cached.get("dim"):
+        return int(cached["dim"])
+
+    dim = len(embeddings(embed_model).embed_query("dimension probe"))
+    _count("dim_probes")
+    set_json(key, {"dim": dim}, ttl_seconds=365 * 24 * 3600)
+    return dim
+
+def embed_dimension(embed_model: str = EMBED_MODEL) -> int:
+    dim = _dims.get(embed_model)
+    if dim:
+        _count("dim_hits")
+        return dim
+
+    with _lock:
+        dim = _dims.get(embed_model)
+        if dim:
+            _count("dim_hits")
+            return dim
+        _count("dim_misses")
+        dim = _resolve_dimension(embed_model)
+        _dims[embed_model] = dim
+        return dim
+
+def get_index(embed_model: str = EMBED_MODEL, index_name: str = PINECONE_INDEX):
+    key = (embed_model, index_name)
+    index = _indexes.get(key)
+    if index is not None:
+        _count("index_hits")
+        return index
+
+    dim = embed_dimension(embed_model)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _count("index_hits")
+            return index
+        _count("index_misses")
+        index = ensure_index(dimension=dim, name=index_name)
+        _indexes[key] = index
+        return index
+
+def registry_stats() -> dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_registry() -> None:
+    with _lock:
+        _dims.clear()
+        _indexes.clear()
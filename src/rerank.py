@@ -1,7 +1,34 @@
+"""
+Rerankers pick the passages passed to generation from the retrieved candidates.
+
+- "local" (default on the local vector store): CPU only, no model call. Relevance blends cosine similarity of
+  the candidate vectors to the query vector with a BM25 score computed over the
+  candidate set; selection is MMR so near-duplicate (overlapping) chunks do not
+  crowd out other evidence. A couple of NumPy matrix ops, well under a millisecond.
+  On Pinecone the candidate vectors need a fetch round trip.
+- "llm" (default on Pinecone): the chat model picks indices from the full candidate
+  texts. Slower and paid per question.
+"""
+
 import json
-from langchain_openai import ChatOpenAI
+from typing import Optional, Protocol
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
-from src.config import CHAT_MODEL, OPENAI_API_KEY, TOP_K
+from src.config import TOP_K, RERANKER, RERANK_MMR_LAMBDA, RERANK_LEXICAL_WEIGHT, BM25_K1, BM25_B
+from src.clients import chat_llm
+from src.bm25 import tokenize
+from src.metrics import record_usage
+
+class Reranker(Protocol):
+    name: str
+    needs_vectors: bool
+
+    def rerank(self, question: str, candidates: list[str], top_k: int = TOP_K,
+               query_vec=None, vectors: Optional[list] = None) -> list[int]: ...
+
+# =========================
+# LLM
+# =========================
 
 _PROMPT = ChatPromptTemplate.from_messages([
     ("system",
@@ -12,27 +39,131 @@ _PROMPT = ChatPromptTemplate.from_messages([
      "Question:\n{question}\n\nCandidates:\n{candidates}\n\nReturn JSON only.")
 ])
 
-def rerank(question: str, candidates: list[str], top_k: int = TOP_K) -> list[int]:
-    if not candidates:
-        return []
-    if len(candidates) <= top_k:
-        return list(range(len(candidates)))
-
-    llm = ChatOpenAI(model=CHAT_MODEL, api_key=OPENAI_API_KEY, temperature=0)
-    cand_text = "\n\n".join([f"[{i}] {c}" for i, c in enumerate(candidates)])
-    msg = _PROMPT.format_messages(question=question, candidates=cand_text, top_k=top_k)
-    raw = llm.invoke(msg).content.strip()
-
-    try:
-        obj = json.loads(raw)
-        keep = obj.get("keep", [])
-        keep = [int(i) for i in keep if isinstance(i, (int, float, str))]
-        keep = [i for i in keep if 0 <= i < len(candidates)]
-        # ensure uniqueness & cap
-        out = []
-        for i in keep:
-            if i not in out:
-                out.append(i)
-        return out[:top_k] if out else list(range(min(top_k, len(candidates))))
-    except Exception:
-        return list(range(min(top_k, len(candidates))))
+class LLMReranker:
+    name = "llm"
+    needs_vectors = False
+
+    def rerank(self, question: str, candidates: list[str], top_k: int = TOP_K,
+               query_vec=None, vectors: Optional[list] = None) -> list[int]:
+        if not candidates:
+            return []
+        if len(candidates) <= top_k:
+            return list(range(len(candidates)))
+
+        llm = chat_llm(temperature=0)
+        cand_text = "\n\n".join([f"[{i}] {c}" for i, c in enumerate(candidates)])
+        msg = _PROMPT.format_messages(question=question, candidates=cand_text, top_k=top_k)
+        res = llm.invoke(msg)
+        record_usage("rerank", res.usage_metadata)
+        raw = res.content.strip()
+
+        try:
+            obj = json.loads(raw)
+            keep = obj.get("keep", [])
+            keep = [int(i) for i in keep if isinstance(i, (int, float, str))]
+            keep = [i for i in keep if 0 <= i < len(candidates)]
+            # ensure uniqueness & cap
+            out = []
+            for i in keep:
+                if i not in out:
+                    out.append(i)
+            return out[:top_k] if out else list(range(min(top_k, len(candidates))))
+        except Exception:
+            return list(range(min(top_k, len(candidates))))
+
+# =========================
+# Local (MMR + lexical)
+# =========================
+
+def _minmax(x: np.ndarray) -> np.ndarray:
+    lo, hi = float(x.min()), float(x.max())
+    return (x - lo) / (hi - lo) if hi > lo else np.zeros_like(x)
+
+def lexical_scores(question: str, candidates: list[str]) -> np.ndarray:
+    """BM25 of the question against the candidate set (idf from the candidates themselves)."""
+    terms = list(dict.fromkeys(tokenize(question)))
+    n = len(candidates)
+    if not terms or not n:
+        return np.zeros(n, dtype=np.float32)
+    col = {t: j for j, t in enumerate(terms)}
+    tf = np.zeros((n, len(terms)), dtype=np.float32)
+    dl = np.zeros(n, dtype=np.float32)
+    for i, text in enumerate(candidates):
+        tokens = tokenize(text)
+        dl[i] = len(tokens)
+        for tok in tokens:
+            j = col.get(tok)
+            if j is not None:
+                tf[i, j] += 1
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * dl / (float(dl.mean()) or 1.0))
+    return (idf * tf * (BM25_K1 + 1.0) / (tf + norm[:, None])).sum(axis=1)
+
+class LocalReranker:
+    name = "local"
+    needs_vectors = True
+
+    def __init__(self, mmr_lambda: float = RERANK_MMR_LAMBDA, lexical_weight: float = RERANK_LEXICAL_WEIGHT):
+        self.mmr_lambda = mmr_lambda
+        self.lexical_weight = lexical_weight
+
+    def rerank(self, question: str, candidates: list[str], top_k: int = TOP_K,
+               query_vec=None, vectors: Optional[list] = None) -> list[int]:
+        n = len(candidates)
+        if n <= top_k:
+            return list(range(n))
+
+        lex = _minmax(lexical_scores(question, candidates))
+
+        # candidate vectors (missing ones stay zero: no similarity, no diversity penalty)
+        V = None
+        have = np.zeros(n, dtype=bool)
+        if query_vec is not None and vectors:
+            have = np.asarray([v is not None for v in vectors], dtype=bool)
+        if have.any():
+            dim = len(next(v for v in vectors if v is not None))
+            V = np.zeros((n, dim), dtype=np.float32)
+            V[have] = np.asarray([v for v in vectors if v is not None], dtype=np.float32)
+            V /= np.maximum(np.linalg.norm(V, axis=1, keepdims=True), 1e-12)
+            q = np.asarray(query_vec, dtype=np.float32).ravel()
+            dense = V @ (q / (np.linalg.norm(q) or 1.0))
+            dense[~have] = dense[have].min()
+            rel = (1.0 - self.lexical_weight) * _minmax(dense) + self.lexical_weight * lex
+        else:
+            rel = lex
+
+        if V is None:
+            # no vectors: lexical order, retrieval order breaking ties
+            return np.argsort(-rel, kind="stable")[:top_k].tolist()
+
+        # MMR: lambda * relevance - (1 - lambda) * max similarity to what is already selected
+        G = V @ V.T
+        closest = np.zeros(n, dtype=np.float32)
+        taken = np.zeros(n, dtype=bool)
+        out: list[int] = []
+        for _ in range(top_k):
+            score = self.mmr_lambda * rel - (1.0 - self.mmr_lambda) * closest
+            score[taken] = -np.inf
+            i = int(np.argmax(score))
+            out.append(i)
+            taken[i] = True
+            np.maximum(closest, G[i], out=closest)
+        return out
+
+_rerankers: dict[str, Reranker] = {}
+
+def get_reranker(name: str = RERANKER) -> Reranker:
+    r = _rerankers.get(name)
+    if r is None:
+        if name == "local":
+            r = LocalReranker()
+        elif name == "llm":
+            r = LLMReranker()
+        else:
+            raise ValueError(f"Unknown RERANKER: {name}")
+        _rerankers[name] = r
+    return r
+
+def rerank(question: str, candidates: list[str], top_k: int = TOP_K, query_vec=None, vectors: Optional[list] = None) -> list[int]:
+    return get_reranker().rerank(question, candidates, top_k=top_k, query_vec=query_vec, vectors=vectors)
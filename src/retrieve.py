@@ -1,16 +1,24 @@
 import json
 import time
-from typing import Any
+from typing import Any, Iterator, Optional
 from sqlalchemy import select
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from src.config import OPENAI_API_KEY, EMBED_MODEL, CHAT_MODEL, FETCH_K, TOP_K, RERANK_TOP_N
-from src.cache import get_json, set_json, sha1
+from src.config import FETCH_K, TOP_K, RERANK_TOP_N, VECTOR_BACKEND, HYBRID_RETRIEVAL, HYBRID_CANDIDATES, ASYNC_RETRIEVAL, RETRIEVAL_CACHE_TTL_S, CHAT_MODEL
+from src.clients import chat_llm
+from src.cache import get_json, set_json, get_many, set_many, sha1, generation, video_generations, note_invalidations, single_flight
 from src.db import SessionLocal
 from src.models import Chunk, Video
-from src.pinecone_store import ensure_index
-from src.rewrite import rewrite_query
-from src.rerank import rerank
+from src.vector_store import get_store
+from src.bm25 import get_bm25, rrf_fuse
+from src.rewrite import rewrite_query, should_rewrite
+from src.query_embed import query_vector
+from src.rerank import get_reranker
+from src import semantic_cache
 from src.citations import ts_url
+from src.context import pack
+from src.tokens import count_tokens
+from src.metrics import span, observe, record_usage
+
+CHUNK_CACHE_TTL = 7 * 24 * 3600
 
 def _fetch_chunks_by_ids(ids: list[str]) -> list[Chunk]:
     if not ids:
@@ -23,165 +31,97 @@ def _fetch_chunks_by_ids(ids: list[str]) -> list[Chunk]:
     finally:
         db.close()
 
-def _fetch_titles(video_ids: list[str]) -> dict[str, str | None]:
-    if not video_ids:
-        return {}
-    db = SessionLocal()
-    try:
-        rows = db.execute(select(Video).where(Video.id.in_(video_ids))).scalars().all()
-        return {r.id: r.title for r in rows}
-    finally:
-        db.close()
-
-def answer_question(question: str, namespace: str, summary: str = "", recent_turns: list[dict] | None = None, video_filter: list[str] | None = None):
-
-    timings: dict[str, float] = {}
-    cache_info: dict[str, bool] = {}
-
-    t0 = time.perf_counter()
-
-    # 1) rewrite (cached)
-    # t = time.perf_counter()
-    # rewritten, hit = rewrite_query(question, namespace=namespace)
-    # timings["rewrite_ms"] = (time.perf_counter() - t) * 1000
-    # cache_info["rewrite_hit"] = hit
-    recent_turns = recent_turns or []
-    rewritten, hit = rewrite_query(question, namespace=namespace, summary=summary or "", recent_turns=recent_turns)
-
-
-    # 2) query embedding (cached)
-    t = time.perf_counter()
-    emb = OpenAIEmbeddings(model=EMBED_MODEL, api_key=OPENAI_API_KEY)
-
-    qkey = f"qembed:{EMBED_MODEL}:{sha1(rewritten)}"
-    qcached = get_json(qkey)
-    if qcached:
-        qvec = qcached["vec"]
-        cache_info["qembed_hit"] = True
-    else:
-        qvec = emb.embed_query(rewritten)
-        set_json(qkey, {"vec": qvec}, ttl_seconds=30 * 24 * 3600)
-        cache_info["qembed_hit"] = False
-
-    timings["embed_query_ms"] = (time.perf_counter() - t) * 1000
-
-    # 3) pinecone retrieve (cached short TTL)
-    t = time.perf_counter()
-    dim = len(emb.embed_query("dimension probe"))
-    index = ensure_index(dimension=dim)
-
-    flt = {"video_id": {"$in": video_filter}} if video_filter else None
-    filter_hash = sha1(json.dumps(flt, sort_keys=True)) if flt else "nofilter"
-    rkey = f"retr:{namespace}:{sha1(rewritten)}:{FETCH_K}:{filter_hash}"
-
-    rcached = get_json(rkey)
-    if rcached:
-        matches = rcached["matches"]
-        cache_info["retrieval_hit"] = True
-    else:
-        query_res = index.query(
-            vector=qvec,
-            top_k=FETCH_K,
-            include_metadata=True,
-            namespace=namespace,
-            filter=flt
-        )
-
-        # Convert QueryResponse → plain JSON-safe dict
-        matches = []
-        for m in query_res.matches:
-            matches.append({
-                "id": m.id,
-                "score": float(m.score),
-                "metadata": dict(m.metadata) if m.metadata else {}
-            })
+def _hydrate_chunks(ids: list[str]) -> tuple[list[Chunk], int]:
+    """
+    Ordered Chunk objects for ids (missing ids are dropped), plus the number of
+    cached entries dropped because their video was re-ingested.
+    Cached entries are synthesized into transient Chunk objects.
+    """
+    if not ids:
+        return [], 0
 
-        set_json(rkey, {"matches": matches}, ttl_seconds=15 * 60)
-        cache_info["retrieval_hit"] = False
+    cached = get_many([f"chunk:{cid}" for cid in ids])
+    vgens = video_generations(_cached_videos(cached))
+    by_id, misses, stale = _from_cached(ids, cached, vgens)
+    fetched = _fetch_chunks_by_ids(misses)
+    vgens.update(video_generations(_new_videos(fetched, vgens)))
+    set_many(_cache_items(fetched, vgens), ttl_seconds=CHUNK_CACHE_TTL)
+    for c in fetched:
+        by_id[c.id] = c
 
+    return [by_id[cid] for cid in ids if cid in by_id], stale
 
-    timings["retrieve_ms"] = (time.perf_counter() - t) * 1000
+def _cached_videos(cached: list) -> list[str]:
+    return list({c["video_id"] for c in cached if c and c.get("video_id") is not None})
 
-    #matches = res.get("matches", []) if isinstance(res, dict) else []
-    ids = [m["id"] for m in matches]
+def _new_videos(chunks: list[Chunk], vgens: dict[str, int]) -> list[str]:
+    return list({c.video_id for c in chunks} - vgens.keys())
 
-    # 4) fetch chunk texts from Postgres (can be cached per chunk, optional)
-    t = time.perf_counter()
-    # Simple per-chunk cache:
-    chunk_texts = []
-    chunk_objs = []
+def _from_cached(
+    ids: list[str], cached: list, vgens: dict[str, int],
+) -> tuple[dict[str, Chunk], list[str], int]:
+    """Cached chunk entries still at their video's generation; the rest are misses (stale ones counted)."""
+    by_id: dict[str, Chunk] = {}
     misses = []
-    for cid in ids:
-        ckey = f"chunk:{cid}"
-        c = get_json(ckey)
-        if c:
-            chunk_texts.append(c["text"])
+    stale = 0
+    for cid, c in zip(ids, cached):
+        if c and c.get("video_id") is not None and c.get("vgen") == vgens.get(c["video_id"]):
+            by_id[cid] = Chunk(id=cid, video_id=c["video_id"], start=c["start"], end=c["end"], text=c["text"])
         else:
+            stale += bool(c)
             misses.append(cid)
+    note_invalidations("chunk", stale)
+    return by_id, misses, stale
 
-    fetched = _fetch_chunks_by_ids(misses)
-    by_id = {c.id: c for c in fetched}
-    for cid in misses:
-        c = by_id.get(cid)
-        if c:
-            set_json(f"chunk:{cid}", {"text": c.text, "video_id": c.video_id, "start": c.start, "end": c.end}, ttl_seconds=7*24*3600)
-            chunk_texts.append(c.text)
-        else:
-            chunk_texts.append("")
-
-    # we still need ordered Chunk objects for sources; fetch all (some from cache)
-    # lightweight: fetch all missing objects from DB, and synthesize cached ones:
-    cached_objs = []
-    for cid in ids:
-        ckey = f"chunk:{cid}"
-        c = get_json(ckey)
-        if c and c.get("video_id") is not None:
-            cached_objs.append(Chunk(id=cid, video_id=c["video_id"], start=c["start"], end=c["end"], text=c["text"]))
-        else:
-            cached_objs.append(None)
+def _cache_items(chunks: list[Chunk], vgens: dict[str, int]) -> dict[str, dict]:
+    return {
+        f"chunk:{c.id}": {"text": c.text, "video_id": c.video_id, "start": c.start, "end": c.end, "vgen": vgens.get(c.video_id, 0)}
+        for c in chunks
+    }
 
-    # if any None remains, fill from DB:
-    need = [ids[i] for i, obj in enumerate(cached_objs) if obj is None]
-    fill = _fetch_chunks_by_ids(need)
-    fill_map = {c.id: c for c in fill}
-    for i, obj in enumerate(cached_objs):
-        if obj is None:
-            cached_objs[i] = fill_map.get(ids[i])
+def _current_matches(rcached: Optional[dict], gen: int) -> Optional[list]:
+    return rcached["matches"] if rcached and rcached.get("gen") == gen else None
 
-    chunk_objs = [c for c in cached_objs if c is not None]
+def _fresh_matches(rcached: Optional[dict], gen: int) -> tuple[Optional[list], bool]:
+    """(cached matches if built under namespace generation gen, whether a stale entry was found)."""
+    if not rcached:
+        return None, False
+    matches = _current_matches(rcached, gen)
+    if matches is not None:
+        return matches, False
+    note_invalidations("retr")
+    return None, True
 
-    timings["db_fetch_ms"] = (time.perf_counter() - t) * 1000
+def _retrieval_key(namespace: str, rewritten: str, flt: dict | None) -> str:
+    filter_hash = sha1(json.dumps(flt, sort_keys=True)) if flt else "nofilter"
+    return f"retr:{VECTOR_BACKEND}:{namespace}:{sha1(rewritten)}:{FETCH_K}:{filter_hash}"
 
-    # 5) rerank (LLM)
-    t = time.perf_counter()
-    candidate_strings = []
-    for c in chunk_objs:
-        candidate_strings.append(f"{c.video_id} @ {c.start}s\n{c.text}")
+def _fuse(vector_ids: list[str], lexical_ids: list[str]) -> list[str]:
+    # namespaces without a BM25 index keep the plain vector candidates
+    if not lexical_ids:
+        return vector_ids
+    return [cid for cid, _ in rrf_fuse([vector_ids, lexical_ids])][:HYBRID_CANDIDATES]
 
-    keep_idx = rerank(question, candidate_strings, top_k=min(RERANK_TOP_N, TOP_K))
+def _keep(chunk_objs: list[Chunk], keep_idx: list[int]) -> list[Chunk]:
     reranked = [chunk_objs[i] for i in keep_idx if 0 <= i < len(chunk_objs)]
-    reranked = reranked[:TOP_K] if reranked else chunk_objs[:TOP_K]
-    timings["rerank_ms"] = (time.perf_counter() - t) * 1000
+    return reranked[:TOP_K] if reranked else chunk_objs[:TOP_K]
 
-    # 6) titles
-    t = time.perf_counter()
-    vids = list({c.video_id for c in reranked})
-    titles = _fetch_titles(vids)
-    timings["titles_ms"] = (time.perf_counter() - t) * 1000
-
-    # 7) generation
-    t = time.perf_counter()
+def _build_prompt(
+    question: str, reranked: list[Chunk], titles: dict[str, str | None],
+) -> tuple[list[str], list[dict], str, dict]:
+    """(contexts, sources, prompt, stats) for the selected chunks, packed into CONTEXT_TOKEN_BUDGET."""
+    passages = pack(reranked)
     contexts = []
     sources = []
-    for c in reranked:
-        title = titles.get(c.video_id) or f"YouTube {c.video_id}"
-        contexts.append(f"[{title} | {c.video_id} | {c.start}s]\n{c.text}")
+    for p in passages:
+        title = titles.get(p.video_id) or f"YouTube {p.video_id}"
+        contexts.append(f"[{title} | {p.video_id} | {p.start}s]\n{p.text}")
         sources.append({
-            "video_id": c.video_id,
+            "video_id": p.video_id,
             "title": title,
-            "start": c.start,
-            "end": c.end,
-            "url": ts_url(c.video_id, c.start),
+            "start": p.start,
+            "end": p.end,
+            "url": ts_url(p.video_id, p.start),
         })
 
     prompt = (
@@ -192,20 +132,267 @@ def answer_question(question: str, namespace: str, summary: str = "", recent_tur
         f"Question: {question}\n\n"
         "Context:\n" + "\n\n---\n\n".join(contexts)
     )
+    stats = {
+        "prompt_tokens": count_tokens(prompt, CHAT_MODEL),
+        "context_tokens": sum(p.tokens for p in passages),
+        "used_chunks": sum(len(p.chunk_ids) for p in passages),
+    }
+    return contexts, sources, prompt, stats
+
+def _fetch_titles(video_ids: list[str]) -> dict[str, str | None]:
+    if not video_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(Video).where(Video.id.in_(video_ids))).scalars().all()
+        return {r.id: r.title for r in rows}
+    finally:
+        db.close()
+
+def _semantic_result(sem: dict, rewritten: str, timings: dict, cache_info: dict) -> dict[str, Any]:
+    return {
+        "rewritten_query": rewritten,
+        "sources": sem["sources"],
+        "timings": timings,
+        "cache": cache_info,
+        "retrieved_candidates": 0,
+        "lexical_candidates": 0,
+        "reranker": None,
+        "used_context": len(sem["contexts_used"]),
+        "contexts_used": sem["contexts_used"],
+        "answer": sem["answer"],
+        "similarity": sem["similarity"],
+    }
 
-    llm = ChatOpenAI(model=CHAT_MODEL, api_key=OPENAI_API_KEY, temperature=0)
-    answer = llm.invoke(prompt).content.strip()
-    timings["generate_ms"] = (time.perf_counter() - t) * 1000
+def _semantic_store(namespace: str, out: dict) -> None:
+    """Remember a freshly generated answer (prepare_answer's private "_semantic" entry)."""
+    flt, qvec, gen = out.pop("_semantic")
+    payload = {"answer": out["answer"], "sources": out["sources"], "contexts_used": out["contexts_used"]}
+    semantic_cache.store(namespace, flt, qvec, payload, gen)
+
+def _observe_answer(out: dict, mode: str) -> None:
+    observe("answer_latency_ms", out["timings"]["total_ms"], mode=mode, semantic=out["cache"].get("semantic_hit", False))
+
+def prepare_answer(
+    question: str,
+    namespace: str,
+    summary: str = "",
+    recent_turns: list[dict] | None = None,
+    video_filter: list[str] | None = None,
+    last_rewritten: str | None = None,
+    rewrite_gating: str | None = None,
+) -> dict[str, Any]:
+    """
+    Everything before generation: rewrite, retrieve, rerank, sources and the final prompt.
+    Returns the answer_question result without "answer" plus "prompt", or, on a
+    semantic cache hit, the cached result with "answer" and no "prompt".
+    """
 
-    timings["total_ms"] = (time.perf_counter() - t0) * 1000
+    timings: dict[str, float] = {}
+    cache_info: dict[str, Any] = {}
+
+    t0 = time.perf_counter()
+
+    # 1) rewrite (gated, cached)
+    recent_turns = recent_turns or []
+    with span("rewrite", timings) as sp:
+        needed, gate, embedded = should_rewrite(question, summary or "", recent_turns, last_rewritten=last_rewritten, mode=rewrite_gating)
+        if needed:
+            rewritten, hit = rewrite_query(question, namespace=namespace, summary=summary or "", recent_turns=recent_turns)
+        else:
+            rewritten, hit = question, False
+        sp.label(cache=hit if needed else "skipped")
+    cache_info["rewrite_hit"] = hit
+    cache_info["rewrite_skipped"] = not needed
+    cache_info["rewrite_gate"] = gate
+
+    # 2) query embedding (cached); a skipped rewrite reuses the gate's embedding of the question
+    with span("embed", timings, key="embed_query_ms") as sp:
+        qvec, cache_info["qembed_hit"] = embedded if (embedded and not needed) else query_vector(rewritten)
+        sp.label(cache=cache_info["qembed_hit"])
+
+    # 2b) semantic answer cache: a near-duplicate of an earlier (rewritten) query skips the rest.
+    # The namespace generation read here also validates the retrieval cache below.
+    flt = {"video_id": {"$in": video_filter}} if video_filter else None
+    with span("semantic", timings) as sp:
+        gen = generation(namespace)
+        cache_info["generation"] = gen
+        sem = semantic_cache.lookup(namespace, flt, qvec, gen)
+        cache_info["semantic_hit"] = sem is not None
+        sp.label(cache=cache_info["semantic_hit"])
+    if sem is not None:
+        timings["prepare_ms"] = (time.perf_counter() - t0) * 1000
+        return _semantic_result(sem, rewritten, timings, cache_info)
+
+    # 3) vector store retrieve (cached until the namespace generation moves)
+    store = get_store()
+    rkey = _retrieval_key(namespace, rewritten, flt)
+    with span("retrieve", timings) as sp:
+        matches, cache_info["retrieval_stale"] = _fresh_matches(get_json(rkey), gen)
+        if matches is not None:
+            cache_info["retrieval_hit"] = True
+        else:
+            def search() -> list:
+                # plain JSON-safe dicts from either backend
+                found = store.query(qvec, top_k=FETCH_K, namespace=namespace, filter=flt)
+                set_json(rkey, {"matches": found, "gen": gen}, ttl_seconds=RETRIEVAL_CACHE_TTL_S)
+                return found
+
+            matches, cache_info["retrieval_hit"] = single_flight(rkey, search, lambda: _current_matches(get_json(rkey), gen))
+        sp.label(cache=cache_info["retrieval_hit"])
+
+    ids = [m["id"] for m in matches]
+
+    # 3b) lexical (BM25) retrieve, fused with the vector ranking; the original question is
+    # included because it carries the exact terms users quote
+    lexical_ids: list[str] = []
+    if HYBRID_RETRIEVAL:
+        with span("lexical", timings):
+            lexical = get_bm25().search(f"{question}\n{rewritten}", top_k=FETCH_K, namespace=namespace, video_ids=video_filter)
+            lexical_ids = [cid for cid, _ in lexical]
+            ids = _fuse(ids, lexical_ids)
+
+    # 4) hydrate chunks: one cache MGET, one DB query for misses, one pipelined write-back
+    with span("hydrate", timings, key="db_fetch_ms"):
+        chunk_objs, cache_info["chunks_stale"] = _hydrate_chunks(ids)
+
+    # 5) rerank (local MMR by default; LLM when RERANKER=llm)
+    reranker = get_reranker()
+    with span("rerank", timings, reranker=reranker.name):
+        candidate_strings = []
+        for c in chunk_objs:
+            candidate_strings.append(f"{c.video_id} @ {c.start}s\n{c.text}")
+
+        cand_vecs = None
+        if reranker.needs_vectors and len(chunk_objs) > min(RERANK_TOP_N, TOP_K):
+            by_id = store.fetch([c.id for c in chunk_objs], namespace=namespace)
+            cand_vecs = [by_id.get(c.id) for c in chunk_objs]
+        keep_idx = reranker.rerank(question, candidate_strings, top_k=min(RERANK_TOP_N, TOP_K), query_vec=qvec, vectors=cand_vecs)
+        reranked = _keep(chunk_objs, keep_idx)
+
+    # 6) titles
+    with span("titles", timings):
+        vids = list({c.video_id for c in reranked})
+        titles = _fetch_titles(vids)
+
+    # 7) prompt
+    with span("prompt", timings):
+        contexts, sources, prompt, stats = _build_prompt(question, reranked, titles)
+    timings["prompt_tokens"] = stats["prompt_tokens"]
+    timings["context_tokens"] = stats["context_tokens"]
+
+    timings["prepare_ms"] = (time.perf_counter() - t0) * 1000
 
     return {
         "rewritten_query": rewritten,
-        "answer": answer,
         "sources": sources,
         "timings": timings,
         "cache": cache_info,
         "retrieved_candidates": len(ids),
-        "used_context": len(reranked),
+        "lexical_candidates": len(lexical_ids),
+        "reranker": reranker.name,
+        "used_context": stats["used_chunks"],
         "contexts_used": contexts,
+        "prompt": prompt,
+        "_semantic": (flt, qvec, gen),
     }
+
+def answer_question(
+    question: str,
+    namespace: str,
+    summary: str = "",
+    recent_turns: list[dict] | None = None,
+    video_filter: list[str] | None = None,
+    last_rewritten: str | None = None,
+    rewrite_gating: str | None = None,
+):
+    out = prepare_answer(
+        question, namespace, summary=summary, recent_turns=recent_turns, video_filter=video_filter,
+        last_rewritten=last_rewritten, rewrite_gating=rewrite_gating,
+    )
+    timings = out["timings"]
+    if "answer" in out:
+        timings["total_ms"] = timings["prepare_ms"]
+        _observe_answer(out, "sync")
+        return out
+
+    # 8) generation
+    with span("generate", timings):
+        llm = chat_llm(temperature=0)
+        msg = llm.invoke(out.pop("prompt"))
+        out["answer"] = msg.content.strip()
+    record_usage("generate", getattr(msg, "usage_metadata", None))
+
+    timings["total_ms"] = timings["prepare_ms"] + timings["generate_ms"]
+    _semantic_store(namespace, out)
+    _observe_answer(out, "sync")
+    return out
+
+def answer_question_stream(
+    question: str,
+    namespace: str,
+    summary: str = "",
+    recent_turns: list[dict] | None = None,
+    video_filter: list[str] | None = None,
+    last_rewritten: str | None = None,
+    rewrite_gating: str | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Streaming answer_question. Yields events:
+      {"type": "meta", ...}      first: the answer_question fields except "answer" (sources, timings so far, cache)
+      {"type": "token", "text"}  answer text as the model produces it
+      {"type": "done", ...}      last: "answer" plus final timings (ttft_ms, generate_ms, total_ms)
+    With ASYNC_RETRIEVAL the meta part comes from the async stage DAG (src/retrieve_async.py).
+    """
+    if ASYNC_RETRIEVAL:
+        from src import aio
+        from src.retrieve_async import prepare_answer_async
+        out = aio.run(prepare_answer_async(
+            question, namespace, summary=summary, recent_turns=recent_turns, video_filter=video_filter,
+            last_rewritten=last_rewritten, rewrite_gating=rewrite_gating,
+        ))
+    else:
+        out = prepare_answer(
+            question, namespace, summary=summary, recent_turns=recent_turns, video_filter=video_filter,
+            last_rewritten=last_rewritten, rewrite_gating=rewrite_gating,
+        )
+    timings = out["timings"]
+    if "answer" in out:
+        # semantic cache hit: the whole answer arrives as a single token
+        answer = out.pop("answer")
+        yield {"type": "meta", **out, "timings": dict(timings)}
+        timings["ttft_ms"] = timings["generate_ms"] = 0.0
+        timings["total_ms"] = timings["prepare_ms"]
+        _observe_answer(out, "stream")
+        yield {"type": "token", "text": answer}
+        yield {"type": "done", **out, "answer": answer}
+        return
+
+    prompt = out.pop("prompt")
+    semantic = out.pop("_semantic")
+    yield {"type": "meta", **out, "timings": dict(timings)}
+
+    # 8) generation (streamed)
+    llm = chat_llm(temperature=0)
+    parts: list[str] = []
+    usage = None
+    with span("generate", timings, mode="stream") as sp:
+        for chunk in llm.stream(prompt):
+            # with stream_usage the token counts arrive on a final chunk without text
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = chunk.content
+            if not text:
+                continue
+            if not parts:
+                timings["ttft_ms"] = sp.elapsed_ms()
+                observe("ttft_ms", timings["ttft_ms"])
+            parts.append(text)
+            yield {"type": "token", "text": text}
+    record_usage("generate", usage)
+    timings.setdefault("ttft_ms", timings["generate_ms"])
+
+    timings["total_ms"] = timings["prepare_ms"] + timings["generate_ms"]
+    out["answer"] = "".join(parts).strip()
+    _semantic_store(namespace, {**out, "_semantic": semantic})
+    _observe_answer(out, "stream")
+    yield {"type": "done", **out}
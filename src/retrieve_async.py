@@ -0,0 +1,405 @@
+"""
+asyncio answer_question: pipeline stages run as a DAG, each as soon as its inputs are ready.
+Every stage has a timeout (ASYNC_STAGE_TIMEOUTS); optional stages degrade instead of failing.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+from sqlalchemy import select
+from src.config import FETCH_K, TOP_K, RERANK_TOP_N, HYBRID_RETRIEVAL, ASYNC_STAGE_TIMEOUTS, RETRIEVAL_CACHE_TTL_S
+from src.clients import async_chat_llm
+from src.cache import aget_json, aset_json, aget_many, aset_many, ageneration, avideo_generations, asingle_flight
+from src.db import async_session_factory
+from src.models import Chunk, Video
+from src.vector_store import get_store
+from src.bm25 import get_bm25
+from src.rewrite import arewrite_query, ashould_rewrite
+from src.query_embed import aquery_vector
+from src.rerank import get_reranker
+from src.metrics import observe, inc, record_usage
+from src import semantic_cache
+from src.retrieve import (
+    CHUNK_CACHE_TTL,
+    _fetch_chunks_by_ids, _fetch_titles, _from_cached, _cache_items, _cached_videos, _new_videos,
+    _current_matches, _fresh_matches, _retrieval_key, _fuse, _keep, _build_prompt, _semantic_result,
+)
+
+_REQUIRED = object()
+
+# stage name -> timings key used by the sync path
+_TIMING_KEYS = {
+    "rewrite": "rewrite_ms",
+    "embed": "embed_query_ms",
+    "semantic": "semantic_ms",
+    "vector": "retrieve_ms",
+    "lexical": "lexical_ms",
+    "hydrate": "db_fetch_ms",
+    "vectors": "rerank_fetch_ms",
+    "rerank": "rerank_ms",
+    "titles": "titles_ms",
+    "prompt": "prompt_ms",
+    "generate": "generate_ms",
+}
+
+def _parse_timeouts(raw: str) -> dict[str, float]:
+    out = {}
+    for part in raw.split(","):
+        if ":" in part:
+            name, seconds = part.rsplit(":", 1)
+            out[name.strip()] = float(seconds)
+    return out
+
+STAGE_TIMEOUTS = _parse_timeouts(ASYNC_STAGE_TIMEOUTS)
+
+@dataclass
+class Finish:
+    """Stage result that ends the DAG: stages still running are cancelled, not failed."""
+    value: Any
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Awaitable[Any]]     # called with dependency results as keyword args
+    deps: tuple[str, ...] = ()
+    fallback: Any = _REQUIRED            # result on timeout/error; _REQUIRED = fail the DAG;
+                                         # a callable is called with the cause ("timeout" or the error type)
+
+def _cause(e: BaseException) -> str:
+    return "timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+
+async def run_dag(
+    stages: list[Stage], timeouts: dict[str, float],
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """
+    Run stages (listed in dependency order) as tasks; returns (results, report).
+    report: spans {name: (start_ms, end_ms)}, degraded {name: error}, finished_by (stage that
+    returned Finish, else None), critical_path, critical_path_ms, work_ms. After a Finish,
+    results hold only the stages that completed.
+    """
+    t0 = time.perf_counter()
+    tasks: dict[str, asyncio.Task] = {}
+    spans: dict[str, tuple[float, float]] = {}
+    degraded: dict[str, str] = {}
+    finish: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def run(stage: Stage) -> Any:
+        kwargs = {}
+        for d in stage.deps:
+            kwargs[d] = await tasks[d]
+            if finish.done():
+                return None
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(stage.fn(**kwargs), timeouts.get(stage.name))
+            if isinstance(result, Finish) and not finish.done():
+                finish.set_result(stage.name)
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if stage.fallback is _REQUIRED:
+                raise
+            degraded[stage.name] = f"{type(e).__name__}: {e}" if str(e) else _cause(e)
+            return stage.fallback(_cause(e)) if callable(stage.fallback) else stage.fallback
+        finally:
+            spans[stage.name] = ((start - t0) * 1000, (time.perf_counter() - t0) * 1000)
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.create_task(run(stage), name=f"stage-{stage.name}")
+    everything = asyncio.gather(*tasks.values())
+    # after a Finish, a stage failing while it is cancelled is not an error
+    everything.add_done_callback(lambda f: f.cancelled() or f.exception())
+    try:
+        await asyncio.wait({everything, finish}, return_when=asyncio.FIRST_COMPLETED)
+        finished_by = finish.result() if finish.done() else None
+        if finished_by is None:
+            everything.result()   # raises the failed stage's error
+    finally:
+        pending = [t for t in tasks.values() if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if not finish.done():
+            finish.cancel()
+    results = {
+        name: t.result() for name, t in tasks.items()
+        if t.done() and not t.cancelled() and t.exception() is None and name in spans
+    }
+
+    # walk back from the last stage through whichever dependency finished last
+    deps = {s.name: s.deps for s in stages}
+    path = [finished_by or stages[-1].name]
+    while deps[path[0]]:
+        path.insert(0, max(deps[path[0]], key=lambda d: spans[d][1]))
+
+    report = {
+        "spans": spans,
+        "degraded": degraded,
+        "finished_by": finished_by,
+        "critical_path": path,
+        "critical_path_ms": (time.perf_counter() - t0) * 1000,
+        "work_ms": sum(end - start for start, end in spans.values()),
+    }
+    return results, report
+
+# =========================
+# async data access
+# =========================
+
+async def _afetch_chunks_by_ids(ids: list[str]) -> list[Chunk]:
+    if not ids:
+        return []
+    Session = async_session_factory()
+    if Session is None:
+        return await asyncio.to_thread(_fetch_chunks_by_ids, ids)
+    async with Session() as db:
+        rows = (await db.execute(select(Chunk).where(Chunk.id.in_(ids)))).scalars().all()
+    by_id = {r.id: r for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+async def _ahydrate_chunks(ids: list[str]) -> tuple[list[Chunk], int]:
+    if not ids:
+        return [], 0
+    cached = await aget_many([f"chunk:{cid}" for cid in ids])
+    vgens = await avideo_generations(_cached_videos(cached))
+    by_id, misses, stale = _from_cached(ids, cached, vgens)
+    fetched = await _afetch_chunks_by_ids(misses)
+    vgens.update(await avideo_generations(_new_videos(fetched, vgens)))
+    await aset_many(_cache_items(fetched, vgens), ttl_seconds=CHUNK_CACHE_TTL)
+    for c in fetched:
+        by_id[c.id] = c
+    return [by_id[cid] for cid in ids if cid in by_id], stale
+
+async def _afetch_titles(video_ids: list[str]) -> dict[str, str | None]:
+    if not video_ids:
+        return {}
+    Session = async_session_factory()
+    if Session is None:
+        return await asyncio.to_thread(_fetch_titles, video_ids)
+    async with Session() as db:
+        rows = (await db.execute(select(Video).where(Video.id.in_(video_ids)))).scalars().all()
+    return {r.id: r.title for r in rows}
+
+# =========================
+# answer
+# =========================
+
+def _stages(
+    question: str, namespace: str, summary: str, recent_turns: list[dict], video_filter: Optional[list[str]],
+    last_rewritten: Optional[str], rewrite_gating: Optional[str], generate: bool,
+) -> list[Stage]:
+    store = get_store()
+    reranker = get_reranker()
+    flt = {"video_id": {"$in": video_filter}} if video_filter else None
+    top_n = min(RERANK_TOP_N, TOP_K)
+
+    async def rewrite():
+        """(rewritten, cache hit, skipped, gate reason, gate's question embedding or None)"""
+        needed, gate, embedded = await ashould_rewrite(question, summary or "", recent_turns, last_rewritten=last_rewritten, mode=rewrite_gating)
+        if not needed:
+            return question, False, True, gate, embedded
+        rewritten, hit = await arewrite_query(question, namespace=namespace, summary=summary or "", recent_turns=recent_turns)
+        return rewritten, hit, False, gate, None
+
+    async def embed(rewrite):
+        return rewrite[4] or await aquery_vector(rewrite[0])
+
+    async def semantic(rewrite, embed):
+        """namespace generation (also validates the retrieval cache); Finish((payload, gen)) on a hit"""
+        gen = await ageneration(namespace)
+        payload = semantic_cache.lookup(namespace, flt, embed[0], gen)
+        if payload is not None:
+            return Finish((payload, gen))
+        return gen
+
+    async def vector(rewrite, embed, semantic):
+        """(matches, cache hit, stale entry found)"""
+        rkey = _retrieval_key(namespace, rewrite[0], flt)
+        matches, stale = _fresh_matches(await aget_json(rkey), semantic)
+        if matches is not None:
+            return matches, True, stale
+
+        async def search() -> list:
+            found = await asyncio.to_thread(store.query, embed[0], top_k=FETCH_K, namespace=namespace, filter=flt)
+            await aset_json(rkey, {"matches": found, "gen": semantic}, ttl_seconds=RETRIEVAL_CACHE_TTL_S)
+            return found
+
+        async def read() -> Optional[list]:
+            return _current_matches(await aget_json(rkey), semantic)
+
+        matches, shared = await asingle_flight(rkey, search, read)
+        return matches, shared, stale
+
+    async def lexical(rewrite):
+        if not HYBRID_RETRIEVAL:
+            return []
+        hits = await asyncio.to_thread(
+            get_bm25().search, f"{question}\n{rewrite[0]}", top_k=FETCH_K, namespace=namespace, video_ids=video_filter,
+        )
+        return [cid for cid, _ in hits]
+
+    async def fuse(vector, lexical):
+        return _fuse([m["id"] for m in vector[0]], lexical)
+
+    async def hydrate(fuse):
+        return await _ahydrate_chunks(fuse)
+
+    async def vectors(fuse):
+        if not reranker.needs_vectors or len(fuse) <= top_n:
+            return {}
+        return await asyncio.to_thread(store.fetch, fuse, namespace=namespace)
+
+    async def rerank(hydrate, vectors, embed):
+        chunk_objs = hydrate[0]
+        candidate_strings = [f"{c.video_id} @ {c.start}s\n{c.text}" for c in chunk_objs]
+        cand_vecs = [vectors.get(c.id) for c in chunk_objs] if vectors else None
+        keep_idx = await asyncio.to_thread(
+            reranker.rerank, question, candidate_strings, top_k=top_n, query_vec=embed[0], vectors=cand_vecs,
+        )
+        return _keep(chunk_objs, keep_idx)
+
+    async def titles(hydrate):
+        # every candidate's video, so this overlaps with rerank instead of following it
+        return await _afetch_titles(list({c.video_id for c in hydrate[0]}))
+
+    async def prompt(rerank, titles):
+        return _build_prompt(question, rerank, titles)
+
+    stages = [
+        Stage("rewrite", rewrite, fallback=lambda cause: (question, False, True, cause, None)),
+        Stage("embed", embed, ("rewrite",)),
+        Stage("semantic", semantic, ("rewrite", "embed")),
+        Stage("vector", vector, ("rewrite", "embed", "semantic")),
+        Stage("lexical", lexical, ("rewrite",), fallback=[]),
+        Stage("fuse", fuse, ("vector", "lexical")),
+        Stage("hydrate", hydrate, ("fuse",)),
+        Stage("vectors", vectors, ("fuse",), fallback={}),
+        Stage("rerank", rerank, ("hydrate", "vectors", "embed")),
+        Stage("titles", titles, ("hydrate",), fallback={}),
+        Stage("prompt", prompt, ("rerank", "titles")),
+    ]
+    if generate:
+        async def generation(prompt):
+            msg = await async_chat_llm(temperature=0).ainvoke(prompt[2])
+            record_usage("generate", msg.usage_metadata)
+            return msg.content.strip()
+        stages.append(Stage("generate", generation, ("prompt",)))
+    return stages
+
+def _observe_dag(res: dict[str, Any], report: dict[str, Any], generate: bool) -> None:
+    """Stage spans into the same stage_latency_ms histograms as the sync path (pipeline=answer_async)."""
+    cache = {
+        "rewrite": "skipped" if res["rewrite"][2] else res["rewrite"][1],
+        "embed": res["embed"][1],
+        "semantic": False,
+        "vector": res["vector"][1],
+    }
+    for name, (start, end) in report["spans"].items():
+        observe("stage_latency_ms", end - start, stage=name, pipeline="answer_async", cache=cache.get(name))
+    for name in report["degraded"]:
+        inc("stage_degraded_total", stage=name)
+    observe("dag_critical_path_ms", report["critical_path_ms"])
+    if generate:
+        observe("answer_latency_ms", report["critical_path_ms"], mode="async", semantic=False)
+
+async def _answer(
+    question: str, namespace: str, summary: str, recent_turns: Optional[list[dict]], video_filter: Optional[list[str]],
+    last_rewritten: Optional[str], rewrite_gating: Optional[str], generate: bool,
+) -> dict[str, Any]:
+    recent_turns = recent_turns or []
+    stages = _stages(question, namespace, summary, recent_turns, video_filter, last_rewritten, rewrite_gating, generate)
+    res, report = await run_dag(stages, STAGE_TIMEOUTS)
+    if report["finished_by"] == "semantic":
+        payload, gen = res["semantic"].value
+        elapsed = report["critical_path_ms"]
+        rewritten, rewrite_hit, rewrite_skipped, gate, _ = res["rewrite"]
+        cache_info = {
+            "rewrite_hit": rewrite_hit,
+            "rewrite_skipped": rewrite_skipped,
+            "rewrite_gate": gate,
+            "qembed_hit": res["embed"][1],
+            "generation": gen,
+            "semantic_hit": True,
+        }
+        timings = {"prepare_ms": elapsed, "critical_path_ms": elapsed, "total_ms": elapsed}
+        if generate:
+            observe("answer_latency_ms", elapsed, mode="async", semantic=True)
+        return _semantic_result(payload, rewritten, timings, cache_info)
+
+    timings: dict[str, Any] = {}
+    for name, (start, end) in report["spans"].items():
+        if name in _TIMING_KEYS:
+            timings[_TIMING_KEYS[name]] = end - start
+    timings["critical_path_ms"] = report["critical_path_ms"]
+    timings["work_ms"] = report["work_ms"]
+    timings["prepare_ms"] = report["spans"]["prompt"][1]
+    timings["total_ms"] = report["critical_path_ms"]
+    _observe_dag(res, report, generate)
+
+    rewritten, rewrite_hit, rewrite_skipped, gate, _ = res["rewrite"]
+    contexts, sources, prompt, stats = res["prompt"]
+    timings["prompt_tokens"] = stats["prompt_tokens"]
+    timings["context_tokens"] = stats["context_tokens"]
+    out = {
+        "rewritten_query": rewritten,
+        "sources": sources,
+        "timings": timings,
+        "cache": {
+            "rewrite_hit": rewrite_hit,
+            "rewrite_skipped": rewrite_skipped,
+            "rewrite_gate": gate,
+            "qembed_hit": res["embed"][1],
+            "generation": res["semantic"],
+            "semantic_hit": False,
+            "retrieval_hit": res["vector"][1],
+            "retrieval_stale": res["vector"][2],
+            "chunks_stale": res["hydrate"][1],
+        },
+        "retrieved_candidates": len(res["fuse"]),
+        "lexical_candidates": len(res["lexical"]),
+        "reranker": get_reranker().name,
+        "used_context": stats["used_chunks"],
+        "contexts_used": contexts,
+        "critical_path": report["critical_path"],
+        "degraded": report["degraded"],
+    }
+    flt = {"video_id": {"$in": video_filter}} if video_filter else None
+    semantic = (flt, res["embed"][0], res["semantic"])
+    if generate:
+        out["answer"] = res["generate"]
+        semantic_cache.store(namespace, flt, semantic[1], {"answer": out["answer"], "sources": sources, "contexts_used": contexts}, semantic[2])
+    else:
+        out["prompt"] = prompt
+        out["_semantic"] = semantic
+    return out
+
+async def answer_question_async(
+    question: str,
+    namespace: str,
+    summary: str = "",
+    recent_turns: list[dict] | None = None,
+    video_filter: list[str] | None = None,
+    last_rewritten: str | None = None,
+    rewrite_gating: str | None = None,
+) -> dict[str, Any]:
+    """Same result as answer_question, plus critical_path / degraded and DAG timings."""
+    return await _answer(
+        question, namespace, summary, recent_turns, video_filter, last_rewritten, rewrite_gating, generate=True,
+    )
+
+async def prepare_answer_async(
+    question: str,
+    namespace: str,
+    summary: str = "",
+    recent_turns: list[dict] | None = None,
+    video_filter: list[str] | None = None,
+    last_rewritten: str | None = None,
+    rewrite_gating: str | None = None,
+) -> dict[str, Any]:
+    """Async prepare_answer: everything up to the prompt (used by the streaming path)."""
+    return await _answer(
+        question, namespace, summary, recent_turns, video_filter, last_rewritten, rewrite_gating, generate=False,
+    )
@@ -1,7 +1,31 @@
-from langchain_openai import ChatOpenAI
+"""
+Query rewrite (LLM) plus a gate that decides whether the rewrite call is needed.
+
+should_rewrite / ashould_rewrite skip the LLM when:
+- first_turn:     no summary and no earlier turns, so there is nothing to resolve
+- self_contained: no pronouns / follow-up markers and at least REWRITE_MIN_WORDS words
+- close_to_last:  (REWRITE_GATING=embedding) the raw question embedding is within
+                  REWRITE_SIM_THRESHOLD cosine of the previous rewritten query, i.e.
+                  it already states the resolved search intent
+The embedding gate embeds the raw question (one cached query_vector call, counted
+as "embedded" in rewrite_stats) and returns it, so a skipped question reuses it as
+the search vector. A previous rewritten query that is no longer in the embedding
+cache means a rewrite (reason "uncached"). Skipped questions are used verbatim
+as the search query. rewrite_stats() reports the skip rate.
+"""
+
+import re
+import threading
+from typing import Optional
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
-from src.config import CHAT_MODEL, OPENAI_API_KEY
-from src.cache import get_json, set_json, sha1
+from src.config import REWRITE_GATING, REWRITE_MIN_WORDS, REWRITE_SIM_THRESHOLD
+from src.clients import chat_llm, async_chat_llm
+from src.cache import get_json, set_json, aget_json, aset_json, sha1, single_flight, asingle_flight
+from src.query_embed import query_vector, aquery_vector, cached_query_vector, acached_query_vector
+from src.metrics import record_usage
+
+REWRITE_CACHE_TTL = 24 * 3600  # 1 day is enough for chat sessions
 
 _PROMPT = ChatPromptTemplate.from_messages([
     ("system",
@@ -15,22 +39,137 @@ _PROMPT = ChatPromptTemplate.from_messages([
      "Rewritten search query:")
 ])
 
-def rewrite_query(question: str, namespace: str, summary: str, recent_turns: list[dict]) -> tuple[str, bool]:
+def _key_and_messages(question: str, namespace: str, summary: str, recent_turns: list[dict]):
     # cache key must include memory context, otherwise follow-ups cache wrong
     recent_text = "\n".join([f"{m['role']}:{m['content']}" for m in (recent_turns or [])])
     key = f"rewrite:{namespace}:{sha1(summary or '')}:{sha1(recent_text)}:{sha1(question)}"
+    recent_fmt = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in (recent_turns or [])])
+    messages = _PROMPT.format_messages(
+        summary=summary or "",
+        recent=recent_fmt or "(none)",
+        question=question
+    )
+    return key, messages
+
+def rewrite_query(question: str, namespace: str, summary: str, recent_turns: list[dict]) -> tuple[str, bool]:
+    key, messages = _key_and_messages(question, namespace, summary, recent_turns)
     cached = get_json(key)
     if cached:
         return cached["q"], True
 
-    llm = ChatOpenAI(model=CHAT_MODEL, api_key=OPENAI_API_KEY, temperature=0)
-    recent_fmt = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in (recent_turns or [])])
+    def compute() -> str:
+        llm = chat_llm(temperature=0)
+        msg = llm.invoke(messages)
+        record_usage("rewrite", msg.usage_metadata)
+        out = msg.content.strip()
+        set_json(key, {"q": out}, ttl_seconds=REWRITE_CACHE_TTL)
+        return out
 
-    out = llm.invoke(_PROMPT.format_messages(
-        summary=summary or "",
-        recent=recent_fmt or "(none)",
-        question=question
-    )).content.strip()
+    # concurrent sessions asking the same thing share one LLM call
+    return single_flight(key, compute, lambda: (get_json(key) or {}).get("q"))
+
+async def arewrite_query(question: str, namespace: str, summary: str, recent_turns: list[dict]) -> tuple[str, bool]:
+    key, messages = _key_and_messages(question, namespace, summary, recent_turns)
+    cached = await aget_json(key)
+    if cached:
+        return cached["q"], True
+
+    async def compute() -> str:
+        llm = async_chat_llm(temperature=0)
+        msg = await llm.ainvoke(messages)
+        record_usage("rewrite", msg.usage_metadata)
+        out = msg.content.strip()
+        await aset_json(key, {"q": out}, ttl_seconds=REWRITE_CACHE_TTL)
+        return out
+
+    async def read() -> Optional[str]:
+        return ((await aget_json(key)) or {}).get("q")
+
+    return await asingle_flight(key, compute, read)
+
+# =========================
+# Gate
+# =========================
+
+_FOLLOW_UP = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|there|"
+    r"above|previous|earlier|before|same|again|more|else|other|another|instead|former|latter)\b"
+    r"|^\s*(and|but|so|also|then|what about|how about|why not|ok|okay)\b",
+    re.IGNORECASE,
+)
+
+_stats_lock = threading.Lock()
+_stats = {"checked": 0, "skipped": 0, "embedded": 0, "reasons": {}}
+
+def _record(skip: bool, reason: str, embedded: bool = False) -> None:
+    with _stats_lock:
+        _stats["checked"] += 1
+        _stats["embedded"] += int(embedded)
+        _stats["skipped"] += int(skip)
+        _stats["reasons"][reason] = _stats["reasons"].get(reason, 0) + 1
+
+def rewrite_stats() -> dict:
+    with _stats_lock:
+        checked = _stats["checked"]
+        return {**_stats, "reasons": dict(_stats["reasons"]), "skip_rate": _stats["skipped"] / checked if checked else 0.0}
+
+def _history(question: str, summary: str, recent_turns: list[dict]) -> bool:
+    turns = list(recent_turns or [])
+    # callers usually append the current question before passing recent turns
+    if turns and turns[-1].get("role") == "user" and turns[-1].get("content") == question:
+        turns = turns[:-1]
+    return bool((summary or "").strip()) or bool(turns)
+
+def _heuristic(question: str, summary: str, recent_turns: list[dict]) -> Optional[str]:
+    """Skip reason when the question clearly needs no rewrite, else None."""
+    if not _history(question, summary, recent_turns):
+        return "first_turn"
+    if len(question.split()) >= REWRITE_MIN_WORDS and not _FOLLOW_UP.search(question):
+        return "self_contained"
+    return None
+
+def _close(a: np.ndarray, b: np.ndarray) -> bool:
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b)) or 1.0
+    return float(np.dot(a, b)) / denom >= REWRITE_SIM_THRESHOLD
+
+def should_rewrite(question: str, summary: str, recent_turns: list[dict],
+                   last_rewritten: Optional[str] = None, mode: Optional[str] = None):
+    """
+    (rewrite needed, reason, question embedding or None). mode: off | heuristic | embedding
+    (default REWRITE_GATING). The embedding is query_vector(question)'s (vector, cache hit).
+    """
+    mode = mode or REWRITE_GATING
+    if mode == "off":
+        return True, "gating_off", None
+    reason = _heuristic(question, summary, recent_turns)
+    embedded = None
+    if reason is None and mode == "embedding" and last_rewritten:
+        last = cached_query_vector(last_rewritten)
+        if last is None:
+            _record(False, "uncached")
+            return True, "uncached", None
+        embedded = query_vector(question)
+        if _close(embedded[0], last):
+            reason = "close_to_last"
+    skip = reason is not None
+    _record(skip, reason or "rewrite", embedded is not None)
+    return not skip, reason or "rewrite", embedded
 
-    set_json(key, {"q": out}, ttl_seconds=24 * 3600)  # 1 day is enough for chat sessions
-    return out, False
+async def ashould_rewrite(question: str, summary: str, recent_turns: list[dict],
+                          last_rewritten: Optional[str] = None, mode: Optional[str] = None):
+    mode = mode or REWRITE_GATING
+    if mode == "off":
+        return True, "gating_off", None
+    reason = _heuristic(question, summary, recent_turns)
+    embedded = None
+    if reason is None and mode == "embedding" and last_rewritten:
+        last = await acached_query_vector(last_rewritten)
+        if last is None:
+            _record(False, "uncached")
+            return True, "uncached", None
+        embedded = await aquery_vector(question)
+        if _close(embedded[0], last):
+            reason = "close_to_last"
+    skip = reason is not None
+    _record(skip, reason or "rewrite", embedded is not None)
+    return not skip, reason or "rewrite", embedded
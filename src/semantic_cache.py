@@ -0,0 +1,177 @@
+"""
+Semantic answer cache: reuse an answer when a new query is a near-duplicate of
+one answered before.
+
+Entries (query vector, answer, sources, contexts) live in process memory,
+grouped by scope = (namespace, video filter). Each scope keeps its vectors in
+one L2-normalized float32 matrix, so a lookup is a single matrix-vector product
+plus argmax over live rows. Queries are compared by the embedding of the
+*rewritten* query, so follow-ups that only look alike ("what about it?") do
+not collide across conversations.
+
+- threshold: cosine >= SEMANTIC_CACHE_THRESHOLD
+- TTL per entry (SEMANTIC_CACHE_TTL_S) and a global LRU cap (SEMANTIC_CACHE_MAX_ENTRIES)
+- invalidation: each scope remembers the namespace generation (cache.generation,
+  read by the caller) it was filled under; ingestion bumps the generation, and
+  the next lookup drops the whole scope
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+import numpy as np
+from src.config import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_S, SEMANTIC_CACHE_MAX_ENTRIES
+from src.cache import sha1
+
+def scope_key(namespace: str, flt: Optional[dict]) -> str:
+    return f"{namespace}:{sha1(json.dumps(flt, sort_keys=True)) if flt else 'nofilter'}"
+
+class _Scope:
+    _INITIAL_CAPACITY = 64
+
+    def __init__(self, gen: int):
+        self.gen = gen
+        self.vecs: Optional[np.ndarray] = None
+        self.expires = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.payloads: list[Optional[dict]] = []
+        self.free: list[int] = []
+
+    def _grow(self, dim: int) -> None:
+        cap = len(self.alive)
+        new_cap = max(self._INITIAL_CAPACITY, cap * 2)
+        vecs = np.zeros((new_cap, dim), dtype=np.float32)
+        if self.vecs is not None:
+            vecs[:cap] = self.vecs
+        self.vecs = vecs
+        self.expires = np.concatenate([self.expires, np.zeros(new_cap - cap)])
+        self.alive = np.concatenate([self.alive, np.zeros(new_cap - cap, dtype=bool)])
+        self.payloads.extend([None] * (new_cap - cap))
+        self.free.extend(range(new_cap - 1, cap - 1, -1))
+
+    def add(self, vec: np.ndarray, payload: dict, ttl_s: float) -> int:
+        if not self.free:
+            self._grow(vec.size)
+        slot = self.free.pop()
+        self.vecs[slot] = vec
+        self.expires[slot] = time.monotonic() + ttl_s
+        self.alive[slot] = True
+        self.payloads[slot] = payload
+        return slot
+
+    def remove(self, slot: int) -> None:
+        if self.alive[slot]:
+            self.alive[slot] = False
+            self.payloads[slot] = None
+            self.free.append(slot)
+
+    def best(self, vec: np.ndarray) -> tuple[int, float]:
+        if self.vecs is None or self.vecs.shape[1] != vec.size or not self.alive.any():
+            return -1, -1.0
+        sims = self.vecs @ vec
+        sims[~self.alive] = -np.inf
+        slot = int(np.argmax(sims))
+        return slot, float(sims[slot])
+
+class SemanticCache:
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl_s: float = SEMANTIC_CACHE_TTL_S,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._scopes: dict[str, _Scope] = {}
+        self._lru: OrderedDict[tuple[str, int], None] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32).ravel()
+        return v / (np.linalg.norm(v) or 1.0)
+
+    def _scope(self, key: str, gen: int) -> Optional[_Scope]:
+        """Scope for gen; a newer gen drops the old entries, an older one (racing reader) gets None."""
+        scope = self._scopes.get(key)
+        if scope is not None and scope.gen > gen:
+            return None
+        if scope is not None and scope.gen < gen:
+            for slot in np.flatnonzero(scope.alive).tolist():
+                self._lru.pop((key, slot), None)
+            self.stats["invalidations"] += 1
+            scope = None
+        if scope is None:
+            scope = self._scopes[key] = _Scope(gen)
+        return scope
+
+    def lookup(self, key: str, gen: int, vec) -> Optional[dict]:
+        """Cached payload (plus "similarity") for the nearest prior query, or None."""
+        q = self._normalize(vec)
+        with self._lock:
+            scope = self._scope(key, gen)
+            while scope is not None:
+                slot, sim = scope.best(q)
+                if slot < 0 or sim < self.threshold:
+                    self.stats["misses"] += 1
+                    return None
+                if scope.expires[slot] > time.monotonic():
+                    break
+                # expired: drop it and look again
+                scope.remove(slot)
+                self._lru.pop((key, slot), None)
+                self.stats["expirations"] += 1
+            if scope is None:
+                self.stats["misses"] += 1
+                return None
+            self._lru.move_to_end((key, slot))
+            self.stats["hits"] += 1
+            return {**scope.payloads[slot], "similarity": sim}
+
+    def store(self, key: str, gen: int, vec, payload: dict) -> None:
+        """gen must be the generation seen at lookup time, so answers built from stale data are dropped."""
+        q = self._normalize(vec)
+        with self._lock:
+            scope = self._scope(key, gen)
+            if scope is None or (scope.vecs is not None and scope.vecs.shape[1] != q.size):
+                return
+            slot, sim = scope.best(q)
+            if slot >= 0 and sim >= 0.999:
+                # same query again: refresh in place
+                scope.remove(slot)
+                self._lru.pop((key, slot), None)
+            slot = scope.add(q, payload, self.ttl_s)
+            self._lru[(key, slot)] = None
+            self.stats["stores"] += 1
+            while len(self._lru) > self.max_entries:
+                (old_key, old_slot), _ = self._lru.popitem(last=False)
+                self._scopes[old_key].remove(old_slot)
+                self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+            self._lru.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._lru), "scopes": len(self._scopes)}
+
+_cache = SemanticCache()
+
+def semantic_cache_stats() -> dict[str, Any]:
+    return _cache.snapshot()
+
+def clear() -> None:
+    _cache.clear()
+
+def lookup(namespace: str, flt: Optional[dict], vec, gen: int) -> Optional[dict]:
+    """Cached payload for a near-duplicate query, or None; gen is the current namespace generation."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    return _cache.lookup(scope_key(namespace, flt), gen, vec)
+
+def store(namespace: str, flt: Optional[dict], vec, payload: dict, gen: int) -> None:
+    """gen as passed to lookup, so answers built from stale data are dropped."""
+    if SEMANTIC_CACHE_ENABLED:
+        _cache.store(scope_key(namespace, flt), gen, vec, payload)
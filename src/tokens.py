@@ -0,0 +1,13 @@
+from functools import lru_cache
+import tiktoken
+from src.config import EMBED_MODEL
+
+@lru_cache(maxsize=None)
+def encoder(model: str = EMBED_MODEL) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str = EMBED_MODEL) -> int:
+    return len(encoder(model).encode(text, disallowed_special=()))
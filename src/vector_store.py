@@ -0,0 +1,423 @@
+"""
+Pluggable vector store used by ingest (upsert) and retrieval (query).
+
+Backends (VECTOR_BACKEND):
+- "pinecone": the managed index, via the registry's reused Index handle
+- "local":    cosine search with NumPy over memory-mapped float32 matrices,
+              one directory per namespace under LOCAL_VECTOR_DIR; exact brute
+              force for small namespaces, an HNSW graph (src/ann.py) once a
+              namespace reaches ANN_MIN_ROWS (LOCAL_ANN=hnsw)
+
+Both return matches as plain dicts: {"id", "score", "metadata"}.
+Supported filter (same shape as Pinecone): {"video_id": {"$in": [...]}}
+(also {"$eq": v} or a bare value).
+
+Local layout per namespace:
+    header.json   {"dim": D}
+    vectors.f32   row-major float32 matrix (capacity x D), L2-normalized rows
+    meta.jsonl    append-only side table: {"row", "id", "video_id", "start", "end"}
+                  or {"row", "deleted": true}; replayed on load, last line wins
+    hnsw.npz      HNSW graph over rows (LOCAL_ANN=hnsw, large namespaces only),
+                  saved every ANN_SAVE_EVERY rows and on flush()
+Namespaces are loaded lazily on first use.
+
+Stored vectors are never rewritten: re-upserting an id with a different vector
+tombstones its row and appends a new one, so the graph never links a row by a
+vector it no longer has. The graph is extended on a copy outside the namespace
+lock and swapped in, every ANN_INSERT_BATCH rows, on flush() and (in a background
+thread) when a namespace opens with a missing or stale graph; rows not in it
+yet are searched exactly.
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Optional, Protocol
+import numpy as np
+from src.config import (
+    VECTOR_BACKEND, LOCAL_VECTOR_DIR, EMBED_MODEL, PINECONE_INDEX,
+    LOCAL_ANN, ANN_MIN_ROWS, ANN_M, ANN_EF_CONSTRUCTION, ANN_EF_SEARCH, ANN_FILTER_EXACT_MAX, ANN_INSERT_BATCH, ANN_SAVE_EVERY,
+)
+from src.ann import HNSWIndex
+
+Vector = tuple[str, Any, dict]
+
+class VectorStore(Protocol):
+    name: str
+
+    def upsert(self, vectors: list[Vector], namespace: str) -> None: ...
+
+    def query(self, vector, top_k: int, namespace: str, filter: Optional[dict] = None) -> list[dict]: ...
+
+    def delete(self, ids: list[str], namespace: str) -> None: ...
+
+    def fetch(self, ids: list[str], namespace: str) -> dict[str, np.ndarray]: ...
+
+    def flush(self, namespace: str) -> None: ...
+
+def _video_filter(flt: Optional[dict]) -> Optional[list[str]]:
+    """Allowed video ids from a Pinecone-style filter, or None for no filter."""
+    if not flt:
+        return None
+    unsupported = set(flt) - {"video_id"}
+    if unsupported:
+        raise ValueError(f"Unsupported filter fields for local vector store: {sorted(unsupported)}")
+    cond = flt["video_id"]
+    if isinstance(cond, dict):
+        if "$in" in cond:
+            return list(cond["$in"])
+        if "$eq" in cond:
+            return [cond["$eq"]]
+        raise ValueError(f"Unsupported video_id filter: {cond}")
+    return [cond]
+
+# =========================
+# Pinecone
+# =========================
+
+class PineconeStore:
+    name = "pinecone"
+
+    def __init__(self, embed_model: str = EMBED_MODEL, index_name: str = PINECONE_INDEX):
+        self.embed_model = embed_model
+        self.index_name = index_name
+
+    def _index(self):
+        from src.registry import get_index
+        return get_index(self.embed_model, self.index_name)
+
+    def upsert(self, vectors: list[Vector], namespace: str) -> None:
+        index = self._index()
+        B = 100
+        for i in range(0, len(vectors), B):
+            batch = [(vid, np.asarray(vec, dtype=np.float32).tolist(), meta) for vid, vec, meta in vectors[i:i+B]]
+            index.upsert(vectors=batch, namespace=namespace)
+
+    def query(self, vector, top_k: int, namespace: str, filter: Optional[dict] = None) -> list[dict]:
+        res = self._index().query(
+            vector=np.asarray(vector, dtype=np.float32).tolist(),
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace,
+            filter=filter,
+        )
+        return [
+            {"id": m.id, "score": float(m.score), "metadata": dict(m.metadata) if m.metadata else {}}
+            for m in res.matches
+        ]
+
+    def delete(self, ids: list[str], namespace: str) -> None:
+        if ids:
+            self._index().delete(ids=ids, namespace=namespace)
+
+    def fetch(self, ids: list[str], namespace: str) -> dict[str, np.ndarray]:
+        if not ids:
+            return {}
+        res = self._index().fetch(ids=ids, namespace=namespace)
+        return {vid: np.asarray(v.values, dtype=np.float32) for vid, v in res.vectors.items()}
+
+    def flush(self, namespace: str) -> None:
+        pass
+
+# =========================
+# Local (NumPy + memmap)
+# =========================
+
+_SAME_VECTOR = 1.0 - 1e-6   # cosine above which a re-upserted vector counts as unchanged
+
+def _top(rows: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    k = min(k, rows.size)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top]
+
+class _LocalNamespace:
+    _INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.capacity = 0
+        self.vecs: Optional[np.memmap] = None
+        self.ids: list[str] = []
+        self.row_of: dict[str, int] = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.video_ids: list[str] = []
+        self.code_of: dict[str, int] = {}
+        self.ann: Optional[HNSWIndex] = None
+        self.ann_lock = threading.Lock()   # one graph update at a time, outside self.lock
+        self.ann_saved = 0                 # graph size in hnsw.npz
+        self._load()
+
+    # ---- persistence ----
+
+    def _load(self) -> None:
+        header = self.path / "header.json"
+        if not header.exists():
+            return
+        self.dim = int(json.loads(header.read_text(encoding="utf-8"))["dim"])
+        lines = []
+        meta = self.path / "meta.jsonl"
+        if meta.exists():
+            with meta.open(encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+        self.count = 1 + max((m["row"] for m in lines), default=-1)
+        f = self.path / "vectors.f32"
+        file_rows = f.stat().st_size // (self.dim * 4) if f.exists() else 0
+        self._open(max(self.count, file_rows, self._INITIAL_CAPACITY))
+        self.ids = [""] * self.count
+        for m in lines:
+            self._apply_meta(m)
+
+        if LOCAL_ANN == "hnsw" and (self.path / "hnsw.npz").exists():
+            self.ann = HNSWIndex.load(self.path / "hnsw.npz")
+            self.ann_saved = self.ann.size
+        behind = self.ann.size < self.count if self.ann is not None else self.count >= ANN_MIN_ROWS
+        if LOCAL_ANN == "hnsw" and behind:
+            # queries search exactly until the graph catches up
+            threading.Thread(target=self._sync_ann, name=f"hnsw-{self.path.name}", daemon=True).start()
+
+    def _sync_ann(self, min_new: int = 1) -> None:
+        """
+        Build the graph once the namespace is large enough, then insert new rows once
+        at least min_new are missing. Call without self.lock: the rows are added to a
+        copy that is then swapped in.
+        """
+        if LOCAL_ANN != "hnsw":
+            return
+        with self.ann_lock:
+            while True:
+                with self.lock:
+                    count, vecs, ann = self.count, self.vecs, self.ann
+                if (ann is None and count < ANN_MIN_ROWS) or (ann is not None and count - ann.size < min_new):
+                    return
+                graph = ann.copy() if ann is not None else HNSWIndex(M=ANN_M, ef_construction=ANN_EF_CONSTRUCTION)
+                # rows below count are written and never change
+                graph.add(vecs, range(graph.size, count))
+                with self.lock:
+                    self.ann = graph
+                if graph.size - self.ann_saved >= ANN_SAVE_EVERY:
+                    self._save_ann(graph)
+
+    def _save_ann(self, graph: HNSWIndex) -> None:
+        graph.save(self.path / "hnsw.npz")
+        self.ann_saved = graph.size
+
+    def flush(self) -> None:
+        """Add every pending row to the graph and write it if it changed since the last save."""
+        self._sync_ann()
+        with self.ann_lock:
+            if self.ann is not None and self.ann.size > self.ann_saved:
+                self._save_ann(self.ann)
+
+    def _open(self, capacity: int) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        f = self.path / "vectors.f32"
+        size = capacity * self.dim * 4
+        with open(f, "ab") as fh:
+            if fh.tell() < size:
+                fh.truncate(size)
+        if self.vecs is not None:
+            self.vecs.flush()
+        self.vecs = np.memmap(f, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        for attr, dtype in (("alive", bool), ("codes", np.int32), ("starts", np.int64), ("ends", np.int64)):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=dtype)
+            new[:len(old)] = old[:capacity]
+            setattr(self, attr, new)
+        self.capacity = capacity
+
+    def _apply_meta(self, m: dict) -> None:
+        row = m["row"]
+        if m.get("deleted"):
+            self.alive[row] = False
+            self.row_of.pop(self.ids[row], None)
+            return
+        self.ids[row] = m["id"]
+        self.row_of[m["id"]] = row
+        self.alive[row] = True
+        self.codes[row] = self._code(m.get("video_id") or "")
+        self.starts[row] = int(m.get("start") or 0)
+        self.ends[row] = int(m.get("end") or 0)
+
+    def _code(self, video_id: str) -> int:
+        code = self.code_of.get(video_id)
+        if code is None:
+            code = self.code_of[video_id] = len(self.video_ids)
+            self.video_ids.append(video_id)
+        return code
+
+    def _append_meta(self, lines: list[dict]) -> None:
+        with (self.path / "meta.jsonl").open("a", encoding="utf-8") as f:
+            for m in lines:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+
+    # ---- operations ----
+
+    def upsert(self, vectors: list[Vector]) -> None:
+        if not vectors:
+            return
+        with self.lock:
+            mat = np.asarray([v for _, v, _ in vectors], dtype=np.float32)
+            if self.dim is None:
+                self.dim = int(mat.shape[1])
+                self.path.mkdir(parents=True, exist_ok=True)
+                (self.path / "header.json").write_text(json.dumps({"dim": self.dim}), encoding="utf-8")
+                self._open(self._INITIAL_CAPACITY)
+            if mat.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {mat.shape[1]} does not match namespace dimension {self.dim}")
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            mat /= np.where(norms > 0, norms, 1.0)
+
+            lines = []
+            for (vid, _, meta), vec in zip(vectors, mat):
+                row = self.row_of.get(vid)
+                if row is not None and float(self.vecs[row] @ vec) < _SAME_VECTOR:
+                    # a changed vector gets a new row; rows are never rewritten
+                    m = {"row": row, "deleted": True}
+                    self._apply_meta(m)
+                    lines.append(m)
+                    row = None
+                if row is None:
+                    row = self.count
+                    if row >= self.capacity:
+                        self._open(self.capacity * 2)
+                    self.vecs[row] = vec
+                    self.count += 1
+                    self.ids.append(vid)
+                m = {"row": row, "id": vid, "video_id": meta.get("video_id"), "start": meta.get("start"), "end": meta.get("end")}
+                self._apply_meta(m)
+                lines.append(m)
+            self.vecs.flush()
+            self._append_meta(lines)
+        self._sync_ann(ANN_INSERT_BATCH)
+
+    def delete(self, ids: list[str]) -> None:
+        with self.lock:
+            lines = []
+            for vid in ids:
+                row = self.row_of.get(vid)
+                if row is not None:
+                    m = {"row": row, "deleted": True}
+                    self._apply_meta(m)
+                    lines.append(m)
+            if lines:
+                self._append_meta(lines)
+
+    def fetch(self, ids: list[str]) -> dict[str, np.ndarray]:
+        """Stored (L2-normalized) vectors for ids that exist; copies, safe to keep."""
+        with self.lock:
+            found = [(vid, self.row_of[vid]) for vid in ids if vid in self.row_of]
+            if not found:
+                return {}
+            mat = np.array(self.vecs[[row for _, row in found]])
+            return {vid: mat[i] for i, (vid, _) in enumerate(found)}
+
+    def candidate_mask(self, video_ids: Optional[list[str]]) -> np.ndarray:
+        mask = self.alive[:self.count].copy()
+        if video_ids is not None:
+            wanted = [self.code_of[v] for v in video_ids if v in self.code_of]
+            mask &= np.isin(self.codes[:self.count], np.asarray(wanted, dtype=np.int32))
+        return mask
+
+    def matches(self, rows: np.ndarray, scores: np.ndarray) -> list[dict]:
+        return [
+            {
+                "id": self.ids[r],
+                "score": float(s),
+                "metadata": {
+                    "video_id": self.video_ids[self.codes[r]],
+                    "start": int(self.starts[r]),
+                    "end": int(self.ends[r]),
+                },
+            }
+            for r, s in zip(rows.tolist(), scores.tolist())
+        ]
+
+    def query(self, vector, top_k: int, video_ids: Optional[list[str]]) -> list[dict]:
+        # snapshot under the lock, score without it: rows below count are append-only
+        # and never rewritten, a swapped-out memmap or graph stays valid for its rows,
+        # and the mask is a copy
+        with self.lock:
+            if self.dim is None or self.count == 0:
+                return []
+            count, vecs, ann = self.count, self.vecs, self.ann
+            mask = self.candidate_mask(video_ids)
+
+        q = np.asarray(vector, dtype=np.float32).ravel()
+        q = q / (np.linalg.norm(q) or 1.0)
+        rows = np.flatnonzero(mask)
+        if rows.size == 0:
+            return []
+
+        if ann is not None and rows.size > ANN_FILTER_EXACT_MAX:
+            valid = None if rows.size == count else mask
+            top_rows, top_scores = ann.search(vecs, q, top_k, ef=ANN_EF_SEARCH, valid=valid)
+            # rows the graph does not have yet are scored exactly
+            tail = rows[rows >= ann.size]
+            if tail.size:
+                top_rows, top_scores = _top(
+                    np.concatenate([top_rows, tail]), np.concatenate([top_scores, vecs[tail] @ q]), top_k,
+                )
+        elif rows.size == count:
+            top_rows, top_scores = _top(rows, vecs[:count] @ q, top_k)
+        else:
+            top_rows, top_scores = _top(rows, vecs[rows] @ q, top_k)
+        with self.lock:
+            return self.matches(top_rows, top_scores)
+
+class LocalStore:
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_VECTOR_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._namespaces: dict[str, _LocalNamespace] = {}
+
+    def _ns(self, namespace: str) -> _LocalNamespace:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                ns = self._namespaces[namespace] = _LocalNamespace(self.root / namespace)
+            return ns
+
+    def upsert(self, vectors: list[Vector], namespace: str) -> None:
+        self._ns(namespace).upsert(vectors)
+
+    def query(self, vector, top_k: int, namespace: str, filter: Optional[dict] = None) -> list[dict]:
+        return self._ns(namespace).query(vector, top_k, _video_filter(filter))
+
+    def delete(self, ids: list[str], namespace: str) -> None:
+        self._ns(namespace).delete(ids)
+
+    def fetch(self, ids: list[str], namespace: str) -> dict[str, np.ndarray]:
+        return self._ns(namespace).fetch(ids)
+
+    def flush(self, namespace: str) -> None:
+        self._ns(namespace).flush()
+
+_stores: dict[str, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(backend: str = VECTOR_BACKEND) -> VectorStore:
+    with _stores_lock:
+        store = _stores.get(backend)
+        if store is None:
+            if backend == "pinecone":
+                store = PineconeStore()
+            elif backend == "local":
+                store = LocalStore()
+            else:
+                raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+            _stores[backend] = store
+        return store
+
+def set_store(store: VectorStore, backend: str = VECTOR_BACKEND) -> None:
+    """Replace the shared store for backend (e.g. a LocalStore wrapped with injected latency)."""
+    with _stores_lock:
+        _stores[backend] = store